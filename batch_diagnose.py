@@ -0,0 +1,349 @@
+# ----------------------------------------------------------------------
+# วินิจฉัยรูปจำนวนมากแบบ offline (ไม่ผ่าน LINE webhook)
+# ----------------------------------------------------------------------
+# ใช้สำหรับให้คะแนนรูปเก่าใหม่หลังเปลี่ยนโมเดล หรือตรวจสอบ record ใน collection diagnoses ย้อนหลัง
+# ใช้ preprocessing, class_names_map และ class_details ชุดเดียวกับ webhook
+#   - input: directory (ค้นหารูปในทุก directory ย่อย), ไฟล์ .tar/.tar.gz/.tgz/.zip หรือ manifest
+#     (.txt หนึ่ง path ต่อบรรทัด, .csv ที่มีคอลัมน์ path หรือ .jsonl ที่มี key path
+#     ทั้งสองแบบหลังใส่คอลัมน์/key id ได้ เช่น document id ของ diagnoses) path สัมพัทธ์อิงกับ directory ของ manifest
+#   - decode + resize รูปใน process แยก (--decode-workers) แล้วส่ง pixel ให้ process หลัก
+#     รวมเป็น batch ละ --batch-size รูปก่อนเรียก interpreter
+#   - เขียนผลทีละ batch เป็น JSONL หรือ CSV พร้อม top-k class และค่าความมั่นใจ
+#   - --resume อ่าน output เดิม (ตัดบรรทัดสุดท้ายที่เขียนไม่ครบทิ้ง) แล้วข้ามรูปที่มีผลแล้ว
+#     รูปที่ decode ไม่ได้ถูกบันทึกพร้อม error และนับว่าทำแล้วเช่นกัน
+#
+# วิธีใช้ (รันจาก root ของ repo):
+#   python batch_diagnose.py archive/2024/ --output rescored.jsonl
+#   python batch_diagnose.py images.tar.gz --output rescored.csv --top-k 5 --batch-size 32
+#   python batch_diagnose.py audit_manifest.csv --output audit.jsonl --resume
+# เลือกโมเดลด้วย --model/--variant (ค่าเริ่มต้นตาม MODEL_VARIANT เหมือน webhook)
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import model_loader
+from class_catalog import class_details, class_names_map
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+ARCHIVE_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.zip')
+OUTPUT_FORMATS = ('jsonl', 'csv')
+PROGRESS_INTERVAL = 10.0 # วินาที
+
+
+def _is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def _iter_directory(root):
+    for directory, subdirs, names in os.walk(root):
+        subdirs.sort()
+        for name in sorted(names):
+            if _is_image(name):
+                path = os.path.join(directory, name)
+                yield os.path.relpath(path, root), path
+
+
+def _iter_tar(path, skip):
+    # อ่านตามลำดับใน archive (tar.gz ค้นหาแบบสุ่มไม่ได้) แล้วส่ง bytes ของรูปให้ process decode
+    with tarfile.open(path, 'r:*') as archive:
+        for member in archive:
+            if member.isfile() and _is_image(member.name) and member.name not in skip:
+                yield member.name, archive.extractfile(member).read()
+
+
+def _zip_members(archive):
+    return [info for info in archive.infolist() if not info.is_dir() and _is_image(info.filename)]
+
+
+def _iter_zip(path, skip):
+    with zipfile.ZipFile(path) as archive:
+        for info in _zip_members(archive):
+            if info.filename not in skip:
+                yield info.filename, archive.read(info)
+
+
+def _iter_manifest(path):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            rows = csv.DictReader(f)
+        elif path.endswith('.jsonl'):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = ({'path': line.strip()} for line in f if line.strip() and not line.startswith('#'))
+        for row in rows:
+            image_path = os.path.join(base, os.path.expanduser(row['path']))
+            yield str(row.get('id') or row['path']), image_path
+
+
+def iter_sources(source, skip=frozenset()):
+    """คืน (key, path หรือ bytes) ของรูปใน input ที่ key ไม่อยู่ใน skip (key ใช้ระบุรูปใน output และตอน resume)."""
+    if os.path.isdir(source):
+        items = _iter_directory(source)
+    elif source.lower().endswith('.zip'):
+        return _iter_zip(source, skip)
+    elif source.lower().endswith(ARCHIVE_EXTENSIONS):
+        return _iter_tar(source, skip)
+    else:
+        items = _iter_manifest(source)
+    return ((key, path) for key, path in items if key not in skip)
+
+
+def count_sources(source, skip=frozenset()):
+    """จำนวนรูปที่ต้องทำ (None สำหรับ tar เพราะต้องอ่านทั้ง archive เพื่อนับ)."""
+    if os.path.isdir(source):
+        keys = (key for key, _ in _iter_directory(source))
+    elif source.lower().endswith('.zip'):
+        with zipfile.ZipFile(source) as archive:
+            keys = [info.filename for info in _zip_members(archive)]
+    elif source.lower().endswith(ARCHIVE_EXTENSIONS):
+        return None
+    else:
+        keys = (key for key, _ in _iter_manifest(source))
+    return sum(1 for key in keys if key not in skip)
+
+
+def decode_image(task):
+    """ทำงานใน process decode: คืน (key, pixel uint8 (H, W, 3) หรือ None, ข้อความ error หรือ None)."""
+    import numpy as np
+
+    from preprocessing import load_image
+
+    key, source, size = task
+    try:
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+        return key, np.asarray(load_image(source, size)), None
+    except Exception as e:
+        return key, None, f"{e.__class__.__name__}: {e}"
+
+
+def decode_stream(tasks, workers, window):
+    """decode รูปแบบขนานโดยคงลำดับเดิม และมีงานค้างไม่เกิน window (ไม่อ่าน archive ล่วงหน้าจนหน่วยความจำเต็ม)."""
+    if workers <= 0:
+        for task in tasks:
+            yield decode_image(task)
+        return
+    # ใช้ spawn เพราะ process หลักมี thread ของ interpreter อยู่แล้ว (fork ไม่ปลอดภัย)
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(decode_image, task))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class ResultWriter:
+    """เขียนผลทีละแถวเป็น JSONL หรือ CSV (append ต่อจากไฟล์เดิมได้)."""
+
+    def __init__(self, path, fmt, top_k, with_details=False):
+        self.path = path
+        self.fmt = fmt
+        self.top_k = top_k
+        self.with_details = with_details
+        self.fields = ['key', 'predicted_class_english', 'predicted_class_thai', 'confidence']
+        for rank in range(2, top_k + 1):
+            self.fields += [f'top{rank}_class_english', f'top{rank}_confidence']
+        if with_details:
+            self.fields += ['treatment', 'avoid', 'severe_warning']
+        self.fields += ['model', 'error']
+        self._file = None
+        self._csv = None
+
+    def open(self, append):
+        exists = append and os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        self._file = open(self.path, 'a' if append else 'w', encoding='utf-8', newline='')
+        if self.fmt == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=self.fields)
+            if not exists:
+                self._csv.writeheader()
+        return self
+
+    def write(self, row):
+        if self.fmt == 'csv':
+            flat = {name: row.get(name) for name in self.fields}
+            for rank, item in enumerate(row.get('top_k', [])[1:], start=2):
+                flat[f'top{rank}_class_english'] = item['class_english']
+                flat[f'top{rank}_confidence'] = item['confidence']
+            flat.update(row.get('details') or {})
+            self._csv.writerow(flat)
+        else:
+            self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def completed_keys(path, fmt):
+    """อ่าน key ที่มีผลแล้วจาก output เดิม และตัดแถวสุดท้ายที่เขียนไม่ครบ (ถูกหยุดกลางคัน) ทิ้ง."""
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+            log.warning(f"Dropped a partially written row at the end of {path}")
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            return {row['key'] for row in csv.DictReader(f)}
+        return {json.loads(line)['key'] for line in f if line.strip()}
+
+
+def build_row(key, predictions, top_k, model_name, with_details):
+    import numpy as np
+
+    order = np.argsort(predictions)[::-1][:top_k]
+    ranked = [
+        {
+            'class_english': class_names_map[i]['english'],
+            'class_thai': class_names_map[i]['thai'],
+            'confidence': round(float(predictions[i]), 6),
+        }
+        for i in order
+    ]
+    row = {
+        'key': key,
+        'predicted_class_english': ranked[0]['class_english'],
+        'predicted_class_thai': ranked[0]['class_thai'],
+        'confidence': ranked[0]['confidence'],
+        'top_k': ranked,
+        'model': model_name,
+    }
+    if with_details:
+        row['details'] = class_details.get(ranked[0]['class_english'], {})
+    return row
+
+
+class Progress:
+    """log จำนวนรูปที่ทำแล้ว ความเร็ว (รูป/วินาที) และเวลาที่เหลือโดยประมาณ ทุก interval วินาที."""
+
+    def __init__(self, total, interval=PROGRESS_INTERVAL):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.errors = 0
+        self._started = self._last = time.perf_counter()
+
+    def update(self, done, errors=0, force=False):
+        self.done += done
+        self.errors += errors
+        now = time.perf_counter()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        rate = self.done / (now - self._started) if now > self._started else 0.0
+        if self.total:
+            remaining = (self.total - self.done) / rate if rate else float('inf')
+            log.info(f"{self.done}/{self.total} images ({self.done / self.total:.1%}), {rate:.1f} img/s, "
+                     f"{self.errors} errors, ETA {remaining / 60:.1f} min")
+        else:
+            log.info(f"{self.done} images, {rate:.1f} img/s, {self.errors} errors")
+
+    def rate(self):
+        elapsed = time.perf_counter() - self._started
+        return self.done / elapsed if elapsed else 0.0
+
+
+def run(args):
+    import numpy as np
+
+    from batch_scheduler import InferenceScheduler
+    from interpreter_pool import InterpreterPool
+    from preprocessing import to_model_input
+
+    model_path = args.model or model_loader.resolve_model_path(model_loader.DEFAULT_MODEL_PATH, args.variant)
+    done = completed_keys(args.output, args.format) if args.resume else set()
+    if done:
+        log.info(f"Resuming: {len(done)} images already in {args.output}")
+    total = None if args.no_count else count_sources(args.source, done)
+
+    pool = InterpreterPool(model_path, size=1, num_threads=args.threads, delegate=args.delegate)
+    scheduler = InferenceScheduler(pool, max_batch_size=args.batch_size, stats_log_every=0)
+    input_detail = pool.input_details[0]
+    height, width = (int(v) for v in input_detail['shape'][1:3])
+    batch = np.empty((args.batch_size, height, width, 3), dtype=input_detail['dtype'])
+    model_name = os.path.basename(model_path)
+
+    tasks = ((key, source, (width, height)) for key, source in iter_sources(args.source, done))
+    writer = ResultWriter(args.output, args.format, args.top_k, args.with_details).open(append=args.resume)
+    progress = Progress(total)
+    keys, failed = [], []
+
+    def flush_batch():
+        if keys:
+            predictions = scheduler.predict_batch(batch[:len(keys)])
+            for key, row_predictions in zip(keys, predictions):
+                writer.write(build_row(key, row_predictions, args.top_k, model_name, args.with_details))
+        for key, error in failed:
+            writer.write({'key': key, 'top_k': [], 'model': model_name, 'error': error})
+        writer.flush()
+        progress.update(len(keys) + len(failed), len(failed))
+        keys.clear()
+        failed.clear()
+
+    try:
+        for key, pixels, error in decode_stream(tasks, args.decode_workers, window=args.batch_size * 4):
+            if error is not None:
+                failed.append((key, error))
+                log.warning(f"Could not decode {key}: {error}")
+            else:
+                to_model_input(pixels, input_detail, out=batch[len(keys)])
+                keys.append(key)
+            if len(keys) == args.batch_size:
+                flush_batch()
+        flush_batch()
+    finally:
+        writer.close()
+
+    progress.update(0, force=True)
+    log.info(f"Wrote {progress.done} results to {args.output} ({progress.rate():.1f} img/s, "
+             f"{progress.errors} errors)")
+    log.info(scheduler.format_stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Diagnose many images offline with the skin diagnosis model')
+    parser.add_argument('source', help='directory, ไฟล์ .tar/.tar.gz/.tgz/.zip หรือ manifest (.txt/.csv/.jsonl)')
+    parser.add_argument('--output', required=True, help='ไฟล์ผลลัพธ์ (.jsonl หรือ .csv)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, help='ค่าเริ่มต้นตามนามสกุลของ --output')
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--decode-workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help='จำนวน process สำหรับ decode รูป (0 = decode ใน process หลัก)')
+    parser.add_argument('--model', help='path ของไฟล์ .tflite (ค่าเริ่มต้นตาม MODEL_VARIANT)')
+    parser.add_argument('--variant', choices=model_loader.MODEL_VARIANTS)
+    parser.add_argument('--threads', type=int, help='จำนวน thread ของ interpreter')
+    parser.add_argument('--delegate', help='default/none/path ของ .so (xnnpack คือ default) เหมือน INTERPRETER_DELEGATE')
+    parser.add_argument('--with-details', action='store_true', help='ใส่ treatment/avoid/severe_warning ของ class อันดับ 1')
+    parser.add_argument('--resume', action='store_true', help='ข้ามรูปที่มีผลอยู่แล้วใน --output และเขียนต่อท้าย')
+    parser.add_argument('--no-count', action='store_true', help='ไม่นับจำนวนรูปทั้งหมดก่อนเริ่ม (ไม่แสดง ETA)')
+    args = parser.parse_args()
+
+    args.format = args.format or ('csv' if args.output.lower().endswith('.csv') else 'jsonl')
+    args.top_k = max(1, min(args.top_k, len(class_names_map)))
+    args.batch_size = max(1, args.batch_size)
+    if not os.path.exists(args.source):
+        raise SystemExit(f"Input not found: {args.source}")
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+# ----------------------------------------------------------------------
+# ตัวจัดคิว Inference แบบ Micro-batching
+# ----------------------------------------------------------------------
+# รวม tensor ขนาด 224x224 จากหลาย webhook ที่เข้ามาพร้อมกันให้เป็น batch เดียว
+# batch จะถูกรันเมื่อครบ max_batch_size หรือรอครบ max_wait_ms (แล้วแต่อย่างไหนถึงก่อน)
+# จากนั้นกระจายผลลัพธ์กลับไปยังผู้เรียกแต่ละคนผ่าน Future
+# ถ้า max_batch_size = 1 จะรันใน thread ของผู้เรียกเลย (เหมือนพฤติกรรมเดิม ไม่มีการรอ)
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+
+class _BatchSizeStats:
+    __slots__ = ('batches', 'images', 'invoke_seconds', 'wait_seconds')
+
+    def __init__(self):
+        self.batches = 0
+        self.images = 0
+        self.invoke_seconds = 0.0
+        self.wait_seconds = 0.0
+
+
+class InferenceScheduler:
+    """รับ tensor ทีละรูปแล้วรันผ่าน InterpreterPool แบบรวม batch."""
+
+    def __init__(self, pool, max_batch_size=1, max_wait_ms=10.0, stats_log_every=100):
+        self.pool = pool
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.stats_log_every = stats_log_every
+
+        self._input_index = pool.input_details[0]['index']
+        self._input_dtype = pool.input_details[0]['dtype']
+        self._output_index = pool.output_details[0]['index']
+        # โมเดล int8 ส่งผลลัพธ์เป็นจำนวนเต็ม: แปลงกลับเป็นความน่าจะเป็นด้วย (q - zero_point) * scale
+        output_scale, output_zero_point = pool.output_details[0].get('quantization', (0.0, 0))
+        self._output_dequantize = None
+        if np.dtype(pool.output_details[0]['dtype']).kind in 'iu' and output_scale:
+            self._output_dequantize = (np.float32(output_scale), np.float32(output_zero_point))
+        self._sample_shape = tuple(pool.input_details[0]['shape'][1:])
+
+        # ขนาด batch ที่ interpreter แต่ละตัวถูก resize ไว้ล่าสุด (key = id ของ interpreter)
+        self._allocated_batch = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        self._total_batches = 0
+
+        self._queue = queue.Queue()
+        if self.max_batch_size > 1:
+            # runner หนึ่งตัวต่อ interpreter หนึ่งตัวใน pool เพื่อให้ทุกตัวได้ทำงานพร้อมกัน
+            for i in range(pool.size):
+                threading.Thread(target=self._run_forever, name=f"inference-batch-{i}", daemon=True).start()
+            log.info(f"Inference scheduler started: max_batch_size={self.max_batch_size}, max_wait_ms={max_wait_ms}")
+
+    def predict(self, tensor, timeout=None):
+        """คืนผลลัพธ์ (1 มิติ) ของรูปเดียว โดย tensor ต้องมีรูปร่างเท่ากับ input ของโมเดล (ไม่รวมมิติ batch)."""
+        if self.max_batch_size == 1:
+            return self._run_batch([tensor], [time.perf_counter()])[0]
+        return self.submit(tensor).result(timeout)
+
+    def predict_batch(self, tensors):
+        """รันหลายรูปใน thread ของผู้เรียกโดยไม่ผ่านคิว (สำหรับงาน offline) แบ่งเป็นชุดละไม่เกิน max_batch_size."""
+        results = []
+        for start in range(0, len(tensors), self.max_batch_size):
+            chunk = tensors[start:start + self.max_batch_size]
+            results.append(self._run_batch(chunk, [time.perf_counter()] * len(chunk)))
+        return np.concatenate(results) if len(results) > 1 else results[0]
+
+    def submit(self, tensor):
+        future = Future()
+        self._queue.put((tensor, future, time.perf_counter()))
+        return future
+
+    def _collect_batch(self):
+        # รอรายการแรกแบบไม่จำกัดเวลา จากนั้นเก็บเพิ่มจนครบขนาดหรือหมดเวลารอ
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run_forever(self):
+        while True:
+            items = self._collect_batch()
+            futures = [future for _, future, _ in items]
+            try:
+                results = self._run_batch([tensor for tensor, _, _ in items], [queued for _, _, queued in items])
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def _padded_size(self, n):
+        # ปัดขนาด batch ขึ้นเป็นกำลังของ 2 เพื่อลดจำนวนครั้งที่ต้อง resize/allocate ใหม่
+        size = 1
+        while size < n:
+            size *= 2
+        return min(size, self.max_batch_size)
+
+    def _run_batch(self, tensors, queued_at):
+        n = len(tensors)
+        batch_size = self._padded_size(n)
+        if batch_size == 1 and tensors[0].dtype == self._input_dtype:
+            # รูปเดียว: ใช้ view ที่เพิ่มมิติ batch ได้เลยโดยไม่ต้องคัดลอก
+            batch = tensors[0][np.newaxis]
+        else:
+            batch = np.zeros((batch_size,) + self._sample_shape, dtype=self._input_dtype)
+            for i, tensor in enumerate(tensors):
+                batch[i] = tensor
+
+        started = time.perf_counter()
+        with self.pool.checkout() as model:
+            interpreter = model.interpreter
+            key = id(interpreter)
+            if self._allocated_batch.get(key, 1) != batch_size:
+                interpreter.resize_tensor_input(self._input_index, [batch_size, *self._sample_shape])
+                interpreter.allocate_tensors()
+                self._allocated_batch[key] = batch_size
+            interpreter.set_tensor(self._input_index, batch)
+            interpreter.invoke()
+            predictions = interpreter.get_tensor(self._output_index)
+        finished = time.perf_counter()
+
+        if self._output_dequantize is not None:
+            scale, zero_point = self._output_dequantize
+            predictions = (predictions.astype(np.float32) - zero_point) * scale
+
+        self._record(n, finished - started, sum(started - t for t in queued_at))
+        return predictions[:n]
+
+    def _record(self, n, invoke_seconds, wait_seconds):
+        with self._stats_lock:
+            stats = self._stats.setdefault(n, _BatchSizeStats())
+            stats.batches += 1
+            stats.images += n
+            stats.invoke_seconds += invoke_seconds
+            stats.wait_seconds += wait_seconds
+            self._total_batches += 1
+            should_log = self.stats_log_every and self._total_batches % self.stats_log_every == 0
+        if should_log:
+            log.info(self.format_stats())
+
+    def stats(self):
+        """สถิติแยกตามขนาด batch: throughput (รูป/วินาทีของเวลา invoke) และ latency เฉลี่ย (ms)."""
+        with self._stats_lock:
+            return {
+                n: {
+                    'batches': s.batches,
+                    'images': s.images,
+                    'images_per_sec': round(s.images / s.invoke_seconds, 1) if s.invoke_seconds else 0.0,
+                    'avg_invoke_ms': round(s.invoke_seconds / s.batches * 1000, 2),
+                    'avg_queue_wait_ms': round(s.wait_seconds / s.images * 1000, 2),
+                }
+                for n, s in sorted(self._stats.items())
+            }
+
+    def format_stats(self):
+        return "Inference batch stats: " + "; ".join(
+            f"batch={n} batches={s['batches']} img/s={s['images_per_sec']} "
+            f"invoke_ms={s['avg_invoke_ms']} wait_ms={s['avg_queue_wait_ms']}"
+            for n, s in self.stats().items()
+        )
@@ -0,0 +1,268 @@
+# ----------------------------------------------------------------------
+# ตัวแทนของ LINE Messaging API และ Firestore ที่ทำงานในหน่วยความจำ (ใช้กับ benchmark)
+# ----------------------------------------------------------------------
+# ไม่มีการเชื่อมต่อเครือข่าย แต่หน่วงเวลาทุก RPC ตามค่าที่กำหนด (latency_ms + สุ่มไม่เกิน jitter_ms)
+# เพื่อจำลอง round trip ของบริการจริง รองรับเฉพาะ API ที่โค้ดใน repo นี้ใช้:
+#   - FakeLineBotApi: reply_message, get_message_content
+#   - FakeFirestoreClient: collection/document get/set/update/create/delete, add,
+#     batch (create/set/update/delete/commit), write_option(last_update_time=...)
+#     รวมถึง firestore.Increment และ SERVER_TIMESTAMP
+import itertools
+import random
+import threading
+import time
+import uuid
+
+
+class Latency:
+    """หน่วงเวลา latency_ms (+ สุ่มเพิ่ม 0..jitter_ms) ต่อการเรียกหนึ่งครั้ง."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self.latency_ms
+        if self.jitter_ms:
+            with self._lock:
+                delay += self._random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+
+# ----------------------------------------------------------------------
+# LINE Messaging API
+# ----------------------------------------------------------------------
+class _FakeResponse:
+    def __init__(self, data, content_type):
+        self.headers = {'Content-Type': content_type, 'Content-Length': str(len(data))}
+        self.status_code = 200
+
+
+class FakeContent:
+    """เลียนแบบ linebot.models.responses.Content (content, content_type, iter_content)."""
+
+    def __init__(self, data, content_type='image/jpeg'):
+        self._data = data
+        self.response = _FakeResponse(data, content_type)
+
+    @property
+    def content_type(self):
+        return self.response.headers['Content-Type']
+
+    @property
+    def content(self):
+        return self._data
+
+    def iter_content(self, chunk_size=1024):
+        for start in range(0, len(self._data), chunk_size):
+            yield self._data[start:start + chunk_size]
+
+
+class FakeLineBotApi:
+    """แทน LineBotApi: เก็บข้อความที่ตอบกลับไว้ และคืนรูปที่ลงทะเบียนด้วย add_content."""
+
+    def __init__(self, reply_latency=None, content_latency=None):
+        self.reply_latency = reply_latency or Latency()
+        self.content_latency = content_latency or Latency()
+        self._lock = threading.Lock()
+        self._contents = {}
+        self.replies = 0
+        self.content_requests = 0
+
+    def add_content(self, message_id, data, content_type='image/jpeg'):
+        with self._lock:
+            self._contents[message_id] = (data, content_type)
+
+    def reply_message(self, reply_token, messages, notification_disabled=False, timeout=None):
+        self.reply_latency.wait()
+        with self._lock:
+            self.replies += 1
+
+    def get_message_content(self, message_id, timeout=None):
+        self.content_latency.wait()
+        with self._lock:
+            self.content_requests += 1
+            data, content_type = self._contents[message_id]
+        return FakeContent(data, content_type)
+
+
+# ----------------------------------------------------------------------
+# Firestore
+# ----------------------------------------------------------------------
+def _conflict(kind, message):
+    from google.api_core import exceptions
+
+    return getattr(exceptions, kind)(message)
+
+
+def _resolve(value, old):
+    # แปลง transform ของ Firestore ให้เป็นค่าจริง (ตรวจจากชื่อ class เพื่อไม่ผูกกับเวอร์ชันของ SDK)
+    kind = value.__class__.__name__
+    if kind == 'Increment':
+        return (old if isinstance(old, (int, float)) else 0) + value.value
+    if kind == 'Sentinel':
+        return time.time() # SERVER_TIMESTAMP
+    return value
+
+
+class _WriteOption:
+    def __init__(self, last_update_time=None, exists=None):
+        self.last_update_time = last_update_time
+        self.exists = exists
+
+
+class FakeWriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, update_time):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return None if self._data is None else dict(self._data)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self.path = f"{collection}/{doc_id}"
+        self.id = doc_id
+
+    def get(self):
+        self._client.latency.wait()
+        data, update_time = self._client._read(self.path)
+        return FakeSnapshot(self, data, update_time)
+
+    def set(self, data, merge=False):
+        self._client.latency.wait()
+        return self._client._apply([('set', self.path, data, {'merge': merge})])[0]
+
+    def update(self, data, option=None):
+        self._client.latency.wait()
+        return self._client._apply([('update', self.path, data, {'option': option})])[0]
+
+    def create(self, data):
+        self._client.latency.wait()
+        return self._client._apply([('create', self.path, data, {})])[0]
+
+    def delete(self):
+        self._client.latency.wait()
+        return self._client._apply([('delete', self.path, None, {})])[0]
+
+
+class FakeCollectionReference:
+    def __init__(self, client, name):
+        self._client = client
+        self.id = name
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._client, self.id, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        return ref.create(data).update_time, ref
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def create(self, reference, data):
+        self._writes.append(('create', reference.path, data, {}))
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('set', reference.path, data, {'merge': merge}))
+
+    def update(self, reference, data, option=None):
+        self._writes.append(('update', reference.path, data, {'option': option}))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference.path, None, {}))
+
+    def commit(self):
+        self._client.latency.wait()
+        writes, self._writes = self._writes, []
+        return self._client._apply(writes)
+
+
+class FakeFirestoreClient:
+    """Firestore ในหน่วยความจำ: เขียนแบบ atomic ต่อ batch และตรวจเงื่อนไขเหมือนของจริง."""
+
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self._lock = threading.Lock()
+        self._docs = {} # path -> (data, update_time)
+        self._clock = itertools.count(1) # update_time ต้องไม่ซ้ำกันเท่านั้น จึงใช้ตัวนับ
+        self.counters = {'reads': 0, 'writes': 0, 'commits': 0, 'conflicts': 0}
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def write_option(self, **kwargs):
+        return _WriteOption(**kwargs)
+
+    def documents(self, collection):
+        """คืน dict ของ document ทั้งหมดใน collection (สำหรับตรวจผลหลัง benchmark)."""
+        prefix = collection + '/'
+        with self._lock:
+            return {path[len(prefix):]: dict(data) for path, (data, _) in self._docs.items()
+                    if path.startswith(prefix)}
+
+    def _read(self, path):
+        with self._lock:
+            self.counters['reads'] += 1
+            data, update_time = self._docs.get(path, (None, None))
+            return (None if data is None else dict(data)), update_time
+
+    def _check(self, method, path, kwargs):
+        current = self._docs.get(path)
+        if method == 'create' and current is not None:
+            return 'AlreadyExists', f"Document already exists: {path}"
+        if method == 'update':
+            if current is None:
+                return 'NotFound', f"No document to update: {path}"
+            option = kwargs.get('option')
+            if option is not None and option.last_update_time not in (None, current[1]):
+                return 'FailedPrecondition', f"Document {path} was modified since it was read"
+        return None
+
+    def _apply(self, writes):
+        with self._lock:
+            # ตรวจเงื่อนไขของทุกการเขียนก่อน เพื่อให้ batch สำเร็จหรือล้มเหลวทั้งชุด
+            for method, path, _, kwargs in writes:
+                failure = self._check(method, path, kwargs)
+                if failure is not None:
+                    self.counters['conflicts'] += 1
+                    raise _conflict(*failure)
+
+            results = []
+            for method, path, data, kwargs in writes:
+                update_time = next(self._clock)
+                if method == 'delete':
+                    self._docs.pop(path, None)
+                else:
+                    merge = method == 'update' or kwargs.get('merge')
+                    old = dict(self._docs[path][0]) if merge and path in self._docs else {}
+                    for key, value in data.items():
+                        old[key] = _resolve(value, old.get(key))
+                    self._docs[path] = (old, update_time)
+                self.counters['writes'] += 1
+                results.append(FakeWriteResult(update_time))
+            self.counters['commits'] += 1
+            return results
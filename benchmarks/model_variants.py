@@ -0,0 +1,134 @@
+# ----------------------------------------------------------------------
+# Benchmark: เทียบโมเดล float / float16 / int8 บนรูปในเครื่อง
+# ----------------------------------------------------------------------
+# แต่ละ variant รันใน subprocess แยก (ค่า peak RSS จะไม่ปนกัน) ผ่าน InterpreterPool และ
+# InferenceScheduler ตัวเดียวกับที่ใช้งานจริง แล้วรายงาน
+#   - top-1 agreement: สัดส่วนรูปที่ variant ทำนาย class เดียวกับโมเดล float
+#   - ค่าความมั่นใจที่ต่างจาก float โดยเฉลี่ย
+#   - latency ของ invoke (mean/p50/p95) เวลาโหลดโมเดล ขนาดไฟล์ และ peak RSS
+#
+# วิธีใช้ (รันจาก root ของ repo):
+#   python -m benchmarks.model_variants --images samples/
+#   python -m benchmarks.model_variants --images samples/ --variants float,int8 --threads 2 --delegate none
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from quantize_model import FLOAT_MODEL_PATH, list_images
+
+
+def run_worker(model_path, image_paths, num_threads, delegate):
+    import numpy as np
+
+    from batch_scheduler import InferenceScheduler
+    from interpreter_pool import InterpreterPool
+    from preprocessing import preprocess_image
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    pool = InterpreterPool(model_path, size=1, num_threads=num_threads, delegate=delegate)
+    scheduler = InferenceScheduler(pool, stats_log_every=0)
+    load_seconds = time.perf_counter() - started
+
+    input_detail = pool.input_details[0]
+    scheduler.predict(preprocess_image(image_paths[0], input_detail)) # warm-up
+    top1, confidences, timings = [], [], []
+    for path in image_paths:
+        tensor = preprocess_image(path, input_detail)
+        started = time.perf_counter()
+        predictions = scheduler.predict(tensor)
+        timings.append(time.perf_counter() - started)
+        index = int(np.argmax(predictions))
+        top1.append(index)
+        confidences.append(float(predictions[index]))
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    timings.sort()
+    # ru_maxrss บน Linux มีหน่วย KB
+    print(json.dumps({
+        'model': os.path.basename(model_path),
+        'input_dtype': np.dtype(input_detail['dtype']).name,
+        'size_mb': round(os.path.getsize(model_path) / 1024 / 1024, 2),
+        'load_ms': round(load_seconds * 1000, 1),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 2),
+        'p50_ms': round(timings[len(timings) // 2] * 1000, 2),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 2),
+        'peak_rss_mb': round(rss_after / 1024, 1),
+        'peak_rss_growth_mb': round((rss_after - rss_before) / 1024, 1),
+        'top1': top1,
+        'confidence': confidences,
+    }))
+
+
+def compare(reference, result):
+    pairs = list(zip(reference['top1'], result['top1']))
+    agreement = sum(1 for a, b in pairs if a == b) / len(pairs)
+    confidence_delta = sum(
+        abs(a - b) for a, b in zip(reference['confidence'], result['confidence'])) / len(pairs)
+    return round(agreement, 4), round(confidence_delta, 4)
+
+
+def main():
+    import model_loader
+
+    parser = argparse.ArgumentParser(description='Compare accuracy, latency and memory of model variants')
+    parser.add_argument('--images', required=True, help='directory ของรูปที่ใช้ทดสอบ')
+    parser.add_argument('--limit', type=int, help='จำนวนรูปสูงสุด')
+    parser.add_argument('--variants', default=','.join(model_loader.MODEL_VARIANTS))
+    parser.add_argument('--model', default=FLOAT_MODEL_PATH, help='path ของโมเดล float')
+    parser.add_argument('--threads', type=int, help='INTERPRETER_NUM_THREADS ที่ใช้ทดสอบ')
+    parser.add_argument('--delegate', help='INTERPRETER_DELEGATE ที่ใช้ทดสอบ (default/none/path; xnnpack คือ default)')
+    parser.add_argument('--output', help='บันทึกผลเป็น JSON')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    image_paths = list_images(args.images, args.limit)
+    if not image_paths:
+        raise SystemExit(f"No images found in {args.images}")
+
+    if args.worker:
+        run_worker(args.worker, image_paths, args.threads, args.delegate)
+        return
+
+    variants = ['float'] + [v for v in args.variants.split(',') if v != 'float'] # float เป็นตัวอ้างอิงเสมอ
+    results = {}
+    for variant in variants:
+        path = model_loader.variant_path(args.model, variant)
+        if not os.path.exists(path):
+            print(f"Skipping {variant}: {path} not found (create it with quantize_model.py)")
+            continue
+        command = [sys.executable, '-m', 'benchmarks.model_variants', '--worker', path, '--images', args.images]
+        for flag, value in (('--limit', args.limit), ('--threads', args.threads), ('--delegate', args.delegate)):
+            if value is not None:
+                command += [flag, str(value)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results[variant] = json.loads(output.strip().splitlines()[-1])
+
+    reference = results.get('float')
+    if reference is None:
+        raise SystemExit(f"Float model {args.model} is required as the reference")
+
+    print(f"{len(image_paths)} images, threads={args.threads}, delegate={args.delegate or 'default'}")
+    print(f"{'variant':<8} {'input':<7} {'size_mb':>8} {'load_ms':>8} {'mean_ms':>8} {'p50_ms':>8} {'p95_ms':>8} "
+          f"{'rss_mb':>8} {'top1_agree':>10} {'conf_Δ':>7}")
+    for variant, r in results.items():
+        r['top1_agreement'], r['mean_confidence_delta'] = compare(reference, r)
+        print(f"{variant:<8} {r['input_dtype']:<7} {r['size_mb']:>8} {r['load_ms']:>8} {r['mean_ms']:>8} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['peak_rss_mb']:>8} {r['top1_agreement']:>10} "
+              f"{r['mean_confidence_delta']:>7}")
+
+    if args.output:
+        summary = {variant: {k: v for k, v in r.items() if k not in ('top1', 'confidence')}
+                   for variant, r in results.items()}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'images': len(image_paths), 'threads': args.threads, 'delegate': args.delegate,
+                       'variants': summary}, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
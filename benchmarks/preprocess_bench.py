@@ -0,0 +1,115 @@
+# ----------------------------------------------------------------------
+# Micro-benchmark: preprocessing แบบเดิม เทียบกับ preprocessing.py
+# ----------------------------------------------------------------------
+# วัดเวลา decode+resize ต่อรูป และ peak RSS ของแต่ละวิธี
+# แต่ละวิธีรันใน subprocess แยกกัน เพื่อให้ค่า peak RSS ไม่ปนกัน
+#
+# วิธีใช้ (รันจาก root ของ repo):
+#   python -m benchmarks.preprocess_bench                      # ใช้รูปสังเคราะห์ขนาด 12 MP
+#   python -m benchmarks.preprocess_bench --image photo.jpg --iterations 50
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# input ของโมเดลจริงเป็น float32 ขนาด 224x224x3
+INPUT_DETAIL = {'shape': [1, 224, 224, 3], 'dtype': 'float32', 'quantization': (0.0, 0)}
+
+
+def legacy_preprocess(data):
+    """โค้ดเดิมใน handle_image_message ก่อนแยกเป็น preprocessing.py."""
+    import numpy as np
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(data)).convert('RGB')
+    img = img.resize((224, 224))
+    img_array = np.array(img)
+    img_array = img_array / 255.0
+    img_array = np.expand_dims(img_array, axis=0)
+    return img_array.astype(INPUT_DETAIL['dtype'])
+
+
+def optimized_preprocess(data):
+    from preprocessing import preprocess_image
+
+    return preprocess_image(io.BytesIO(data), INPUT_DETAIL)
+
+
+def make_synthetic_jpeg(path, width=4032, height=3024):
+    # รูปขนาดเท่ากล้องมือถือทั่วไป (12 MP) พร้อมลวดลายเพื่อให้ขนาดไฟล์ใกล้เคียงรูปจริง
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 256, size=(height // 16, width // 16, 3), dtype=np.uint8)
+    Image.fromarray(base).resize((width, height)).save(path, format='JPEG', quality=90)
+
+
+def run_worker(method, image_path, iterations):
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    func = legacy_preprocess if method == 'legacy' else optimized_preprocess
+
+    func(data) # warm-up (import ไลบรารี, จอง buffer)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func(data)
+        timings.append(time.perf_counter() - started)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    timings.sort()
+    # ru_maxrss บน Linux มีหน่วย KB
+    print(json.dumps({
+        'method': method,
+        'iterations': iterations,
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 2),
+        'p50_ms': round(timings[len(timings) // 2] * 1000, 2),
+        'max_ms': round(timings[-1] * 1000, 2),
+        'peak_rss_mb': round(rss_after / 1024, 1),
+        'peak_rss_growth_mb': round((rss_after - rss_before) / 1024, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare legacy and optimized image preprocessing')
+    parser.add_argument('--image', help='path ของรูป JPEG ที่จะใช้ทดสอบ (ถ้าไม่ระบุจะสร้างรูป 12 MP ให้)')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--worker', choices=['legacy', 'optimized'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.image, args.iterations)
+        return
+
+    image_path = args.image
+    if image_path is None:
+        image_path = os.path.join(tempfile.mkdtemp(), 'synthetic_12mp.jpg')
+        make_synthetic_jpeg(image_path)
+
+    results = []
+    for method in ('legacy', 'optimized'):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.preprocess_bench', '--worker', method,
+             '--image', image_path, '--iterations', str(args.iterations)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output))
+
+    print(f"{'method':<10} {'mean_ms':>9} {'p50_ms':>9} {'max_ms':>9} {'peak_rss_mb':>12}")
+    for r in results:
+        print(f"{r['method']:<10} {r['mean_ms']:>9} {r['p50_ms']:>9} {r['max_ms']:>9} {r['peak_rss_mb']:>12}")
+    legacy, optimized = results
+    if optimized['mean_ms']:
+        print(f"speed-up: {legacy['mean_ms'] / optimized['mean_ms']:.1f}x, "
+              f"peak RSS saved: {legacy['peak_rss_mb'] - optimized['peak_rss_mb']:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+# ----------------------------------------------------------------------
+# Benchmark: ส่ง webhook ที่ลงลายเซ็นถูกต้องเข้า main(request) โดยไม่ต้องต่อ LINE/Firestore จริง
+# ----------------------------------------------------------------------
+# LineBotApi และ Firestore client ถูกแทนด้วยตัวในหน่วยความจำที่หน่วงเวลาได้ (ดู benchmarks/fakes.py)
+# ส่วนโมเดล TFLite และการประมวลผลรูปภาพเป็นของจริง
+#
+# รูปแบบ request ที่ส่ง (สุ่มลำดับตามสัดส่วนใน --mix):
+#   text          ข้อความทั่วไป (greeting/thanks/ไม่รู้จัก)
+#   symptom       ข้อความที่มีคำของอาการ
+#   conversation  รูปภาพ -> ตำแหน่ง -> อาการอื่นๆ ของผู้ใช้คนเดียวกัน (3 request ตามลำดับ)
+#   multi_event   body เดียวที่มีหลาย event จากหลายผู้ใช้
+# รายงาน throughput และ latency p50/p95/p99 ของแต่ละประเภท request ในแต่ละระดับ concurrency
+# และบันทึกผลเป็น JSON (ค่าเริ่มต้น benchmarks/results/webhook_replay-<commit>.json) เพื่อเทียบระหว่าง commit
+#
+# วิธีใช้ (รันจาก root ของ repo):
+#   python -m benchmarks.webhook_replay
+#   python -m benchmarks.webhook_replay --concurrency 1,8,32 --sessions 300 --firestore-latency-ms 20
+#   python -m benchmarks.webhook_replay --compare benchmarks/results/webhook_replay-abc1234.json
+# ค่า environment ของ main (ASYNC_WEBHOOKS, INTERPRETER_POOL_SIZE, ...) ใช้ได้ตามปกติ
+import argparse
+import base64
+import contextlib
+import hashlib
+import hmac
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import FakeFirestoreClient, FakeLineBotApi, Latency
+
+SCENARIOS = ('text', 'symptom', 'conversation', 'multi_event')
+DEFAULT_MIX = 'text=4,symptom=2,conversation=3,multi_event=1'
+# ใช้เมื่อไม่ได้ตั้ง secret ของ LINE ไว้ใน environment (benchmark ไม่ได้ติดต่อ LINE จริง)
+BENCH_CHANNEL_SECRET = 'webhook-replay-channel-secret'
+BENCH_CHANNEL_ACCESS_TOKEN = 'webhook-replay-access-token'
+
+TEXT_MESSAGES = ('สวัสดีครับ', 'ขอบคุณมากครับ', 'คุณทำอะไรได้บ้าง', 'วันนี้อากาศดีนะ')
+LOCATION_MESSAGES = ('แขน', 'ขา', 'ใบหน้า', 'ลำตัว')
+OTHER_SYMPTOM_MESSAGES = ('ไม่มี', 'คันนิดหน่อย', 'บวมแดง')
+
+
+def sign(body, secret):
+    """ค่า X-Line-Signature: HMAC-SHA256 ของ body ด้วย channel secret แล้วเข้ารหัส base64."""
+    digest = hmac.new(secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+class ReplayRequest:
+    """แทน Flask Request ที่ Cloud Functions ส่งให้ main(request)."""
+
+    def __init__(self, body, signature, method='POST'):
+        self.method = method
+        self.headers = {'X-Line-Signature': signature, 'Content-Type': 'application/json'}
+        self._body = body
+
+    def get_data(self, as_text=False):
+        return self._body if as_text else self._body.encode('utf-8')
+
+
+def make_synthetic_jpegs(count, width, height, seed):
+    # รูปลวดลายสุ่มที่ต่างกันทุกรูป (prediction cache จะ hit เมื่อวนกลับมาใช้รูปเดิม)
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        base = rng.integers(0, 256, size=(height // 16, width // 16, 3), dtype=np.uint8)
+        out = io.BytesIO()
+        Image.fromarray(base).resize((width, height)).save(out, format='JPEG', quality=90)
+        images.append(out.getvalue())
+    return images
+
+
+def load_images(directory):
+    names = sorted(n for n in os.listdir(directory) if n.lower().endswith(('.jpg', '.jpeg', '.png')))
+    if not names:
+        raise SystemExit(f"No images found in {directory}")
+    images = []
+    for name in names:
+        with open(os.path.join(directory, name), 'rb') as f:
+            images.append(f.read())
+    return images
+
+
+class PayloadFactory:
+    """สร้าง webhook body ตามรูปแบบของ LINE Messaging API พร้อมลายเซ็น."""
+
+    def __init__(self, secret, line_api, images, symptoms, events_per_body, seed):
+        self.secret = secret
+        self.line_api = line_api
+        self.images = images
+        self.symptoms = symptoms
+        self.events_per_body = events_per_body
+        self._random = random.Random(seed)
+        self._image_index = 0
+
+    def _message_event(self, user_id, message):
+        return {
+            'type': 'message',
+            'mode': 'active',
+            'timestamp': int(time.time() * 1000),
+            'source': {'type': 'user', 'userId': user_id},
+            'webhookEventId': uuid.uuid4().hex.upper()[:26],
+            'deliveryContext': {'isRedelivery': False},
+            'replyToken': uuid.uuid4().hex,
+            'message': message,
+        }
+
+    def _text(self, user_id, text):
+        return self._message_event(user_id, {'type': 'text', 'id': uuid.uuid4().hex[:18], 'text': text})
+
+    def _image(self, user_id):
+        message_id = uuid.uuid4().hex[:18]
+        self.line_api.add_content(message_id, self.images[self._image_index % len(self.images)])
+        self._image_index += 1
+        return self._message_event(user_id, {
+            'type': 'image', 'id': message_id, 'contentProvider': {'type': 'line'}})
+
+    def request(self, events):
+        body = json.dumps({'destination': 'Ubenchmark', 'events': events}, ensure_ascii=False)
+        return ReplayRequest(body, sign(body, self.secret))
+
+    def session(self, scenario):
+        """คืนลำดับของ (label, request) ที่ต้องส่งตามลำดับสำหรับหนึ่ง session."""
+        user_id = 'U' + uuid.uuid4().hex
+        pick = self._random.choice
+        if scenario == 'text':
+            return [('text', self.request([self._text(user_id, pick(TEXT_MESSAGES))]))]
+        if scenario == 'symptom':
+            return [('symptom', self.request([self._text(user_id, f"ช่วงนี้{pick(self.symptoms)}มากเลย")]))]
+        if scenario == 'conversation':
+            return [
+                ('image', self.request([self._image(user_id)])),
+                ('location', self.request([self._text(user_id, pick(LOCATION_MESSAGES))])),
+                ('other_symptoms', self.request([self._text(user_id, pick(OTHER_SYMPTOM_MESSAGES))])),
+            ]
+        if scenario == 'multi_event':
+            events = []
+            for _ in range(self.events_per_body):
+                text = pick(TEXT_MESSAGES + tuple(self.symptoms))
+                events.append(self._text('U' + uuid.uuid4().hex, text))
+            return [('multi_event', self.request(events))]
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario '{name}' (choose from {', '.join(SCENARIOS)})")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, pct):
+    # nearest-rank
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples, wall_seconds):
+    by_label = {}
+    for label, seconds, status in samples:
+        by_label.setdefault(label, []).append((seconds, status))
+    by_label['all'] = [(seconds, status) for _, seconds, status in samples]
+
+    summary = {}
+    for label, values in by_label.items():
+        latencies = sorted(seconds * 1000 for seconds, _ in values)
+        summary[label] = {
+            'count': len(values),
+            'errors': sum(1 for _, status in values if status != 200),
+            'throughput_rps': round(len(values) / wall_seconds, 2) if wall_seconds else None,
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+        }
+    return summary
+
+
+def run_session(app, session, samples):
+    for label, request in session:
+        started = time.perf_counter()
+        _, status = app.main(request)
+        samples.append((label, time.perf_counter() - started, status))
+
+
+def wait_until_drained(app, timeout=120.0):
+    # โหมด async: main ตอบก่อนประมวลผลเสร็จ ต้องรอคิวและ dispatcher ว่างก่อนหยุดจับเวลา
+    if not app.ASYNC_WEBHOOKS:
+        return
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if (app._event_queue_resource.get().stats()['queued'] == 0
+                and app._dispatcher_resource.get().stats()['active_lanes'] == 0):
+            return
+        time.sleep(0.01)
+    print("Warning: timed out waiting for async webhook processing to finish", file=sys.stderr)
+
+
+def run_level(app, factory, mix, sessions, concurrency, seed):
+    scenarios = [name for name, weight in mix.items() for _ in range(weight)]
+    rng = random.Random(seed)
+    workload = [factory.session(rng.choice(scenarios)) for _ in range(sessions)]
+
+    samples = [] # list.append ปลอดภัยระหว่าง thread
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(run_session, app, session, samples) for session in workload]:
+            future.result()
+    wait_until_drained(app)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def component_stats(app, fake_db, fake_line):
+    stats = {
+        'firestore': dict(fake_db.counters),
+        'line': {'replies': fake_line.replies, 'content_requests': fake_line.content_requests},
+        'user_state_store': app.user_state_store.stats(),
+        'dispatcher': app._dispatcher_resource.get().stats(),
+        'stages': app.telemetry.snapshot(),
+        'paths': app.telemetry.counts(),
+    }
+    if app.diagnosis_sink is not None:
+        app.diagnosis_sink.flush()
+        stats['diagnosis_sink'] = app.diagnosis_sink.stats()
+    inference = app.get_inference()
+    if inference is not None:
+        stats['inference'] = inference.stats()
+    cache = app.get_prediction_cache()
+    if cache is not None:
+        stats['prediction_cache'] = cache.stats()
+    return stats
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_summary(levels):
+    print(f"{'concurrency':>11} {'request':<15} {'count':>6} {'errors':>6} {'rps':>8} "
+          f"{'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}")
+    for concurrency, summary in levels.items():
+        for label, s in summary.items():
+            print(f"{concurrency:>11} {label:<15} {s['count']:>6} {s['errors']:>6} {s['throughput_rps']:>8} "
+                  f"{s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9}")
+
+
+def print_comparison(previous, current):
+    print(f"\nCompared with {previous.get('commit', '?')} (negative = faster):")
+    print(f"{'concurrency':>11} {'request':<15} {'p50 Δ%':>8} {'p95 Δ%':>8} {'p99 Δ%':>8} {'rps Δ%':>8}")
+    for concurrency, summary in current['levels'].items():
+        before = previous.get('levels', {}).get(concurrency, {})
+        for label, s in summary.items():
+            old = before.get(label)
+            if not old:
+                continue
+            deltas = [
+                f"{(s[key] - old[key]) / old[key] * 100:+.1f}" if old[key] else 'n/a'
+                for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps')
+            ]
+            print(f"{concurrency:>11} {label:<15} " + ' '.join(f"{d:>8}" for d in deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay signed LINE webhooks against main(request)')
+    parser.add_argument('--concurrency', default='1,4,16',
+                        help='ระดับ concurrency (จำนวน client พร้อมกัน) คั่นด้วย comma')
+    parser.add_argument('--sessions', type=int, default=200, help='จำนวน session ต่อระดับ concurrency')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"สัดส่วนของแต่ละรูปแบบ (ค่าเริ่มต้น {DEFAULT_MIX})")
+    parser.add_argument('--events-per-body', type=int, default=5, help='จำนวน event ใน multi_event')
+    parser.add_argument('--line-latency-ms', type=float, default=30.0, help='latency ของ reply_message')
+    parser.add_argument('--content-latency-ms', type=float, default=80.0, help='latency ของ get_message_content')
+    parser.add_argument('--firestore-latency-ms', type=float, default=15.0, help='latency ต่อ Firestore RPC')
+    parser.add_argument('--jitter-ms', type=float, default=5.0, help='สุ่ม latency เพิ่มได้ไม่เกินค่านี้')
+    parser.add_argument('--images', type=int, default=16, help='จำนวนรูปสังเคราะห์ที่ไม่ซ้ำกัน')
+    parser.add_argument('--image-size', default='1280x960', help='ขนาดรูปสังเคราะห์ (กว้างxสูง)')
+    parser.add_argument('--image-dir', help='ใช้รูปจริงจาก directory นี้แทนรูปสังเคราะห์')
+    parser.add_argument('--no-prediction-cache', action='store_true', help='ปิด prediction cache ให้รันโมเดลทุกรูป')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='path ของไฟล์ผลลัพธ์ JSON')
+    parser.add_argument('--compare', help='ไฟล์ผลลัพธ์เดิมที่จะนำมาเทียบ')
+    parser.add_argument('--verbose', action='store_true', help='แสดง log ของ main ระหว่าง benchmark')
+    args = parser.parse_args()
+    levels = [int(c) for c in args.concurrency.split(',')]
+
+    # ต้องตั้งก่อน import main: ไม่โหลด Firestore จริงล่วงหน้า และมี secret สำหรับลงลายเซ็น
+    os.environ.setdefault('EAGER_WARMUP', '0')
+    os.environ.setdefault('LINE_CHANNEL_SECRET', BENCH_CHANNEL_SECRET)
+    os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', BENCH_CHANNEL_ACCESS_TOKEN)
+    # รูปสังเคราะห์ได้ความมั่นใจต่ำ: ปิดการขอให้ถ่ายใหม่เพื่อให้ scenario conversation เดินครบทุกขั้น
+    os.environ.setdefault('RETAKE_CONFIDENCE_THRESHOLD', '0')
+    import main as app
+    from startup import LazyResource
+
+    def latency(ms, seed):
+        return Latency(ms, args.jitter_ms, seed=args.seed + seed)
+
+    fake_line = FakeLineBotApi(reply_latency=latency(args.line_latency_ms, 1),
+                               content_latency=latency(args.content_latency_ms, 2))
+    fake_db = FakeFirestoreClient(latency=latency(args.firestore_latency_ms, 3))
+    app.line_bot_api = fake_line
+    app._db_resource = LazyResource('firestore', lambda: fake_db)
+    if args.no_prediction_cache:
+        app._prediction_cache_resource = LazyResource('prediction-cache', lambda: None)
+
+    if args.image_dir:
+        images = load_images(args.image_dir)
+    else:
+        width, height = (int(v) for v in args.image_size.lower().split('x'))
+        images = make_synthetic_jpegs(args.images, width, height, args.seed)
+    factory = PayloadFactory(app.LINE_CHANNEL_SECRET, fake_line, images,
+                             list(app.common_symptoms_treatments), args.events_per_body, args.seed)
+
+    log = sys.stdout if args.verbose else open(os.devnull, 'w')
+    results = {
+        'commit': current_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'mode': 'async' if app.ASYNC_WEBHOOKS else 'sync',
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'levels': {},
+    }
+    with contextlib.redirect_stdout(log):
+        # warm-up: โหลดโมเดลและสร้าง dispatcher ก่อนเริ่มจับเวลา
+        app.get_inference()
+        for scenario in args.mix:
+            run_session(app, factory.session(scenario), [])
+        wait_until_drained(app)
+        for i, concurrency in enumerate(levels):
+            results['levels'][str(concurrency)] = run_level(
+                app, factory, args.mix, args.sessions, concurrency, args.seed + i)
+        results['components'] = component_stats(app, fake_db, fake_line)
+
+    print(f"Webhook replay ({results['mode']} mode, commit {results['commit']})")
+    print_summary(results['levels'])
+    if results['mode'] == 'async':
+        print("Note: async mode latencies measure the acknowledgement only; throughput includes processing.")
+
+    output = args.output or os.path.join('benchmarks', 'results', f"webhook_replay-{results['commit']}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# ----------------------------------------------------------------------
+# ชื่อ Class ของโมเดลวินิจฉัยผิวหนังและรายละเอียดของแต่ละ Class
+# ----------------------------------------------------------------------
+# ใช้ร่วมกันระหว่าง webhook (main.py) และการวินิจฉัยแบบ offline (batch_diagnose.py)
+# ลำดับใน class_names_map ต้องตรงกับลำดับ output ของโมเดล
+
+# นี่คือรายการชื่อคลาสทั้ง 19 ชนิด ที่โมเดลของคุณถูกฝึกมาให้จำแนก
+# ปรับเปลี่ยนให้เป็น Dictionary เพื่อเก็บทั้งชื่อภาษาอังกฤษและภาษาไทย
+class_names_map = [
+    {'english': 'Abrasions', 'thai': 'แผลถลอก'},
+    {'english': 'Acne', 'thai': 'สิว'},
+    {'english': 'Actinic Keratosis', 'thai': 'ติ่งเนื้อจากแสงแดด'},
+    {'english': 'Basal Cell Carcinoma', 'thai': 'มะเร็งผิวหนังชนิดเบเซลเซลล์'},
+    {'english': 'Bruises', 'thai': 'รอยฟกช้ำ'},
+    {'english': 'Burns', 'thai': 'แผลไหม้'},
+    {'english': 'Cut', 'thai': 'บาดแผลถูกของมีคม'},
+    {'english': 'Dermatofibroma', 'thai': 'เนื้องอกผิวหนังชนิดเดอร์มาโตไฟโบรมา'},
+    {'english': 'Diabetic Wounds', 'thai': 'แผลเบาหวาน'},
+    {'english': 'Laceration', 'thai': 'แผลฉีกขาด'},
+    {'english': 'Melanocytic Nevi', 'thai': 'ไฝ'},
+    {'english': 'Melanoma', 'thai': 'มะเร็งผิวหนังชนิดเมลาโนมา'},
+    {'english': 'Normal', 'thai': 'ผิวปกติ'},
+    {'english': 'Pressure Wounds', 'thai': 'แผลกดทับ'},
+    {'english': 'Seborrheic Keratoses', 'thai': 'กระเนื้อ'},
+    {'english': 'Squamous Cell Carcinoma', 'thai': 'มะเร็งผิวหนังชนิดสความัสเซลล์'},
+    {'english': 'Surgical Wounds', 'thai': 'แผลผ่าตัด'},
+    {'english': 'Vascular Lesion', 'thai': 'รอยโรคเส้นเลือด'},
+    {'english': 'Venous Wounds', 'thai': 'แผลหลอดเลือดดำบกพร่อง'}
+]
+
+# สร้าง list ของชื่อภาษาอังกฤษสำหรับใช้กับ np.argmax
+class_names = [item['english'] for item in class_names_map]
+
+# Dictionary สำหรับเก็บข้อมูลเพิ่มเติมของแต่ละประเภทอาการ
+# คุณสามารถแก้ไขข้อมูลเหล่านี้ให้ถูกต้องและครบถ้วนตามที่คุณต้องการได้เลยนะครับ
+class_details = {
+    'Abrasions': {
+        'treatment': 'ทำความสะอาดแผลด้วยน้ำสะอาดและสบู่เบาๆ ทาครีมฆ่าเชื้อและปิดด้วยผ้าก๊อซ',
+        'avoid': 'หลีกเลี่ยงการแกะเกาแผล และไม่ให้แผลโดนสิ่งสกปรก',
+        'severe_warning': 'หากมีเลือดออกมาก แผลลึก มีหนอง บวมแดง หรือปวดมาก ควรพบแพทย์ทันที'
+    },
+    'Acne': {
+        'treatment': 'ใช้ผลิตภัณฑ์ทำความสะอาดผิวหน้าสำหรับสิว ทายาแต้มสิวที่มีส่วนผสมของ Benzoyl Peroxide หรือ Salicylic Acid',
+        'avoid': 'หลีกเลี่ยงการบีบสิว การใช้เครื่องสำอางที่อุดตันรูขุมขน และอาหารที่มีน้ำตาลสูง',
+        'severe_warning': 'หากสิวอักเสบมาก เป็นสิวหัวช้าง หรือมีอาการปวดรุนแรง ควรปรึกษาแพทย์ผิวหนัง'
+    },
+    'Actinic Keratosis': {
+        'treatment': 'ปรึกษาแพทย์ผิวหนังเพื่อการรักษา เช่น การจี้ด้วยความเย็น การใช้ยาเฉพาะที่ หรือการผ่าตัดเล็ก',
+        'avoid': 'หลีกเลี่ยงการโดนแสงแดดจัดโดยตรง และควรทาครีมกันแดดเป็นประจำ',
+        'severe_warning': 'หากรอยโรคมีการเปลี่ยนแปลงขนาด สี หรือมีเลือดออก ควรพบแพทย์โดยเร็วที่สุด เพราะอาจพัฒนาเป็นมะเร็งผิวหนังได้'
+    },
+    'Basal Cell Carcinoma': {
+        'treatment': 'ปรึกษาแพทย์ผิวหนังเพื่อการรักษา เช่น การผ่าตัด การฉายรังสี หรือการใช้ยาเฉพาะที่',
+        'avoid': 'หลีกเลี่ยงการโดนแสงแดดจัด และควรตรวจผิวหนังเป็นประจำ',
+        'severe_warning': 'เป็นมะเร็งผิวหนังที่ต้องได้รับการรักษาโดยแพทย์ผู้เชี่ยวชาญทันที'
+    },
+    'Bruises': {
+        'treatment': 'ประคบเย็นในช่วง 24-48 ชั่วโมงแรก จากนั้นประคบอุ่นเพื่อช่วยให้เลือดไหลเวียนดีขึ้น',
+        'avoid': 'หลีกเลี่ยงการนวดหรือกดบริเวณที่ช้ำแรงๆ ในช่วงแรก',
+        'severe_warning': 'หากรอยช้ำใหญ่ขึ้นอย่างรวดเร็ว ปวดมากผิดปกติ หรือเกิดจากการบาดเจ็บรุนแรง ควรพบแพทย์'
+    },
+    'Burns': {
+        'treatment': 'แผลไหม้ระดับ 1-2: ล้างด้วยน้ำสะอาดหรือน้ำเกลือ ประคบเย็น ทายาสำหรับแผลไหม้',
+        'avoid': 'ห้ามใช้ยาสีฟัน น้ำปลา หรือน้ำแข็งประคบแผลไหม้',
+        'severe_warning': 'แผลไหม้ระดับ 3 ขึ้นไป แผลใหญ่ มีตุ่มพองขนาดใหญ่ หรือไหม้บริเวณใบหน้า มือ เท้า อวัยวะเพศ ควรพบแพทย์ทันที'
+    },
+    'Cut': {
+        'treatment': 'ทำความสะอาดแผลด้วยน้ำสะอาดและสบู่ ทาครีมฆ่าเชื้อ ปิดด้วยผ้าก๊อซหรือพลาสเตอร์',
+        'avoid': 'หลีกเลี่ยงการให้แผลโดนน้ำสกปรก และการแกะเกา',
+        'severe_warning': 'หากแผลลึก เลือดออกไม่หยุด มีหนอง หรือปวดมาก ควรพบแพทย์เพื่อเย็บแผลหรือรับการรักษา'
+    },
+    'Dermatofibroma': {
+        'treatment': 'โดยทั่วไปไม่จำเป็นต้องรักษา หากต้องการเอาออกเพื่อความสวยงาม สามารถปรึกษาแพทย์เพื่อผ่าตัดเล็กได้',
+        'avoid': 'หลีกเลี่ยงการแกะเกาบ่อยๆ',
+        'severe_warning': 'หากมีการเปลี่ยนแปลงขนาด สี หรือมีอาการเจ็บปวด ควรปรึกษาแพทย์เพื่อตรวจวินิจฉัยเพิ่มเติม'
+    },
+    'Diabetic Wounds': {
+        'treatment': 'ทำความสะอาดแผลอย่างสม่ำเสมอ ควบคุมระดับน้ำตาลในเลือด และปรึกษาแพทย์เพื่อการดูแลแผลที่เหมาะสม',
+        'avoid': 'หลีกเลี่ยงการเดินเท้าเปล่า และการใส่รองเท้าที่ไม่เหมาะสม',
+        'severe_warning': 'แผลเบาหวานมักหายยากและเสี่ยงต่อการติดเชื้อสูง ควรพบแพทย์ผู้เชี่ยวชาญทันที'
+    },
+    'Laceration': {
+        'treatment': 'ทำความสะอาดแผล ห้ามเลือด และปรึกษาแพทย์เพื่อประเมินว่าต้องเย็บแผลหรือไม่',
+        'avoid': 'หลีกเลี่ยงการสัมผัสแผลด้วยมือที่ไม่สะอาด',
+        'severe_warning': 'หากแผลลึก กว้าง เลือดออกมาก หรือมีสิ่งแปลกปลอมติดอยู่ในแผล ควรพบแพทย์ทันที'
+    },
+    'Melanocytic Nevi': {
+        'treatment': 'โดยทั่วไปไม่จำเป็นต้องรักษา แต่ควรสังเกตการเปลี่ยนแปลง',
+        'avoid': 'หลีกเลี่ยงการแกะเกาไฝ และควรทาครีมกันแดด',
+        'severe_warning': 'หากไฝมีการเปลี่ยนแปลงขนาด รูปร่าง สี ขอบไม่เรียบ มีอาการคัน หรือมีเลือดออก ควรปรึกษาแพทย์ผิวหนังทันที (อาจเป็นสัญญาณของมะเร็งผิวหนัง)'
+    },
+    'Melanoma': {
+        'treatment': 'ต้องได้รับการรักษาโดยแพทย์ผู้เชี่ยวชาญทันที เช่น การผ่าตัด การฉายรังสี หรือเคมีบำบัด',
+        'avoid': 'หลีกเลี่ยงการโดนแสงแดดจัด และควรตรวจผิวหนังเป็นประจำ',
+        'severe_warning': 'เป็นมะเร็งผิวหนังชนิดร้ายแรงที่สุด ต้องได้รับการวินิจฉัยและรักษาโดยแพทย์ผู้เชี่ยวชาญโดยเร็วที่สุด'
+    },
+    'Normal': {
+        'treatment': 'ดูแลผิวพรรณให้สะอาด ชุ่มชื้น และทาครีมกันแดดเป็นประจำ',
+        'avoid': 'ไม่มีข้อควรหลีกเลี่ยงเฉพาะเจาะจง แต่ควรดูแลสุขภาพโดยรวม',
+        'severe_warning': 'หากมีอาการผิดปกติใดๆ เกิดขึ้น ควรปรึกษาแพทย์'
+    },
+    'Pressure Wounds': {
+        'treatment': 'ลดแรงกดทับบริเวณแผล พลิกตัวบ่อยๆ ทำความสะอาดแผล และปรึกษาแพทย์เพื่อการดูแลแผลที่เหมาะสม',
+        'avoid': 'หลีกเลี่ยงการนอนหรือนั่งท่าเดิมเป็นเวลานาน',
+        'severe_warning': 'หากแผลลึก มีการติดเชื้อ หรือมีไข้ ควรพบแพทย์ทันที'
+    },
+    'Seborrheic Keratoses': {
+        'treatment': 'โดยทั่วไปไม่จำเป็นต้องรักษา หากต้องการเอาออกเพื่อความสวยงาม สามารถปรึกษาแพทย์เพื่อจี้ด้วยความเย็นหรือเลเซอร์ได้',
+        'avoid': 'ไม่มีข้อควรหลีกเลี่ยงเฉพาะเจาะจง',
+        'severe_warning': 'หากมีการเปลี่ยนแปลงขนาด สี หรือมีอาการคัน/เจ็บปวด ควรปรึกษาแพทย์เพื่อตรวจวินิจฉัยเพิ่มเติม'
+    },
+    'Squamous Cell Carcinoma': {
+        'treatment': 'ปรึกษาแพทย์ผิวหนังเพื่อการรักษา เช่น การผ่าตัด การฉายรังสี หรือการใช้ยาเฉพาะที่',
+        'avoid': 'หลีกเลี่ยงการโดนแสงแดดจัด และควรตรวจผิวหนังเป็นประจำ',
+        'severe_warning': 'เป็นมะเร็งผิวหนังที่ต้องได้รับการรักษาโดยแพทย์ผู้เชี่ยวชาญทันที'
+    },
+    'Surgical Wounds': {
+        'treatment': 'ทำความสะอาดแผลตามคำแนะนำของแพทย์ เปลี่ยนผ้าปิดแผลตามกำหนด และสังเกตอาการติดเชื้อ',
+        'avoid': 'หลีกเลี่ยงการให้แผลโดนน้ำโดยไม่จำเป็น และการยกของหนัก',
+        'severe_warning': 'หากแผลบวมแดงร้อน มีหนอง มีไข้ หรือปวดมาก ควรพบแพทย์ทันที'
+    },
+    'Vascular Lesion': {
+        'treatment': 'ปรึกษาแพทย์ผิวหนังเพื่อการวินิจฉัยและวางแผนการรักษา เช่น เลเซอร์ การผ่าตัด หรือการฉีดสารบางชนิด',
+        'avoid': 'หลีกเลี่ยงการแกะเกาหรือทำให้เกิดการบาดเจ็บ',
+        'severe_warning': 'หากมีการเปลี่ยนแปลงขนาด สี หรือมีเลือดออก ควรปรึกษาแพทย์'
+    },
+    'Venous Wounds': {
+        'treatment': 'ทำความสะอาดแผล พันผ้ายืดหรือใส่ถุงน่องรัด เพื่อช่วยการไหลเวียนของเลือด และปรึกษาแพทย์เพื่อการดูแลแผลที่เหมาะสม',
+        'avoid': 'หลีกเลี่ยงการยืนหรือนั่งห้อยขานานๆ',
+        'severe_warning': 'หากแผลมีการติดเชื้อ บวมแดงร้อน หรือมีไข้ ควรพบแพทย์ทันที'
+    }
+}
@@ -0,0 +1,231 @@
+# ----------------------------------------------------------------------
+# ตัวบันทึกข้อมูลการวินิจฉัยแบบ Buffer (ไม่ต้องรอ Firestore ก่อนตอบผู้ใช้)
+# ----------------------------------------------------------------------
+# record จะถูกเก็บใน buffer แล้วเขียนลง Firestore เป็น batch เมื่อครบจำนวน flush_size
+# หรือครบเวลา flush_interval (แล้วแต่อย่างไหนถึงก่อน) และ flush อีกครั้งตอนปิดโปรแกรม
+# ถ้า Firestore ใช้งานไม่ได้ (db เป็น None หรือเขียนไม่สำเร็จ) จะต่อท้ายลงไฟล์ spill (JSON lines)
+# แทนการทิ้งข้อมูล และจะนำกลับมาเขียนใหม่ในการ flush ครั้งถัดไปที่ Firestore พร้อม
+# ถ้ากำหนด stats (DiagnosisStats) ตัวนับสถิติรายวันจะถูกเพิ่มใน batch เดียวกับ record (ดู diagnosis_stats.py)
+# ไฟล์ spill ใช้ร่วมกันได้หลาย process (เช่น worker ของ prefork_server.py): การต่อท้ายถือ flock ของไฟล์
+# และการนำกลับมาเขียนจะ rename ไฟล์ไปเป็น <spill_path>.replay-* ก่อนอ่าน record ที่ต่อท้ายทีหลังจึงไปอยู่ในไฟล์ใหม่
+# ไฟล์ .replay-* ถูกถือ flock ไว้จนเขียนลง Firestore สำเร็จแล้วจึงลบ ถ้า process ตายก่อน ไฟล์จะค้างอยู่
+# และ sink ที่เริ่มทำงานใหม่จะนำไฟล์ที่ไม่มี process ใดถือ lock อยู่กลับมาเขียนใน flush ครั้งแรก
+# flush ครั้งสุดท้ายทำผ่าน atexit จึงไม่เกิดเมื่อ process ถูก SIGKILL หรือ crash
+# record ใน buffer ที่ยังไม่ถึงรอบ flush (ไม่เกิน flush_size รายการหรือ flush_interval วินาที) จะหายไป
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+# Firestore จำกัดการเขียนใน batch เดียวไว้ที่ 500 operations
+MAX_BATCH_WRITES = 500
+
+
+class PartialWriteError(Exception):
+    """เขียนได้เพียงบาง batch: remaining คือ record ที่ยังไม่ถูก commit (batch ที่ commit แล้วต้องไม่ถูกเขียนซ้ำ)."""
+
+    def __init__(self, remaining, cause):
+        super().__init__(f"{len(remaining)} records not written: {cause}")
+        self.remaining = remaining
+
+
+def _same_file(f, path):
+    # path ยังชี้ไปที่ไฟล์ที่เปิดอยู่หรือไม่ (process อื่นอาจ rename หรือลบไปแล้วระหว่างรอ lock)
+    try:
+        return os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+class BufferedDiagnosisSink:
+    """รับ record การวินิจฉัยแบบไม่ block และเขียนลง Firestore เป็นชุดใน background thread."""
+
+    def __init__(self, db_getter, collection, flush_size=50, flush_interval=5.0, spill_path=None, stats=None):
+        self._db_getter = db_getter
+        self.collection = collection
+        self.diagnosis_stats = stats
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+
+        self._cond = threading.Condition()
+        self._buffer = []
+        self._flush_lock = threading.Lock() # ให้มีการ flush ได้ทีละครั้ง
+        self._spill_lock = threading.Lock()
+        self._closed = False
+        self._check_orphans = True # ไฟล์ .replay-* ที่ค้างจาก process ที่ตายไปแล้ว ตรวจครั้งเดียวตอนเริ่ม
+        self._counters = {'buffered': 0, 'flushed': 0, 'failed': 0, 'spilled': 0, 'replayed': 0}
+
+        threading.Thread(target=self._flush_forever, name='diagnosis-sink', daemon=True).start()
+        atexit.register(self.close)
+
+    def _count(self, name, n=1):
+        with self._cond:
+            self._counters[name] += n
+
+    def submit(self, record):
+        """เพิ่ม record เข้า buffer (record ต้องแปลงเป็น JSON ได้ เพื่อให้ spill ลงไฟล์ได้)."""
+        record = dict(record)
+        record.setdefault('client_timestamp', time.time())
+        with self._cond:
+            self._buffer.append(record)
+            self._counters['buffered'] += 1
+            if len(self._buffer) >= self.flush_size:
+                self._cond.notify()
+
+    def _flush_forever(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._buffer) < self.flush_size:
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def _take_buffer(self):
+        with self._cond:
+            records, self._buffer = self._buffer, []
+        return records
+
+    def _write(self, db, records):
+        """เขียน records เป็นหลาย batch ถ้าล้มเหลวจะ raise PartialWriteError พร้อม record ที่ยังไม่ถูก commit."""
+        # เผื่อที่ให้ตัวนับสถิติ (ไม่เกินหนึ่ง operation ต่อ record)
+        per_batch = MAX_BATCH_WRITES // 2 if self.diagnosis_stats is not None else MAX_BATCH_WRITES
+        for start in range(0, len(records), per_batch):
+            try:
+                self._commit_chunk(db, records[start:start + per_batch])
+            except Exception as e:
+                raise PartialWriteError(records[start:], e) from e
+
+    def _commit_chunk(self, db, chunk):
+        from firebase_admin import firestore
+
+        collection = db.collection(self.collection)
+        batch = db.batch()
+        for record in chunk:
+            batch.create(collection.document(), dict(record, timestamp=firestore.SERVER_TIMESTAMP))
+        if self.diagnosis_stats is not None:
+            self.diagnosis_stats.add_to_batch(db, batch, chunk)
+        batch.commit()
+
+    def _spill(self, records):
+        if not self.spill_path:
+            self._count('failed', len(records))
+            log.error(f"Dropped {len(records)} diagnosis records (no spill file configured)")
+            return
+        with self._spill_lock:
+            while True:
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    # process อื่นอาจ rename ไฟล์ไปแล้วระหว่างรอ lock: เปิดชื่อเดิมใหม่แทนการต่อท้ายไฟล์ที่กำลังถูกอ่าน
+                    if not _same_file(f, self.spill_path):
+                        continue
+                    for record in records:
+                        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    f.flush()
+                    break
+        self._count('spilled', len(records))
+        log.warning(f"Spilled {len(records)} diagnosis records to {self.spill_path}")
+
+    def _lock_file(self, path, blocking=True):
+        try:
+            f = open(path, encoding='utf-8')
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close() # process อื่นกำลังนำไฟล์นี้กลับมาเขียนอยู่
+            return None
+        if not _same_file(f, path):
+            f.close()
+            return None
+        return f
+
+    def _claim_spilled(self):
+        """คืน (records, claims) โดย claims คือ (path, file) ที่ถือ flock ไว้ ต้องลบด้วย _release หลังเขียนสำเร็จ."""
+        if not self.spill_path:
+            return [], []
+        claims = []
+        with self._spill_lock:
+            if self._check_orphans:
+                self._check_orphans = False
+                for path in glob.glob(glob.escape(self.spill_path) + '.replay-*'):
+                    f = self._lock_file(path, blocking=False)
+                    if f is not None:
+                        claims.append((path, f))
+                if claims:
+                    log.warning(f"Recovering {len(claims)} spill files left by an earlier process")
+            f = self._lock_file(self.spill_path)
+            if f is not None:
+                # rename แล้ว lock ยังอยู่กับไฟล์เดิม writer ที่รอ lock จะเห็นว่าชื่อเดิมเป็นไฟล์ใหม่แล้ว
+                claimed = f"{self.spill_path}.replay-{os.getpid()}-{time.time_ns()}"
+                os.rename(self.spill_path, claimed)
+                claims.append((claimed, f))
+        records = []
+        for _, f in claims:
+            records.extend(json.loads(line) for line in f if line.strip())
+        return records, claims
+
+    def _release(self, claims):
+        # ลบก่อนปล่อย lock: process ที่รอ lock อยู่จะเห็นว่าไฟล์ถูกลบแล้วและไม่นำไปเขียนซ้ำ
+        for path, f in claims:
+            os.remove(path)
+            f.close()
+
+    def flush(self):
+        """เขียน record ใน buffer (และ record ที่ค้างในไฟล์ spill) ลง Firestore."""
+        with self._flush_lock:
+            records = self._take_buffer()
+            if not records and not (self.spill_path and (self._check_orphans or os.path.exists(self.spill_path))):
+                return
+            db = self._db_getter()
+            if db is None:
+                if records:
+                    log.warning("Firestore is not initialized. Cannot save diagnosis records.")
+                    self._spill(records)
+                return
+
+            replayed, claims = self._claim_spilled()
+            pending = replayed + records
+            try:
+                if pending:
+                    self._write(db, pending)
+            except PartialWriteError as e:
+                # spill เฉพาะส่วนที่ยังไม่ commit ไม่เช่นนั้น record และตัวนับสถิติจะถูกเขียนซ้ำตอน replay
+                written = len(pending) - len(e.remaining)
+                log.error(f"Error saving diagnosis records ({written} written): {e}")
+                self._count('flushed', written)
+                self._count('failed', len(e.remaining))
+                self._spill(e.remaining)
+                self._release(claims)
+                return
+            # ไฟล์ที่ claim ไว้ถูกลบหลังเขียนสำเร็จเท่านั้น
+            self._release(claims)
+            if not pending:
+                return
+            self._count('flushed', len(pending))
+            self._count('replayed', len(replayed))
+            log.info(f"Flushed {len(pending)} diagnosis records ({len(replayed)} replayed from spill file)")
+
+    def close(self):
+        """หยุด background thread และ flush record ที่เหลือ (เรียกอัตโนมัติตอนปิดโปรแกรม)."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats['pending'] = len(self._buffer)
+        return stats
@@ -0,0 +1,226 @@
+# ----------------------------------------------------------------------
+# สถิติการวินิจฉัยแบบสะสม (ทำ dashboard ได้โดยไม่ต้องอ่าน collection diagnoses ทั้งหมด)
+# ----------------------------------------------------------------------
+# ทุกครั้งที่เขียน record การวินิจฉัย ตัวนับจะถูกเพิ่มใน batch write เดียวกัน (สำเร็จหรือล้มเหลวพร้อมกัน)
+# - หนึ่ง document ต่อ (วัน, predicted_class_english, shard) ใน collection diagnosis_stats
+#   เช่น 2024-06-01__melanoma__2 เพิ่มค่าด้วย firestore.Increment ลง shard ที่สุ่มเลือก
+#   เพื่อไม่ให้ document เดียวถูกเขียนถี่เกินขีดจำกัดของ Firestore (ประมาณ 1 ครั้ง/วินาที/document)
+# - field: count, confidence_sum และ histogram ของความมั่นใจ confidence_bucket_00 ... confidence_bucket_90
+#   (ช่วงละ 10% ตั้งชื่อตามขอบล่าง)
+# - วันนับจาก client_timestamp ของ record ตามเขตเวลา DIAGNOSIS_STATS_TIMEZONE (ค่าเริ่มต้น Asia/Bangkok)
+#
+# วิธีใช้ (รันจาก root ของ repo):
+#   python diagnosis_stats.py query --from 2024-06-01 --to 2024-06-30 --class Melanoma
+#   python diagnosis_stats.py backfill --dry-run
+# backfill อ่าน record ทั้งหมดใน diagnoses แล้วเขียนสถิติใหม่ทับทั้ง collection
+# record ที่ถูกเขียนระหว่าง backfill อาจถูกนับขาดหรือซ้ำ จึงควรรันตอนที่มีผู้ใช้น้อย
+import argparse
+import datetime
+import json
+import os
+import random
+import time
+from zoneinfo import ZoneInfo
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+STATS_COLLECTION = 'diagnosis_stats'
+RECORDS_COLLECTION = 'diagnoses'
+DEFAULT_TIMEZONE = 'Asia/Bangkok'
+# ขอบล่างของแต่ละช่วงความมั่นใจ (%) เปลี่ยนแล้วต้อง backfill ใหม่
+CONFIDENCE_BUCKETS = tuple(range(0, 100, 10))
+# Firestore จำกัดการเขียนใน batch เดียวไว้ที่ 500 operations
+MAX_BATCH_WRITES = 500
+RECORD_FIELDS = ('predicted_class_english', 'confidence', 'client_timestamp', 'timestamp')
+
+
+def bucket_field(confidence):
+    """ชื่อ field ของช่วงความมั่นใจ (0-1) เช่น 0.87 -> confidence_bucket_80."""
+    percent = min(max(int(float(confidence) * 100), 0), 99)
+    lower = max(b for b in CONFIDENCE_BUCKETS if b <= percent)
+    return f"confidence_bucket_{lower:02d}"
+
+
+def _slug(class_name):
+    return '_'.join(class_name.lower().replace('/', ' ').split())
+
+
+class DiagnosisStats:
+    """ตัวนับการวินิจฉัยแบบ sharded ต่อวันและต่อ class."""
+
+    def __init__(self, collection=STATS_COLLECTION, shards=4, timezone=DEFAULT_TIMEZONE):
+        self.collection = collection
+        self.shards = max(1, shards)
+        self.timezone = ZoneInfo(timezone)
+
+    @classmethod
+    def from_env(cls, collection=STATS_COLLECTION):
+        return cls(
+            collection,
+            shards=int(os.getenv('DIAGNOSIS_STATS_SHARDS', '4')),
+            timezone=os.getenv('DIAGNOSIS_STATS_TIMEZONE', DEFAULT_TIMEZONE),
+        )
+
+    def day_of(self, record):
+        """วันที่ (YYYY-MM-DD) ของ record จาก client_timestamp หรือ timestamp ของ Firestore (หรือเวลาปัจจุบัน)."""
+        client_timestamp = record.get('client_timestamp')
+        timestamp = record.get('timestamp')
+        if isinstance(client_timestamp, (int, float)):
+            moment = datetime.datetime.fromtimestamp(client_timestamp, self.timezone)
+        elif isinstance(timestamp, datetime.datetime):
+            moment = timestamp.astimezone(self.timezone)
+        else:
+            moment = datetime.datetime.fromtimestamp(time.time(), self.timezone)
+        return moment.date().isoformat()
+
+    def document_id(self, day, class_name, shard):
+        return f"{day}__{_slug(class_name)}__{shard}"
+
+    def aggregate(self, records):
+        """รวม record เป็นค่าที่ต้องเพิ่มต่อ (วัน, class) ข้าม record ที่ไม่มี predicted_class_english."""
+        totals = {}
+        for record in records:
+            class_name = record.get('predicted_class_english')
+            if not class_name:
+                continue
+            confidence = float(record.get('confidence') or 0.0)
+            fields = totals.setdefault((self.day_of(record), class_name), {'count': 0, 'confidence_sum': 0.0})
+            fields['count'] += 1
+            fields['confidence_sum'] += confidence
+            bucket = bucket_field(confidence)
+            fields[bucket] = fields.get(bucket, 0) + 1
+        return totals
+
+    def add_to_batch(self, db, batch, records):
+        """เพิ่มตัวนับของ records ลงใน batch write ที่มีอยู่ (หนึ่ง operation ต่อ (วัน, class)) คืนจำนวน operation."""
+        from firebase_admin import firestore
+
+        collection = db.collection(self.collection)
+        totals = self.aggregate(records)
+        for (day, class_name), fields in totals.items():
+            shard = random.randrange(self.shards)
+            document = {'day': day, 'predicted_class_english': class_name, 'shard': shard}
+            document.update({name: firestore.Increment(value) for name, value in fields.items()})
+            batch.set(collection.document(self.document_id(day, class_name, shard)), document, merge=True)
+        return len(totals)
+
+    def query(self, db, start_day, end_day=None, class_name=None):
+        """อ่านสถิติช่วงวัน [start_day, end_day] รวมทุก shard คืน list ของ dict เรียงตามวันและ class."""
+        query = db.collection(self.collection).where('day', '>=', start_day).where('day', '<=', end_day or start_day)
+        merged = {}
+        for snapshot in query.stream():
+            data = snapshot.to_dict()
+            # กรอง class ฝั่ง client เพื่อไม่ต้องสร้าง composite index (document ต่อวันมีไม่มาก)
+            if class_name and data.get('predicted_class_english') != class_name:
+                continue
+            row = merged.setdefault((data['day'], data['predicted_class_english']), {'count': 0, 'confidence_sum': 0.0})
+            for name, value in data.items():
+                if name == 'count' or name == 'confidence_sum' or name.startswith('confidence_bucket_'):
+                    row[name] = row.get(name, 0) + value
+        rows = []
+        for (day, name), row in sorted(merged.items()):
+            count = row['count']
+            rows.append({
+                'day': day,
+                'predicted_class_english': name,
+                'count': count,
+                'mean_confidence': round(row['confidence_sum'] / count, 4) if count else None,
+                'confidence_buckets': {
+                    f"{b:02d}": row.get(f"confidence_bucket_{b:02d}", 0) for b in CONFIDENCE_BUCKETS
+                },
+            })
+        return rows
+
+    def _delete_all(self, db, page_size=MAX_BATCH_WRITES):
+        collection = db.collection(self.collection)
+        deleted = 0
+        while True:
+            documents = list(collection.limit(page_size).stream())
+            if not documents:
+                return deleted
+            batch = db.batch()
+            for snapshot in documents:
+                batch.delete(snapshot.reference)
+            batch.commit()
+            deleted += len(documents)
+
+    def backfill(self, db, records_collection=RECORDS_COLLECTION, page_size=1000, dry_run=False):
+        """คำนวณสถิติใหม่จาก record ทั้งหมด แล้วเขียนทับ collection สถิติ (shard 0 เก็บยอดรวม)."""
+        collection = db.collection(records_collection)
+        base = collection.select(list(RECORD_FIELDS)).order_by('__name__').limit(page_size)
+        totals, scanned, last = {}, 0, None
+        while True:
+            page = list((base.start_after(last) if last is not None else base).stream())
+            if not page:
+                break
+            for key, fields in self.aggregate(snapshot.to_dict() for snapshot in page).items():
+                current = totals.setdefault(key, {})
+                for name, value in fields.items():
+                    current[name] = current.get(name, 0) + value
+            scanned += len(page)
+            last = page[-1]
+            log.info(f"Backfill scanned {scanned} records")
+
+        summary = {'records': scanned, 'documents': len(totals),
+                   'diagnoses': sum(fields['count'] for fields in totals.values())}
+        if dry_run:
+            return summary
+
+        summary['deleted'] = self._delete_all(db)
+        stats = db.collection(self.collection)
+        items = sorted(totals.items())
+        for start in range(0, len(items), MAX_BATCH_WRITES):
+            batch = db.batch()
+            for (day, class_name), fields in items[start:start + MAX_BATCH_WRITES]:
+                document = {'day': day, 'predicted_class_english': class_name, 'shard': 0, **fields}
+                batch.set(stats.document(self.document_id(day, class_name, 0)), document)
+            batch.commit()
+        return summary
+
+
+def _print_rows(rows):
+    header = f"{'day':<10} {'class':<28} {'count':>6} {'mean':>6}  " + ' '.join(f"{b:>4}" for b in CONFIDENCE_BUCKETS)
+    print(header)
+    for row in rows:
+        mean = '' if row['mean_confidence'] is None else f"{row['mean_confidence']:.3f}"
+        buckets = ' '.join(f"{n:>4}" for n in row['confidence_buckets'].values())
+        print(f"{row['day']:<10} {row['predicted_class_english']:<28} {row['count']:>6} {mean:>6}  {buckets}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query or rebuild the aggregated diagnosis statistics')
+    parser.add_argument('--collection', default=STATS_COLLECTION)
+    commands = parser.add_subparsers(dest='command', required=True)
+    query = commands.add_parser('query', help='อ่านสถิติรายวัน (รวมทุก shard)')
+    query.add_argument('--from', dest='start', required=True, help='วันเริ่มต้น YYYY-MM-DD')
+    query.add_argument('--to', dest='end', help='วันสุดท้าย YYYY-MM-DD (ค่าเริ่มต้นเท่ากับ --from)')
+    query.add_argument('--class', dest='class_name', help='predicted_class_english เช่น Melanoma')
+    query.add_argument('--json', action='store_true', help='พิมพ์ผลเป็น JSON')
+    backfill = commands.add_parser('backfill', help='สร้างสถิติใหม่จาก record ใน diagnoses ทั้งหมด')
+    backfill.add_argument('--records-collection', default=RECORDS_COLLECTION)
+    backfill.add_argument('--dry-run', action='store_true', help='คำนวณอย่างเดียว ไม่เขียนทับ')
+    args = parser.parse_args()
+
+    import firebase_admin
+    from firebase_admin import firestore
+
+    firebase_admin.initialize_app()
+    db = firestore.client()
+    stats = DiagnosisStats.from_env(args.collection)
+
+    if args.command == 'query':
+        rows = stats.query(db, args.start, args.end, args.class_name)
+        if args.json:
+            print(json.dumps(rows, ensure_ascii=False, indent=2))
+        else:
+            _print_rows(rows)
+        return
+
+    summary = stats.backfill(db, args.records_collection, dry_run=args.dry_run)
+    print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
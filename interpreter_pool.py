@@ -0,0 +1,109 @@
+# ----------------------------------------------------------------------
+# Pool ของ TFLite Interpreter สำหรับประมวลผลรูปภาพพร้อมกันหลาย thread
+# ----------------------------------------------------------------------
+# Interpreter หนึ่งตัวไม่ปลอดภัยเมื่อถูกเรียก set_tensor/invoke/get_tensor จากหลาย thread พร้อมกัน
+# จึงสร้าง interpreter ไว้ล่วงหน้า N ตัวจากไฟล์โมเดลเดียวกัน แล้วให้แต่ละ request ยืม (checkout)
+# ไปใช้และคืนเมื่อเสร็จ ถ้าไม่มีตัวว่างจะรอในคิวที่มีขนาดจำกัด
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+import model_loader
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+
+class PoolExhaustedError(RuntimeError):
+    """ไม่สามารถยืม interpreter ได้ (คิวรอเต็มหรือรอนานเกินกำหนด)."""
+
+
+class InterpreterPool:
+    """เก็บ LoadedModel หลายตัวที่ allocate แล้ว พร้อมให้ยืมใช้ทีละ thread."""
+
+    def __init__(self, model_path, size=1, num_threads=None, max_waiters=8, checkout_timeout=10.0, timer=None,
+                 delegate=None):
+        if size < 1:
+            raise ValueError("Interpreter pool size must be at least 1")
+        self.model_path = model_path
+        self.size = size
+        self.max_waiters = max_waiters
+        self.checkout_timeout = checkout_timeout
+
+        # ใช้ LIFO เพื่อให้ interpreter ที่เพิ่งใช้ (cache ยังอุ่นอยู่) ถูกหยิบไปใช้ก่อน
+        self._available = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._waiters = 0
+        self._checkouts = 0
+        self._rejected = 0
+
+        models = [
+            model_loader.load_model(model_path, timer=timer, num_threads=num_threads, delegate=delegate)
+            for _ in range(size)
+        ]
+        for model in models:
+            self._available.put(model)
+
+        # interpreter ทุกตัวมาจากโมเดลเดียวกัน จึงใช้ details ของตัวแรกเป็นตัวแทนได้
+        self.input_details = models[0].input_details
+        self.output_details = models[0].output_details
+        self.runtime = models[0].runtime
+        log.info(f"Interpreter pool ready: size={size}, num_threads={num_threads}, max_waiters={max_waiters}")
+
+    @classmethod
+    def from_env(cls, model_path, timer=None):
+        """สร้าง pool ตามค่าจาก environment variables (INTERPRETER_DELEGATE ดู model_loader.DELEGATE_*)."""
+        num_threads = os.getenv('INTERPRETER_NUM_THREADS')
+        return cls(
+            model_path,
+            size=int(os.getenv('INTERPRETER_POOL_SIZE', '1')),
+            num_threads=int(num_threads) if num_threads else None,
+            max_waiters=int(os.getenv('INTERPRETER_POOL_MAX_WAITERS', '8')),
+            checkout_timeout=float(os.getenv('INTERPRETER_POOL_TIMEOUT', '10')),
+            timer=timer,
+            delegate=os.getenv('INTERPRETER_DELEGATE') or None,
+        )
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """ยืม LoadedModel หนึ่งตัว และคืนเข้า pool อัตโนมัติเมื่อออกจาก with block."""
+        try:
+            model = self._available.get_nowait()
+        except queue.Empty:
+            model = self._wait_for_model(timeout)
+
+        with self._lock:
+            self._checkouts += 1
+        try:
+            yield model
+        finally:
+            self._available.put(model)
+
+    def _wait_for_model(self, timeout):
+        # ไม่มีตัวว่าง: เข้าคิวรอ ถ้าคิวเต็มแล้วให้ปฏิเสธทันทีแทนที่จะค้าง thread ไว้
+        with self._lock:
+            if self._waiters >= self.max_waiters:
+                self._rejected += 1
+                raise PoolExhaustedError(f"Too many requests waiting for an interpreter ({self._waiters})")
+            self._waiters += 1
+        try:
+            return self._available.get(timeout=self.checkout_timeout if timeout is None else timeout)
+        except queue.Empty:
+            with self._lock:
+                self._rejected += 1
+            raise PoolExhaustedError("Timed out waiting for an interpreter")
+        finally:
+            with self._lock:
+                self._waiters -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'available': self._available.qsize(),
+                'waiting': self._waiters,
+                'checkouts': self._checkouts,
+                'rejected': self._rejected,
+            }
@@ -0,0 +1,203 @@
+# ----------------------------------------------------------------------
+# การเชื่อมต่อ LINE API: connection pool และการดาวน์โหลดรูปแบบ stream
+# ----------------------------------------------------------------------
+# - PooledRequestsHttpClient ใช้ requests.Session เดียวต่อ LineBotApi เพื่อใช้ TCP/TLS connection ซ้ำ
+#   (RequestsHttpClient เดิมเรียก requests.get/post ซึ่งเปิด connection ใหม่ทุกครั้ง)
+# - ImageDownloader อ่าน content ของรูปทีละ chunk ลง buffer ที่ใช้ซ้ำได้ (ต่อ thread) โดย
+#   ปฏิเสธทันทีถ้า Content-Type ไม่ใช่รูป, Content-Length หรือขนาดที่อ่านได้เกิน max_bytes,
+#   magic bytes ไม่ใช่ JPEG/PNG/GIF/WebP หรือดาวน์โหลดนานเกิน deadline
+#   ผลลัพธ์เป็น memoryview ของ buffer ซึ่งส่งให้ decoder ผ่าน BufferReader ได้โดยไม่ต้องคัดลอก
+import functools
+import io
+import threading
+import time
+
+import requests
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+from requests.adapters import HTTPAdapter
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+# magic bytes ของรูปแบบที่ PIL decode ได้และ LINE ส่งมาได้
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+# ชื่อรูปแบบที่รับได้ (IMAGE_SIGNATURES และ WebP ที่ตรวจใน sniff_image_format) ใช้ในข้อความตอบผู้ใช้
+ACCEPTED_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WebP')
+SNIFF_BYTES = 12
+
+
+class ContentRejectedError(ValueError):
+    """content ที่ดาวน์โหลดไม่ใช่รูป ใหญ่เกินกำหนด หรือดาวน์โหลดนานเกินไป."""
+
+
+def sniff_image_format(head):
+    """คืนชื่อรูปแบบรูปจาก bytes แรกของไฟล์ หรือ None ถ้าไม่รู้จัก."""
+    head = bytes(head[:SNIFF_BYTES])
+    for signature, name in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return name
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class PooledRequestsHttpClient(RequestsHttpClient):
+    """RequestsHttpClient ที่ส่งทุก request ผ่าน requests.Session ที่มี connection pool."""
+
+    def __init__(self, timeout=RequestsHttpClient.DEFAULT_TIMEOUT, pool_size=10):
+        super().__init__(timeout)
+        self.session = requests.Session()
+        # ไม่ retry เอง: LineBotApi จัดการ error เอง และ reply token ใช้ได้ครั้งเดียว
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _request(self, method, url, timeout, **kwargs):
+        response = self.session.request(method, url, timeout=self.timeout if timeout is None else timeout, **kwargs)
+        return RequestsHttpResponse(response)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._request('GET', url, timeout, headers=headers, params=params, stream=stream)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._request('POST', url, timeout, headers=headers, data=data)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._request('DELETE', url, timeout, headers=headers, data=data)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._request('PUT', url, timeout, headers=headers, data=data)
+
+
+def pooled_http_client(pool_size):
+    """factory สำหรับ argument http_client ของ LineBotApi (LineBotApi จะเรียกด้วย timeout=...)."""
+    return functools.partial(PooledRequestsHttpClient, pool_size=pool_size)
+
+
+def _close(content):
+    # คืน connection ให้ pool แม้จะอ่านไม่ครบ (เช่นถูกปฏิเสธกลางทาง)
+    response = getattr(content, 'response', None)
+    close = getattr(getattr(response, 'response', response), 'close', None)
+    if close is not None:
+        close()
+
+
+class ImageDownloader:
+    """ดาวน์โหลดรูปจาก LINE content API แบบ stream ลง buffer ที่ใช้ซ้ำได้ (หนึ่งชุดต่อ thread)."""
+
+    def __init__(self, max_bytes=10 * 1024 * 1024, chunk_size=64 * 1024, deadline=30.0):
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.deadline = deadline
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counters = {'downloads': 0, 'bytes': 0, 'rejected': 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _buffer(self, size):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or len(buffer) < size:
+            # ขยายทีละเท่าตัว (ไม่เกิน max_bytes) เพื่อไม่ต้องจองใหม่บ่อย
+            capacity = len(buffer) if buffer is not None else self.chunk_size * 4
+            while capacity < size:
+                capacity *= 2
+            grown = bytearray(min(capacity, self.max_bytes))
+            if buffer is not None:
+                grown[:len(buffer)] = buffer
+            buffer = self._local.buffer = grown
+        return buffer
+
+    def _reject(self, message):
+        self._count('rejected')
+        raise ContentRejectedError(message)
+
+    def _check_headers(self, content):
+        content_type = (content.content_type or '').split(';')[0].strip().lower()
+        if content_type and not content_type.startswith('image/'):
+            self._reject(f"Unsupported content type: {content_type}")
+        length = content.response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            self._reject(f"Image is too large: {int(length)} bytes (limit {self.max_bytes})")
+        return int(length) if length and length.isdigit() else None
+
+    def fetch(self, line_bot_api, message_id, timeout=None):
+        """คืน memoryview ของรูป (ใช้ได้จนกว่าจะเรียก fetch ครั้งถัดไปใน thread เดียวกัน)."""
+        started = time.monotonic()
+        content = line_bot_api.get_message_content(message_id, timeout=timeout)
+        try:
+            expected = self._check_headers(content)
+            buffer = self._buffer(expected or self.chunk_size * 4)
+            size = 0
+            for chunk in content.iter_content(chunk_size=self.chunk_size):
+                end = size + len(chunk)
+                if end > self.max_bytes:
+                    self._reject(f"Image exceeds {self.max_bytes} bytes")
+                if end > len(buffer):
+                    buffer = self._buffer(end)
+                buffer[size:end] = chunk
+                if size < SNIFF_BYTES <= end and sniff_image_format(buffer) is None:
+                    self._reject("Content is not a supported image format")
+                size = end
+                if self.deadline and time.monotonic() - started > self.deadline:
+                    self._reject(f"Image download took longer than {self.deadline} s")
+        finally:
+            _close(content)
+
+        if size < SNIFF_BYTES and sniff_image_format(buffer[:size]) is None:
+            self._reject("Content is not a supported image format")
+        self._count('downloads')
+        self._count('bytes', size)
+        return memoryview(buffer)[:size]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+class BufferReader(io.RawIOBase):
+    """file-like แบบอ่านอย่างเดียวบน memoryview (ให้ PIL decode จาก buffer โดยไม่คัดลอกทั้งก้อน)."""
+
+    def __init__(self, view):
+        super().__init__()
+        self._view = memoryview(view).cast('B')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, target):
+        n = min(len(target), len(self._view) - self._position)
+        if n <= 0:
+            return 0
+        target[:n] = self._view[self._position:self._position + n]
+        self._position += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError("Negative seek position")
+        self._position = position
+        return position
+
+    def tell(self):
+        return self._position
@@ -1,9 +1,8 @@
-import tensorflow as tf
-import numpy as np
-from PIL import Image
-import requests
-import io
+import time
+_IMPORT_STARTED = time.perf_counter() # จับเวลา import ตั้งแต่บรรทัดแรก
+
 import os
+import threading
 import datetime # สำหรับ timestamp
 
 # ไลบรารีสำหรับ LINE Bot
@@ -11,10 +10,32 @@ from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, ImageMessage
 
-# ไลบรารีสำหรับ Firebase/Firestore
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import firestore
+# tensorflow/numpy/PIL และ firebase_admin เป็นไลบรารีที่หนัก
+# จึงไม่ import ที่นี่ แต่จะโหลดแบบ background/lazy เพื่อลดเวลา cold start
+import model_loader
+from class_catalog import class_details, class_names, class_names_map
+from diagnosis_sink import BufferedDiagnosisSink
+from diagnosis_stats import DiagnosisStats
+from interpreter_pool import InterpreterPool, PoolExhaustedError
+from line_client import ACCEPTED_IMAGE_FORMATS, BufferReader, ContentRejectedError, ImageDownloader, pooled_http_client
+from routing_index import build_routing_index
+from startup import LazyResource, StartupTimer
+from state_store import StateConflictError, UserStateStore
+from telemetry import Telemetry, get_logger
+
+log = get_logger(__name__)
+
+startup_timer = StartupTimer()
+startup_timer.record('import', time.perf_counter() - _IMPORT_STARTED)
+
+# จับเวลาแต่ละขั้นของการประมวลผล event เป็น histogram (ดู telemetry.py)
+# ตั้งค่าได้ด้วย TELEMETRY_SAMPLE_RATE, SLOW_REQUEST_MS, LOG_FORMAT=json และ LOG_LEVEL
+# ตั้ง METRICS_ENDPOINT=1 เพื่อให้ GET /metrics คืนค่า histogram และตัวนับเส้นทางการตอบในรูปแบบ Prometheus
+telemetry = Telemetry.from_env()
+METRICS_ENDPOINT = os.getenv('METRICS_ENDPOINT', '0') == '1'
+
+# ตั้งเป็น '0' เพื่อปิดการโหลด Firestore/โมเดลล่วงหน้าใน background (จะโหลดตอนใช้งานครั้งแรกแทน)
+EAGER_WARMUP = os.getenv('EAGER_WARMUP', '1') != '0'
 
 # ----------------------------------------------------------------------
 # 0. การตั้งค่า Firebase/Firestore
@@ -25,171 +46,117 @@ from firebase_admin import firestore
 # cred = credentials.Certificate("path/to/your/serviceAccountKey.json")
 # firebase_admin.initialize_app(cred)
 # สำหรับ Cloud Functions เพียงพอที่จะเรียก initialize_app โดยไม่มี argument
-try:
+def _init_firestore():
+    import firebase_admin
+    from firebase_admin import firestore
+
     firebase_admin.initialize_app()
-    db = firestore.client()
-    print("Firestore initialized successfully!")
-except Exception as e:
-    print(f"Error initializing Firestore: {e}")
-    db = None # ตั้งค่า db เป็น None ถ้ามีปัญหาในการเชื่อมต่อ
+    client = firestore.client()
+    log.info("Firestore initialized successfully!")
+    return client
+
+# ถ้าเชื่อมต่อไม่สำเร็จ get_db() จะคืนค่า None เหมือนเดิม
+_db_resource = LazyResource('firestore', _init_firestore, timer=startup_timer, phase='clients_firestore')
+
+def get_db():
+    """คืน Firestore client (รอให้โหลดเสร็จถ้ายังโหลดอยู่) หรือ None ถ้าเชื่อมต่อไม่ได้."""
+    return _db_resource.get()
 
 # ----------------------------------------------------------------------
 # 1. ตั้งค่า LINE API Credentials ของคุณ
 # ----------------------------------------------------------------------
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv('+ejYKoOlgc2wwEki1alzwDcWGSXoAkd2f+XEWDORDo4pNjt8yvlNVvd80EEXdzkwEP5FxWj+f6UOiXbDyM9BOhfRyfrU42EFkV+XKk1M8EEQdRU2RyE6QCi+lRqpVmGrJCJ8NbfOCWdFaN1Q3qv51gdB04t89/1O/w1cDnyilFU=', None)
 LINE_CHANNEL_SECRET = os.getenv('b53014031bc26ccf4683475d5f13470e', None)
+# รองรับชื่อ environment variable มาตรฐานด้วย (ใช้โดย benchmarks/webhook_replay.py และการรันบนเครื่อง local)
+LINE_CHANNEL_ACCESS_TOKEN = LINE_CHANNEL_ACCESS_TOKEN or os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
+LINE_CHANNEL_SECRET = LINE_CHANNEL_SECRET or os.getenv('LINE_CHANNEL_SECRET')
 
 if LINE_CHANNEL_ACCESS_TOKEN is None or LINE_CHANNEL_SECRET is None:
-    print("CRITICAL ERROR: LINE_CHANNEL_ACCESS_TOKEN or LINE_CHANNEL_SECRET is not set.")
+    log.critical("LINE_CHANNEL_ACCESS_TOKEN or LINE_CHANNEL_SECRET is not set.")
     pass
 
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
+# LINE client ไม่มีการเชื่อมต่อเครือข่ายตอนสร้าง จึงสร้างได้ทันที (handler ต้องมีก่อนใช้ decorator)
+# ทุก request ไปยัง LINE ใช้ connection pool เดียวกัน (ดู line_client.py)
+# ตั้งค่าได้ด้วย LINE_CONNECT_TIMEOUT, LINE_READ_TIMEOUT (วินาที) และ LINE_HTTP_POOL_SIZE
+LINE_TIMEOUT = (float(os.getenv('LINE_CONNECT_TIMEOUT', '3')), float(os.getenv('LINE_READ_TIMEOUT', '10')))
+
+with startup_timer.phase('clients_line'):
+    line_bot_api = LineBotApi(
+        LINE_CHANNEL_ACCESS_TOKEN,
+        timeout=LINE_TIMEOUT,
+        http_client=pooled_http_client(int(os.getenv('LINE_HTTP_POOL_SIZE', '10'))),
+    )
+    handler = WebhookHandler(LINE_CHANNEL_SECRET)
+
+# รูปจากผู้ใช้ถูกดาวน์โหลดแบบ stream ลง buffer ที่ใช้ซ้ำ และถูกปฏิเสธทันทีถ้าไม่ใช่รูปหรือใหญ่เกินไป
+# ตั้งค่าได้ด้วย IMAGE_MAX_BYTES และ IMAGE_DOWNLOAD_DEADLINE (วินาที รวมทั้งการดาวน์โหลด)
+image_downloader = ImageDownloader(
+    max_bytes=int(os.getenv('IMAGE_MAX_BYTES', str(10 * 1024 * 1024))),
+    deadline=float(os.getenv('IMAGE_DOWNLOAD_DEADLINE', '30')),
+)
 
 # ----------------------------------------------------------------------
 # 2. โหลดโมเดล AI ของคุณ (.tflite file)
 # ----------------------------------------------------------------------
-MODEL_PATH = 'khunmoa_skin_diagnosis_final_model.tflite'
-
-try:
-    interpreter = tf.lite.Interpreter(model_path=MODEL_PATH)
-    interpreter.allocate_tensors()
-    input_details = interpreter.get_input_details()
-    output_details = interpreter.get_output_details()
-    print("TFLite Model loaded successfully!")
-except Exception as e:
-    print(f"Error loading TFLite model from {MODEL_PATH}: {e}")
-    interpreter = None
+# เลือกโมเดล float/float16/int8 ด้วย MODEL_VARIANT (ดู model_loader.py และ quantize_model.py)
+# ถ้าไม่มีไฟล์ของ variant ที่เลือก จะใช้โมเดล float เดิม
+MODEL_PATH = model_loader.resolve_model_path(model_loader.DEFAULT_MODEL_PATH)
+
+# โหลดโมเดลผ่าน runtime ที่เบาที่สุด (ดู model_loader.py) เป็น pool ของ interpreter หลายตัว
+# เพื่อให้ instance เดียวประมวลผลหลายรูปพร้อมกันได้อย่างปลอดภัย (ดู interpreter_pool.py)
+# ตั้งค่าได้ด้วย INTERPRETER_POOL_SIZE, INTERPRETER_NUM_THREADS, INTERPRETER_DELEGATE
+# (default/none/path ของ .so; xnnpack คือ default), INTERPRETER_POOL_MAX_WAITERS และ INTERPRETER_POOL_TIMEOUT (วินาที)
+# ข้อความ Text ไม่ต้องรอโมเดล มีเพียง handle_image_message ที่เรียก get_inference()
+
+# Micro-batching: รวมรูปจากหลาย request ให้รันเป็น batch เดียว (ดู batch_scheduler.py)
+# ค่าเริ่มต้น 1 คือไม่รวม batch (รันทันทีใน thread ของ request)
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv('INFERENCE_MAX_BATCH_SIZE', '1'))
+INFERENCE_MAX_WAIT_MS = float(os.getenv('INFERENCE_MAX_WAIT_MS', '10'))
+
+def _load_inference():
+    from batch_scheduler import InferenceScheduler # import numpy ด้วย จึงโหลดใน background
+    import preprocessing # โหลด PIL ล่วงหน้าไปพร้อมกันด้วย
+
+    pool = InterpreterPool.from_env(MODEL_PATH, timer=startup_timer)
+    return InferenceScheduler(pool, max_batch_size=INFERENCE_MAX_BATCH_SIZE, max_wait_ms=INFERENCE_MAX_WAIT_MS)
+
+_model_resource = LazyResource('tflite-model', _load_inference)
+
+def get_inference():
+    """คืน InferenceScheduler (ซึ่งถือ InterpreterPool ไว้) หรือ None ถ้าโหลดโมเดลไม่สำเร็จ."""
+    return _model_resource.get()
+
+# Cache ผลการทำนายตาม hash ของรูป (ดู prediction_cache.py) ผูกกับ sha256 ของไฟล์โมเดล
+# เมื่อเปลี่ยนไฟล์ .tflite ผลลัพธ์เก่าจะไม่ถูกนำมาใช้อีก
+# ตั้งค่าได้ด้วย PREDICTION_CACHE_MAX_ENTRIES, PREDICTION_CACHE_TTL (วินาที),
+# PREDICTION_CACHE_PERCEPTUAL=1 และ PREDICTION_CACHE_PERSISTENT=1 (เก็บลง Firestore)
+def _load_prediction_cache():
+    from prediction_cache import PredictionCache
+
+    return PredictionCache.from_env(model_loader.file_fingerprint(MODEL_PATH), db_getter=get_db)
+
+_prediction_cache_resource = LazyResource('prediction-cache', _load_prediction_cache)
+
+def get_prediction_cache():
+    """คืน PredictionCache หรือ None ถ้าสร้างไม่สำเร็จ (จะรันโมเดลทุกครั้งแทน)."""
+    return _prediction_cache_resource.get()
+
+def _report_startup():
+    # รอให้ทรัพยากรทั้งหมดโหลดเสร็จแล้วพิมพ์สรุปเวลาของแต่ละช่วง
+    _db_resource.get()
+    _model_resource.get()
+    log.info(startup_timer.format_report())
+
+if EAGER_WARMUP:
+    _db_resource.start()
+    _model_resource.start()
+    _prediction_cache_resource.start()
+    threading.Thread(target=_report_startup, name='startup-report', daemon=True).start()
 
 # ----------------------------------------------------------------------
 # 3. กำหนดชื่อ Class และรายละเอียดเพิ่มเติม
 # ----------------------------------------------------------------------
-# นี่คือรายการชื่อคลาสทั้ง 19 ชนิด ที่โมเดลของคุณถูกฝึกมาให้จำแนก
-# ปรับเปลี่ยนให้เป็น Dictionary เพื่อเก็บทั้งชื่อภาษาอังกฤษและภาษาไทย
-class_names_map = [
-    {'english': 'Abrasions', 'thai': 'แผลถลอก'},
-    {'english': 'Acne', 'thai': 'สิว'},
-    {'english': 'Actinic Keratosis', 'thai': 'ติ่งเนื้อจากแสงแดด'},
-    {'english': 'Basal Cell Carcinoma', 'thai': 'มะเร็งผิวหนังชนิดเบเซลเซลล์'},
-    {'english': 'Bruises', 'thai': 'รอยฟกช้ำ'},
-    {'english': 'Burns', 'thai': 'แผลไหม้'},
-    {'english': 'Cut', 'thai': 'บาดแผลถูกของมีคม'},
-    {'english': 'Dermatofibroma', 'thai': 'เนื้องอกผิวหนังชนิดเดอร์มาโตไฟโบรมา'},
-    {'english': 'Diabetic Wounds', 'thai': 'แผลเบาหวาน'},
-    {'english': 'Laceration', 'thai': 'แผลฉีกขาด'},
-    {'english': 'Melanocytic Nevi', 'thai': 'ไฝ'},
-    {'english': 'Melanoma', 'thai': 'มะเร็งผิวหนังชนิดเมลาโนมา'},
-    {'english': 'Normal', 'thai': 'ผิวปกติ'},
-    {'english': 'Pressure Wounds', 'thai': 'แผลกดทับ'},
-    {'english': 'Seborrheic Keratoses', 'thai': 'กระเนื้อ'},
-    {'english': 'Squamous Cell Carcinoma', 'thai': 'มะเร็งผิวหนังชนิดสความัสเซลล์'},
-    {'english': 'Surgical Wounds', 'thai': 'แผลผ่าตัด'},
-    {'english': 'Vascular Lesion', 'thai': 'รอยโรคเส้นเลือด'},
-    {'english': 'Venous Wounds', 'thai': 'แผลหลอดเลือดดำบกพร่อง'}
-]
-
-# สร้าง list ของชื่อภาษาอังกฤษสำหรับใช้กับ np.argmax
-class_names = [item['english'] for item in class_names_map]
-
-# Dictionary สำหรับเก็บข้อมูลเพิ่มเติมของแต่ละประเภทอาการ
-# คุณสามารถแก้ไขข้อมูลเหล่านี้ให้ถูกต้องและครบถ้วนตามที่คุณต้องการได้เลยนะครับ
-class_details = {
-    'Abrasions': {
-        'treatment': 'ทำความสะอาดแผลด้วยน้ำสะอาดและสบู่เบาๆ ทาครีมฆ่าเชื้อและปิดด้วยผ้าก๊อซ',
-        'avoid': 'หลีกเลี่ยงการแกะเกาแผล และไม่ให้แผลโดนสิ่งสกปรก',
-        'severe_warning': 'หากมีเลือดออกมาก แผลลึก มีหนอง บวมแดง หรือปวดมาก ควรพบแพทย์ทันที'
-    },
-    'Acne': {
-        'treatment': 'ใช้ผลิตภัณฑ์ทำความสะอาดผิวหน้าสำหรับสิว ทายาแต้มสิวที่มีส่วนผสมของ Benzoyl Peroxide หรือ Salicylic Acid',
-        'avoid': 'หลีกเลี่ยงการบีบสิว การใช้เครื่องสำอางที่อุดตันรูขุมขน และอาหารที่มีน้ำตาลสูง',
-        'severe_warning': 'หากสิวอักเสบมาก เป็นสิวหัวช้าง หรือมีอาการปวดรุนแรง ควรปรึกษาแพทย์ผิวหนัง'
-    },
-    'Actinic Keratosis': {
-        'treatment': 'ปรึกษาแพทย์ผิวหนังเพื่อการรักษา เช่น การจี้ด้วยความเย็น การใช้ยาเฉพาะที่ หรือการผ่าตัดเล็ก',
-        'avoid': 'หลีกเลี่ยงการโดนแสงแดดจัดโดยตรง และควรทาครีมกันแดดเป็นประจำ',
-        'severe_warning': 'หากรอยโรคมีการเปลี่ยนแปลงขนาด สี หรือมีเลือดออก ควรพบแพทย์โดยเร็วที่สุด เพราะอาจพัฒนาเป็นมะเร็งผิวหนังได้'
-    },
-    'Basal Cell Carcinoma': {
-        'treatment': 'ปรึกษาแพทย์ผิวหนังเพื่อการรักษา เช่น การผ่าตัด การฉายรังสี หรือการใช้ยาเฉพาะที่',
-        'avoid': 'หลีกเลี่ยงการโดนแสงแดดจัด และควรตรวจผิวหนังเป็นประจำ',
-        'severe_warning': 'เป็นมะเร็งผิวหนังที่ต้องได้รับการรักษาโดยแพทย์ผู้เชี่ยวชาญทันที'
-    },
-    'Bruises': {
-        'treatment': 'ประคบเย็นในช่วง 24-48 ชั่วโมงแรก จากนั้นประคบอุ่นเพื่อช่วยให้เลือดไหลเวียนดีขึ้น',
-        'avoid': 'หลีกเลี่ยงการนวดหรือกดบริเวณที่ช้ำแรงๆ ในช่วงแรก',
-        'severe_warning': 'หากรอยช้ำใหญ่ขึ้นอย่างรวดเร็ว ปวดมากผิดปกติ หรือเกิดจากการบาดเจ็บรุนแรง ควรพบแพทย์'
-    },
-    'Burns': {
-        'treatment': 'แผลไหม้ระดับ 1-2: ล้างด้วยน้ำสะอาดหรือน้ำเกลือ ประคบเย็น ทายาสำหรับแผลไหม้',
-        'avoid': 'ห้ามใช้ยาสีฟัน น้ำปลา หรือน้ำแข็งประคบแผลไหม้',
-        'severe_warning': 'แผลไหม้ระดับ 3 ขึ้นไป แผลใหญ่ มีตุ่มพองขนาดใหญ่ หรือไหม้บริเวณใบหน้า มือ เท้า อวัยวะเพศ ควรพบแพทย์ทันที'
-    },
-    'Cut': {
-        'treatment': 'ทำความสะอาดแผลด้วยน้ำสะอาดและสบู่ ทาครีมฆ่าเชื้อ ปิดด้วยผ้าก๊อซหรือพลาสเตอร์',
-        'avoid': 'หลีกเลี่ยงการให้แผลโดนน้ำสกปรก และการแกะเกา',
-        'severe_warning': 'หากแผลลึก เลือดออกไม่หยุด มีหนอง หรือปวดมาก ควรพบแพทย์เพื่อเย็บแผลหรือรับการรักษา'
-    },
-    'Dermatofibroma': {
-        'treatment': 'โดยทั่วไปไม่จำเป็นต้องรักษา หากต้องการเอาออกเพื่อความสวยงาม สามารถปรึกษาแพทย์เพื่อผ่าตัดเล็กได้',
-        'avoid': 'หลีกเลี่ยงการแกะเกาบ่อยๆ',
-        'severe_warning': 'หากมีการเปลี่ยนแปลงขนาด สี หรือมีอาการเจ็บปวด ควรปรึกษาแพทย์เพื่อตรวจวินิจฉัยเพิ่มเติม'
-    },
-    'Diabetic Wounds': {
-        'treatment': 'ทำความสะอาดแผลอย่างสม่ำเสมอ ควบคุมระดับน้ำตาลในเลือด และปรึกษาแพทย์เพื่อการดูแลแผลที่เหมาะสม',
-        'avoid': 'หลีกเลี่ยงการเดินเท้าเปล่า และการใส่รองเท้าที่ไม่เหมาะสม',
-        'severe_warning': 'แผลเบาหวานมักหายยากและเสี่ยงต่อการติดเชื้อสูง ควรพบแพทย์ผู้เชี่ยวชาญทันที'
-    },
-    'Laceration': {
-        'treatment': 'ทำความสะอาดแผล ห้ามเลือด และปรึกษาแพทย์เพื่อประเมินว่าต้องเย็บแผลหรือไม่',
-        'avoid': 'หลีกเลี่ยงการสัมผัสแผลด้วยมือที่ไม่สะอาด',
-        'severe_warning': 'หากแผลลึก กว้าง เลือดออกมาก หรือมีสิ่งแปลกปลอมติดอยู่ในแผล ควรพบแพทย์ทันที'
-    },
-    'Melanocytic Nevi': {
-        'treatment': 'โดยทั่วไปไม่จำเป็นต้องรักษา แต่ควรสังเกตการเปลี่ยนแปลง',
-        'avoid': 'หลีกเลี่ยงการแกะเกาไฝ และควรทาครีมกันแดด',
-        'severe_warning': 'หากไฝมีการเปลี่ยนแปลงขนาด รูปร่าง สี ขอบไม่เรียบ มีอาการคัน หรือมีเลือดออก ควรปรึกษาแพทย์ผิวหนังทันที (อาจเป็นสัญญาณของมะเร็งผิวหนัง)'
-    },
-    'Melanoma': {
-        'treatment': 'ต้องได้รับการรักษาโดยแพทย์ผู้เชี่ยวชาญทันที เช่น การผ่าตัด การฉายรังสี หรือเคมีบำบัด',
-        'avoid': 'หลีกเลี่ยงการโดนแสงแดดจัด และควรตรวจผิวหนังเป็นประจำ',
-        'severe_warning': 'เป็นมะเร็งผิวหนังชนิดร้ายแรงที่สุด ต้องได้รับการวินิจฉัยและรักษาโดยแพทย์ผู้เชี่ยวชาญโดยเร็วที่สุด'
-    },
-    'Normal': {
-        'treatment': 'ดูแลผิวพรรณให้สะอาด ชุ่มชื้น และทาครีมกันแดดเป็นประจำ',
-        'avoid': 'ไม่มีข้อควรหลีกเลี่ยงเฉพาะเจาะจง แต่ควรดูแลสุขภาพโดยรวม',
-        'severe_warning': 'หากมีอาการผิดปกติใดๆ เกิดขึ้น ควรปรึกษาแพทย์'
-    },
-    'Pressure Wounds': {
-        'treatment': 'ลดแรงกดทับบริเวณแผล พลิกตัวบ่อยๆ ทำความสะอาดแผล และปรึกษาแพทย์เพื่อการดูแลแผลที่เหมาะสม',
-        'avoid': 'หลีกเลี่ยงการนอนหรือนั่งท่าเดิมเป็นเวลานาน',
-        'severe_warning': 'หากแผลลึก มีการติดเชื้อ หรือมีไข้ ควรพบแพทย์ทันที'
-    },
-    'Seborrheic Keratoses': {
-        'treatment': 'โดยทั่วไปไม่จำเป็นต้องรักษา หากต้องการเอาออกเพื่อความสวยงาม สามารถปรึกษาแพทย์เพื่อจี้ด้วยความเย็นหรือเลเซอร์ได้',
-        'avoid': 'ไม่มีข้อควรหลีกเลี่ยงเฉพาะเจาะจง',
-        'severe_warning': 'หากมีการเปลี่ยนแปลงขนาด สี หรือมีอาการคัน/เจ็บปวด ควรปรึกษาแพทย์เพื่อตรวจวินิจฉัยเพิ่มเติม'
-    },
-    'Squamous Cell Carcinoma': {
-        'treatment': 'ปรึกษาแพทย์ผิวหนังเพื่อการรักษา เช่น การผ่าตัด การฉายรังสี หรือการใช้ยาเฉพาะที่',
-        'avoid': 'หลีกเลี่ยงการโดนแสงแดดจัด และควรตรวจผิวหนังเป็นประจำ',
-        'severe_warning': 'เป็นมะเร็งผิวหนังที่ต้องได้รับการรักษาโดยแพทย์ผู้เชี่ยวชาญทันที'
-    },
-    'Surgical Wounds': {
-        'treatment': 'ทำความสะอาดแผลตามคำแนะนำของแพทย์ เปลี่ยนผ้าปิดแผลตามกำหนด และสังเกตอาการติดเชื้อ',
-        'avoid': 'หลีกเลี่ยงการให้แผลโดนน้ำโดยไม่จำเป็น และการยกของหนัก',
-        'severe_warning': 'หากแผลบวมแดงร้อน มีหนอง มีไข้ หรือปวดมาก ควรพบแพทย์ทันที'
-    },
-    'Vascular Lesion': {
-        'treatment': 'ปรึกษาแพทย์ผิวหนังเพื่อการวินิจฉัยและวางแผนการรักษา เช่น เลเซอร์ การผ่าตัด หรือการฉีดสารบางชนิด',
-        'avoid': 'หลีกเลี่ยงการแกะเกาหรือทำให้เกิดการบาดเจ็บ',
-        'severe_warning': 'หากมีการเปลี่ยนแปลงขนาด สี หรือมีเลือดออก ควรปรึกษาแพทย์'
-    },
-    'Venous Wounds': {
-        'treatment': 'ทำความสะอาดแผล พันผ้ายืดหรือใส่ถุงน่องรัด เพื่อช่วยการไหลเวียนของเลือด และปรึกษาแพทย์เพื่อการดูแลแผลที่เหมาะสม',
-        'avoid': 'หลีกเลี่ยงการยืนหรือนั่งห้อยขานานๆ',
-        'severe_warning': 'หากแผลมีการติดเชื้อ บวมแดงร้อน หรือมีไข้ ควรพบแพทย์ทันที'
-    }
-}
+# รายชื่อ class (class_names_map, class_names) และ class_details อยู่ใน class_catalog.py
 
 # Dictionary สำหรับเก็บข้อมูลวิธีรักษาอาการเบื้องต้นทั่วไป
 # คุณสามารถเพิ่มอาการและวิธีรักษาได้ตามต้องการ
@@ -221,6 +188,40 @@ common_symptoms_treatments = {
 }
 
 
+# Intent ของข้อความทั่วไป (ใช้เมื่อผู้ใช้อยู่ในสถานะ idle) เรียงตามลำดับความสำคัญ
+# และข้อความตอบกลับของแต่ละ intent
+intent_keywords = (
+    ('alternatives', ('ความเป็นไปได้อื่น', 'ผลอื่น', 'other possibilities')), # ตอบจาก top-k ที่เก็บไว้ใน state
+    ('greeting', ('สวัสดี', 'hi')),
+    ('about', ('คืออะไร', 'ทำอะไรได้')),
+    ('thanks', ('ขอบคุณ',)),
+)
+intent_replies = {
+    'greeting': "สวัสดีครับ คุณหมอ AI ยินดีให้บริการครับ! 👋\nส่งรูปภาพผิวหนังหรือบาดแผลมาให้ผมช่วยวิเคราะห์เบื้องต้นได้เลยนะครับ",
+    'about': "ผมคือ AI สำหรับวิเคราะห์รูปภาพโรคผิวหนังและบาดแผลเบื้องต้นครับ\nเพียงแค่ส่งรูปภาพเข้ามา ผมจะช่วยวิเคราะห์โรคของคุณจากภาพที่ส่งมา",
+    'thanks': "ยินดีครับ หากมีคำถามหรือต้องการให้ช่วยวิเคราะห์อีก ส่งรูปมาได้เลยนะครับ!",
+}
+UNKNOWN_TEXT_REPLY = "ผมยังไม่เข้าใจคำถามครับ โปรดส่งรูปภาพเพื่อให้ผมช่วยวิเคราะห์เบื้องต้นครับ 😊"
+IMAGE_FOLLOW_UP_QUESTION = "\n\n**เพื่อบันทึกข้อมูลเพิ่มเติม:**\nอาการนี้เกิดขึ้นที่ส่วนไหนของร่างกายครับ/คะ? (เช่น แขน, ขา, ใบหน้า, ลำตัว)"
+
+# รูปที่โมเดลมั่นใจต่ำ (เช่น selfie, อาหาร, รูปเบลอ) ได้คำตอบสั้นๆ ให้ถ่ายใหม่ และไม่บันทึกสถานะ
+# ตั้งค่าได้ด้วย RETAKE_CONFIDENCE_THRESHOLD (ต่ำกว่านี้ขอให้ถ่ายใหม่ 0 = ปิด)
+# UNCERTAIN_CONFIDENCE_THRESHOLD (ต่ำกว่านี้ตอบผลเต็มพร้อมแนะนำให้ดูความเป็นไปได้อื่น)
+# และ PREDICTION_TOP_K (จำนวน class ที่เก็บไว้ใน state สำหรับ intent 'alternatives')
+RETAKE_CONFIDENCE_THRESHOLD = float(os.getenv('RETAKE_CONFIDENCE_THRESHOLD', '0.35'))
+UNCERTAIN_CONFIDENCE_THRESHOLD = float(os.getenv('UNCERTAIN_CONFIDENCE_THRESHOLD', '0.6'))
+PREDICTION_TOP_K = int(os.getenv('PREDICTION_TOP_K', '3'))
+RETAKE_REPLY_TEMPLATE = (
+    "ขออภัยครับ AI ยังวิเคราะห์รูปนี้ได้ไม่ชัดเจน (ความมั่นใจ: {confidence:.2f})\n"
+    "โปรดถ่ายรูปใหม่ให้เห็นบริเวณผิวหนังหรือบาดแผลชัดๆ ในที่มีแสงสว่างพอ และไม่เบลอ แล้วส่งมาอีกครั้งนะครับ 📷"
+)
+ALTERNATIVES_HINT = "\n\nพิมพ์ 'ความเป็นไปได้อื่น' เพื่อดูผลการวิเคราะห์อันดับอื่นๆ ได้ครับ"
+NO_ALTERNATIVES_REPLY = "ยังไม่มีผลการวิเคราะห์รูปภาพล่าสุดครับ ส่งรูปภาพมาให้ผมช่วยวิเคราะห์ได้เลยนะครับ"
+
+# สร้างดัชนี keyword (อาการ + intent) และข้อความตอบกลับทั้งหมดไว้ครั้งเดียวตอนเริ่มระบบ (ดู routing_index.py)
+# อาการใน common_symptoms_treatments เพิ่มคำพ้องได้ด้วย key 'synonyms' เช่น 'synonyms': ['ปวดศีรษะ']
+routing_index = build_routing_index(common_symptoms_treatments, intent_keywords, class_names_map, class_details)
+
 # ----------------------------------------------------------------------
 # ฟังก์ชันช่วยในการจัดการสถานะและข้อมูลใน Firestore
 # ----------------------------------------------------------------------
@@ -228,77 +229,183 @@ common_symptoms_treatments = {
 USER_STATES_COLLECTION = 'user_states'
 # Collection สำหรับเก็บข้อมูลการวินิจฉัยที่สมบูรณ์
 DIAGNOSES_COLLECTION = 'diagnoses'
+# Collection สำหรับเก็บสถิติการวินิจฉัยรายวันต่อ class (ดู diagnosis_stats.py)
+DIAGNOSIS_STATS_COLLECTION = 'diagnosis_stats'
+
+# สถานะถูก cache แบบ write-through ในหน่วยความจำ และป้องกันการเขียนทับกันระหว่าง instance
+# ด้วย optimistic concurrency (ดู state_store.py)
+# ตั้งค่าได้ด้วย STATE_CACHE_TTL และ STATE_EXPIRY (วินาที: สถานะ waiting_for_* ที่เก่ากว่านี้ถือว่า idle)
+# cache ใช้เฉพาะสถานะ waiting_for_* (cache เก่าจะทำให้การเขียนชนกันแล้วอ่านใหม่ แลกกับ round trip ที่เพิ่มขึ้น)
+# STATE_CACHE_TTL ที่สั้นลดโอกาสชนกันเมื่อมีหลาย instance หรือหลาย worker แต่อ่าน Firestore บ่อยขึ้น
+user_state_store = UserStateStore(
+    get_db,
+    USER_STATES_COLLECTION,
+    cache_ttl=float(os.getenv('STATE_CACHE_TTL', '30')),
+    state_expiry=float(os.getenv('STATE_EXPIRY', '3600')),
+)
 
 def get_user_state(user_id):
-    """ดึงสถานะปัจจุบันและข้อมูลชั่วคราวของผู้ใช้จาก Firestore."""
-    if db is None:
-        print("Firestore is not initialized. Cannot get user state.")
-        return {'state': 'idle', 'data': {}}
-    
-    doc_ref = db.collection(USER_STATES_COLLECTION).document(user_id)
-    doc = doc_ref.get()
-    if doc.exists:
-        return doc.to_dict()
-    return {'state': 'idle', 'data': {}} # สถานะเริ่มต้นถ้าไม่มีข้อมูล
-
-def update_user_state(user_id, state, data=None):
-    """อัปเดตสถานะและข้อมูลชั่วคราวของผู้ใช้ใน Firestore."""
-    if db is None:
-        print("Firestore is not initialized. Cannot update user state.")
-        return
-    
-    doc_ref = db.collection(USER_STATES_COLLECTION).document(user_id)
-    update_data = {'state': state}
-    if data is not None:
-        update_data['data'] = data
-    else: # ถ้าไม่ได้ส่ง data มา ให้ลบ data เก่าออก หรือตั้งเป็นค่าว่าง
-        update_data['data'] = {} 
-    
-    doc_ref.set(update_data, merge=True) # merge=True เพื่อรวมข้อมูล ไม่ใช่เขียนทับทั้งหมด
-    print(f"User {user_id} state updated to: {state}")
+    """ดึงสถานะปัจจุบันและข้อมูลชั่วคราวของผู้ใช้ (จาก cache หรือ Firestore)."""
+    with telemetry.phase('state_read'):
+        return user_state_store.get(user_id)
+
+def update_user_state(user_id, state, data=None, force=False):
+    """อัปเดตสถานะและข้อมูลชั่วคราวของผู้ใช้ใน Firestore (raise StateConflictError ถ้ามีการเขียนชนกัน)."""
+    with telemetry.phase('state_write'):
+        user_state_store.set(user_id, state, data, force=force)
+
+# record การวินิจฉัยถูกเขียนแบบ buffer ใน background (ดู diagnosis_sink.py) ผู้ใช้จึงไม่ต้องรอ Firestore
+# ตั้งค่าได้ด้วย DIAGNOSIS_FLUSH_SIZE, DIAGNOSIS_FLUSH_INTERVAL (วินาที) และ DIAGNOSIS_SPILL_PATH
+# (worker ของ prefork_server.py ใช้ไฟล์ spill เดียวกันได้ ไฟล์ถูก lock ด้วย flock ระหว่างต่อท้ายและนำกลับมาเขียน)
+# ตั้ง DIAGNOSIS_BUFFERED_WRITES=0 เพื่อกลับไปเขียน record พร้อมรีเซ็ตสถานะใน batch write เดียวแบบ synchronous
+DIAGNOSIS_BUFFERED_WRITES = os.getenv('DIAGNOSIS_BUFFERED_WRITES', '1') != '0'
+
+# ตัวนับสถิติรายวันต่อ class ถูกเพิ่มใน batch write เดียวกับ record (ดู diagnosis_stats.py)
+# ตั้งค่าได้ด้วย DIAGNOSIS_STATS_SHARDS และ DIAGNOSIS_STATS_TIMEZONE ตั้ง DIAGNOSIS_STATS=0 เพื่อปิด
+diagnosis_stats = (
+    DiagnosisStats.from_env(DIAGNOSIS_STATS_COLLECTION) if os.getenv('DIAGNOSIS_STATS', '1') != '0' else None
+)
+
+diagnosis_sink = BufferedDiagnosisSink(
+    get_db,
+    DIAGNOSES_COLLECTION,
+    flush_size=int(os.getenv('DIAGNOSIS_FLUSH_SIZE', '50')),
+    flush_interval=float(os.getenv('DIAGNOSIS_FLUSH_INTERVAL', '5')),
+    spill_path=os.getenv('DIAGNOSIS_SPILL_PATH', '/tmp/khunmoa_diagnoses_spill.jsonl'),
+    stats=diagnosis_stats,
+) if DIAGNOSIS_BUFFERED_WRITES else None
 
 def save_diagnosis_record(user_id, record_data):
-    """บันทึกข้อมูลการวินิจฉัยที่สมบูรณ์ลงใน Firestore."""
+    """บันทึกข้อมูลการวินิจฉัยที่สมบูรณ์ลงใน Firestore (ผ่าน buffer ไม่ต้องรอการเขียน ถ้าเปิดใช้)."""
+    record_data['user_id'] = user_id # เพิ่ม user_id เข้าไปใน record
+    if diagnosis_sink is not None:
+        # timestamp (Server Timestamp ของ Firestore) จะถูกเพิ่มตอนเขียนจริง
+        with telemetry.phase('record_save'):
+            diagnosis_sink.submit(record_data)
+        log.debug("Diagnosis record buffered for user %s", user_id)
+        return
+
+    # DIAGNOSIS_BUFFERED_WRITES=0: เขียน record (พร้อมตัวนับสถิติ) ทันทีใน batch write เดียว
+    db = get_db()
     if db is None:
-        print("Firestore is not initialized. Cannot save diagnosis record.")
+        log.warning("Firestore is not initialized. Cannot save diagnosis record.")
+        return
+    from firebase_admin import firestore
+
+    record_data['timestamp'] = firestore.SERVER_TIMESTAMP
+    with telemetry.phase('record_save'):
+        batch = db.batch()
+        batch.create(db.collection(DIAGNOSES_COLLECTION).document(), record_data)
+        if diagnosis_stats is not None:
+            diagnosis_stats.add_to_batch(db, batch, [record_data])
+        batch.commit()
+    log.debug("Diagnosis record saved for user %s", user_id)
+
+def complete_diagnosis(user_id, record_data):
+    """บันทึกข้อมูลการวินิจฉัยที่สมบูรณ์ และรีเซ็ตสถานะผู้ใช้เป็น idle."""
+    if diagnosis_sink is not None:
+        # รีเซ็ตสถานะก่อน: ถ้าชนกับ request อื่น (StateConflictError) จะยังไม่มี record ค้างใน buffer
+        # และการลองใหม่ใน handle_text_message จะไม่บันทึก record ซ้ำ
+        update_user_state(user_id, 'idle', {})
+        save_diagnosis_record(user_id, record_data)
         return
-    
-    # เพิ่ม timestamp เข้าไปในข้อมูล
+
+    from firebase_admin import firestore # โหลดไปแล้วตอน init Firestore จึงไม่เสียเวลาเพิ่ม
+
+    # ไม่ใช้ buffer: เขียน record และรีเซ็ตสถานะใน batch write เดียว
     record_data['timestamp'] = firestore.SERVER_TIMESTAMP # ใช้ Server Timestamp ของ Firestore
     record_data['user_id'] = user_id # เพิ่ม user_id เข้าไปใน record
-    
-    db.collection(DIAGNOSES_COLLECTION).add(record_data)
-    print(f"Diagnosis record saved for user {user_id}")
-    
+    with telemetry.phase('record_save'):
+        user_state_store.complete(user_id, DIAGNOSES_COLLECTION, record_data, stats=diagnosis_stats)
+
 # ----------------------------------------------------------------------
 # 4. ฟังก์ชันสำหรับการรับ Webhook จาก LINE
 # ----------------------------------------------------------------------
+# Event ใน webhook เดียวกันจากผู้ใช้ต่างกันจะถูกประมวลผลพร้อมกัน แต่ event ของผู้ใช้คนเดียวกัน
+# ยังเรียงตามลำดับเสมอ (ดู user_dispatcher.py)
+# ตั้งค่าได้ด้วย DISPATCH_MAX_WORKERS และ DISPATCH_MAX_PENDING
+def process_event(event):
+    """ประมวลผล event หนึ่งตัวด้วย handler ที่ลงทะเบียนไว้ พร้อมจับเวลาทุกขั้น (ดู telemetry.py)."""
+    from webhook_queue import dispatch_event
+
+    message = getattr(event, 'message', None)
+    kind = getattr(message, 'type', None) or getattr(event, 'type', None) or 'unknown'
+    with telemetry.request(kind):
+        dispatch_event(handler, event)
+
+def _create_dispatcher():
+    from user_dispatcher import UserOrderedDispatcher
+
+    return UserOrderedDispatcher(
+        process_event,
+        max_workers=int(os.getenv('DISPATCH_MAX_WORKERS', '4')),
+        max_pending=int(os.getenv('DISPATCH_MAX_PENDING', '64')),
+    )
+
+_dispatcher_resource = LazyResource('event-dispatcher', _create_dispatcher)
+
+# โหมด Asynchronous (ASYNC_WEBHOOKS=1): ตรวจ signature แล้วใส่ event ลงคิว ตอบ 200 ทันที
+# แล้วให้ dispatcher ด้านบนประมวลผลต่อ (ดู webhook_queue.py)
+# ตั้งค่าได้ด้วย ASYNC_QUEUE_SIZE, ASYNC_QUEUE_FULL_POLICY (reject/block ส่วน inline จะถูกใช้เป็น block
+# เพราะ event ที่ข้ามคิวจะแซง event เก่าของผู้ใช้คนเดียวกัน)
+# ASYNC_QUEUE_PUT_TIMEOUT (วินาที) และ WEBHOOK_DEDUP_FIRESTORE=1 (ตรวจ event ที่ส่งซ้ำข้าม instance)
+ASYNC_WEBHOOKS = os.getenv('ASYNC_WEBHOOKS', '0') == '1'
+
+def _create_event_queue():
+    from webhook_queue import EventDeduplicator, WebhookEventQueue
+
+    use_firestore = os.getenv('WEBHOOK_DEDUP_FIRESTORE', '0') == '1'
+    # ใช้ worker ตัวเดียวส่งต่อ event ให้ dispatcher ตามลำดับในคิว เพื่อรักษาลำดับของแต่ละผู้ใช้
+    # submit จะรอเมื่อ dispatcher มีงานค้างครบ DISPATCH_MAX_PENDING ทำให้คิวเต็มและเกิด back-pressure
+    return WebhookEventQueue(
+        _dispatcher_resource.get().submit,
+        workers=1,
+        max_queue=int(os.getenv('ASYNC_QUEUE_SIZE', '256')),
+        full_policy=os.getenv('ASYNC_QUEUE_FULL_POLICY', 'block'),
+        put_timeout=float(os.getenv('ASYNC_QUEUE_PUT_TIMEOUT', '2')),
+        deduplicator=EventDeduplicator(db_getter=get_db if use_firestore else None),
+        ordered=True,
+    )
+
+_event_queue_resource = LazyResource('webhook-queue', _create_event_queue)
+
 # Cloud Functions จะรับ Request object มาตรงๆ
+# ถ้ารันบนเครื่องของตัวเอง ใช้ prefork_server.py ครอบฟังก์ชันนี้ด้วย worker หลาย process ได้
 def main(request): # เปลี่ยนชื่อฟังก์ชันจาก callback เป็น main
     # Cloud Functions จะจัดการ Request body และ headers ให้
     # ดึงค่า X-Line-Signature จาก Header
     signature = request.headers.get('X-Line-Signature')
     body = request.get_data(as_text=True)
 
-    # Log Request body (สำหรับ Debugging ใน Cloud Logging)
-    print("Request body: " + body)
+    # ไม่ log body เพราะมีข้อความของผู้ใช้ (และเสียเวลาทุก request) บันทึกเฉพาะขนาด
+    log.debug("Received %s request (%d bytes)", request.method, len(body))
 
     # ถ้าเป็น GET Request (สำหรับการ Verify Webhook)
     if request.method == 'GET':
-        print("Received GET request to /callback (for verification).")
+        if METRICS_ENDPOINT and getattr(request, 'path', '').rstrip('/').endswith('/metrics'):
+            return telemetry.render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+        log.info("Received GET request to /callback (for verification).")
         return 'OK', 200 # ตอบกลับ 200 OK ทันที
 
     # ถ้าเป็น POST Request (สำหรับ LINE Event จริงๆ)
     try:
-        # ประมวลผล Webhook Event โดยใช้ Line Webhook Handler
-        # handler.handle จะเรียกฟังก์ชัน handle_text_message หรือ handle_image_message
-        handler.handle(body, signature)
+        if ASYNC_WEBHOOKS:
+            # ตรวจ signature และแปลง body เป็น event แล้วส่งเข้าคิว ไม่รอการประมวลผล
+            payload = handler.parser.parse(body, signature, as_payload=True)
+            if not _event_queue_resource.get().submit(payload.events):
+                log.warning("Webhook event queue is full. Rejecting request.")
+                return "Service Unavailable", 503 # ให้ LINE ส่ง event ซ้ำภายหลัง
+        else:
+            # ประมวลผล Webhook Event: handler.parser ตรวจ signature และแปลง body เป็น event
+            # จากนั้น dispatcher จะเรียก handle_text_message หรือ handle_image_message แยกตามผู้ใช้
+            payload = handler.parser.parse(body, signature, as_payload=True)
+            _dispatcher_resource.get().dispatch_all(payload.events)
     except InvalidSignatureError:
-        print("Invalid signature. Please check your channel access token/channel secret or Webhook URL.")
+        log.warning("Invalid signature. Please check your channel access token/channel secret or Webhook URL.")
         # ใน Cloud Functions เราจะ return Response object แทน abort
         return "Invalid signature", 400
     except Exception as e:
-        print(f"Error handling webhook event: {e}")
+        log.error(f"Error handling webhook event: {e}")
         return "Internal Server Error", 500 # ตอบกลับ Error 500 ถ้ามีปัญหาอื่น
 
     return 'OK', 200 # ตอบกลับ LINE ว่าได้รับ Request แล้ว
@@ -306,163 +413,186 @@ def main(request): # เปลี่ยนชื่อฟังก์ชัน
 # ----------------------------------------------------------------------
 # 5. ฟังก์ชันจัดการข้อความ Text Message
 # ----------------------------------------------------------------------
-@handler.add(MessageEvent, message=TextMessage)
-def handle_text_message(event):
-    user_id = event.source.user_id # ดึง User ID ของผู้ใช้
+def send_reply(reply_token, text):
+    """ตอบกลับผู้ใช้ด้วยข้อความ (จับเวลาเป็นขั้น reply_send)."""
+    with telemetry.phase('reply_send'):
+        line_bot_api.reply_message(reply_token, TextMessage(text=text))
+
+def reply_for_conversation(user_id, original_text, route):
+    """เลื่อนสถานะการสนทนาตามข้อความของผู้ใช้ และคืนข้อความที่จะตอบกลับ."""
     user_state = get_user_state(user_id) # ดึงสถานะปัจจุบันของผู้ใช้
 
-    text_message = event.message.text.lower() # แปลงข้อความเป็นตัวพิมพ์เล็กเพื่อการเปรียบเทียบ
-    reply_text = "" # ข้อความตอบกลับเริ่มต้น
+    if route.intent == 'alternatives':
+        # ตอบจาก top-k ที่เก็บไว้ตอนวิเคราะห์รูป (ไม่ดาวน์โหลดรูปหรือรันโมเดลใหม่ และไม่เปลี่ยนสถานะ)
+        top_k = user_state.get('data', {}).get('top_k')
+        if not top_k:
+            telemetry.count('alternatives_missing')
+            return NO_ALTERNATIVES_REPLY
+        telemetry.count('alternatives_stored')
+        reply_text = routing_index.alternatives_reply(top_k)
+        if user_state['state'] == 'waiting_for_location':
+            reply_text += IMAGE_FOLLOW_UP_QUESTION # ยังรอคำตอบเรื่องตำแหน่งอยู่
+        return reply_text
 
-    # --- ตรวจสอบคำถามอาการเบื้องต้นทั่วไปก่อน (ใหม่!) ---
-    for symptom, details in common_symptoms_treatments.items():
-        if symptom in text_message: # ตรวจสอบว่าอาการอยู่ในข้อความหรือไม่
-            reply_text = (
-                f"**💡 วิธีรักษาเบื้องต้นสำหรับอาการ{symptom}:**\n"
-                f"{details['treatment']}\n\n"
-                f"**⚠️ คำเตือนสำคัญ:**\n"
-                f"{details['warning']}\n\n"
-                f"ข้อมูลนี้เป็นเพียงคำแนะนำเบื้องต้นจากระบบ AI และไม่สามารถใช้แทนการวินิจฉัยของแพทย์ได้\n"
-                f"เพื่อการวินิจฉัยที่ถูกต้องและแม่นยำที่สุด **โปรดปรึกษาแพทย์ผู้เชี่ยวชาญ** หรือผู้เชี่ยวชาญด้านสุขภาพ"
-            )
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextMessage(text=reply_text)
-            )
-            return # หยุดการทำงานเมื่อพบอาการและตอบกลับแล้ว
-
-    # --- ตรวจสอบสถานะการสนทนา (สำหรับข้อมูลจากรูปภาพ) ---
     if user_state['state'] == 'waiting_for_location':
         # ผู้ใช้ตอบคำถามตำแหน่งของอาการ
         diagnosis_data = user_state.get('data', {})
-        diagnosis_data['location'] = event.message.text # บันทึกตำแหน่งที่ผู้ใช้ส่งมา
+        diagnosis_data['location'] = original_text # บันทึกตำแหน่งที่ผู้ใช้ส่งมา
 
         update_user_state(user_id, 'waiting_for_other_symptoms', diagnosis_data)
-        reply_text = "ขอบคุณสำหรับข้อมูลตำแหน่งครับ\nมีอาการอื่นๆ ร่วมด้วยไหมครับ? (เช่น คัน, ปวด, มีไข้, บวมแดง, ผื่นขึ้น) หากไม่มีให้พิมพ์ 'ไม่มี' ครับ"
-    
-    elif user_state['state'] == 'waiting_for_other_symptoms':
+        return "ขอบคุณสำหรับข้อมูลตำแหน่งครับ\nมีอาการอื่นๆ ร่วมด้วยไหมครับ? (เช่น คัน, ปวด, มีไข้, บวมแดง, ผื่นขึ้น) หากไม่มีให้พิมพ์ 'ไม่มี' ครับ"
+
+    if user_state['state'] == 'waiting_for_other_symptoms':
         # ผู้ใช้ตอบคำถามอาการอื่นๆ
         diagnosis_data = user_state.get('data', {})
-        other_symptoms = event.message.text.strip()
+        other_symptoms = original_text.strip()
         if other_symptoms.lower() == 'ไม่มี':
             diagnosis_data['other_symptoms'] = 'ไม่มี'
         else:
             diagnosis_data['other_symptoms'] = other_symptoms
 
-        # บันทึกข้อมูลการวินิจฉัยที่สมบูรณ์ลง Firestore
-        save_diagnosis_record(user_id, diagnosis_data)
-        
-        # รีเซ็ตสถานะเป็น idle และล้างข้อมูลชั่วคราว
-        update_user_state(user_id, 'idle', {}) 
-        reply_text = "ขอบคุณสำหรับข้อมูลครับ ข้อมูลของคุณถูกบันทึกไว้เพื่อเป็นประโยชน์ต่อไป\nหากต้องการวิเคราะห์รูปภาพอีกครั้ง ส่งรูปมาได้เลยนะครับ!"
-
-    else: # สถานะ 'idle' หรือสถานะอื่นๆ ที่ไม่เกี่ยวข้องกับการสนทนาต่อเนื่อง
-        # โค้ดสำหรับตอบข้อความทั่วไปเหมือนเดิม
-        if "สวัสดี" in text_message or "hi" in text_message:
-            reply_text = "สวัสดีครับ คุณหมอ AI ยินดีให้บริการครับ! 👋\nส่งรูปภาพผิวหนังหรือบาดแผลมาให้ผมช่วยวิเคราะห์เบื้องต้นได้เลยนะครับ"
-        elif "คืออะไร" in text_message or "ทำอะไรได้" in text_message:
-            reply_text = "ผมคือ AI สำหรับวิเคราะห์รูปภาพโรคผิวหนังและบาดแผลเบื้องต้นครับ\nเพียงแค่ส่งรูปภาพเข้ามา ผมจะช่วยวิเคราะห์โรคของคุณจากภาพที่ส่งมา"
-        elif "ขอบคุณ" in text_message:
-            reply_text = "ยินดีครับ หากมีคำถามหรือต้องการให้ช่วยวิเคราะห์อีก ส่งรูปมาได้เลยนะครับ!"
-        else:
-            reply_text = "ผมยังไม่เข้าใจคำถามครับ โปรดส่งรูปภาพเพื่อให้ผมช่วยวิเคราะห์เบื้องต้นครับ 😊"
+        # บันทึกข้อมูลการวินิจฉัยที่สมบูรณ์ลง Firestore และรีเซ็ตสถานะเป็น idle
+        complete_diagnosis(user_id, diagnosis_data)
+        return "ขอบคุณสำหรับข้อมูลครับ ข้อมูลของคุณถูกบันทึกไว้เพื่อเป็นประโยชน์ต่อไป\nหากต้องการวิเคราะห์รูปภาพอีกครั้ง ส่งรูปมาได้เลยนะครับ!"
+
+    # สถานะ 'idle' หรือสถานะอื่นๆ ที่ไม่เกี่ยวข้องกับการสนทนาต่อเนื่อง
+    # ตอบข้อความทั่วไปตาม intent ที่พบในข้อความ
+    return intent_replies.get(route.intent, UNKNOWN_TEXT_REPLY)
+
+@handler.add(MessageEvent, message=TextMessage)
+def handle_text_message(event):
+    user_id = event.source.user_id # ดึง User ID ของผู้ใช้
+
+    text_message = event.message.text.lower() # แปลงข้อความเป็นตัวพิมพ์เล็กเพื่อการเปรียบเทียบ
+    reply_text = "" # ข้อความตอบกลับเริ่มต้น
+
+    # สแกนข้อความรอบเดียวเพื่อหาทั้งอาการและ intent (ดู routing_index.py)
+    route = routing_index.route(text_message)
+
+    # --- ตรวจสอบคำถามอาการเบื้องต้นทั่วไปก่อน (ใหม่!) ---
+    # (ตรวจก่อนดึงสถานะ เพราะไม่ต้องใช้สถานะของผู้ใช้ จึงไม่ต้องอ่าน Firestore)
+    if route.symptom is not None:
+        send_reply(event.reply_token, routing_index.symptom_replies[route.symptom])
+        return # หยุดการทำงานเมื่อพบอาการและตอบกลับแล้ว
+
+    # --- ตรวจสอบสถานะการสนทนา (สำหรับข้อมูลจากรูปภาพ) ---
+    try:
+        reply_text = reply_for_conversation(user_id, event.message.text, route)
+    except StateConflictError as e:
+        # request อื่นเปลี่ยนสถานะไปก่อน (cache ถูกล้างแล้ว) อ่านสถานะล่าสุดแล้วลองใหม่อีกครั้ง
+        log.info(f"{e}. Retrying with fresh state.")
+        reply_text = reply_for_conversation(user_id, event.message.text, route)
 
     # ตอบกลับผู้ใช้ด้วยข้อความ (เฉพาะกรณีที่ยังไม่ได้ตอบจากอาการเบื้องต้น)
-    line_bot_api.reply_message(
-        event.reply_token,
-        TextMessage(text=reply_text)
-    )
+    send_reply(event.reply_token, reply_text)
 
 # ----------------------------------------------------------------------
 # 6. ฟังก์ชันจัดการรูปภาพ (Image Message)
 # ----------------------------------------------------------------------
+def predict_image(inference, image_data):
+    """คืน vector ความน่าจะเป็นของทุก class สำหรับรูป (bytes หรือ memoryview) โดยใช้ cache ก่อนรันโมเดล."""
+    from preprocessing import preprocess_image
+
+    prediction_cache = get_prediction_cache()
+    cache_key = tensor_key = None
+    if prediction_cache is not None:
+        # รูปเดิมที่ส่งซ้ำ/ส่งต่อ ไม่ต้อง decode และ invoke ใหม่
+        cache_key, predictions = prediction_cache.lookup_bytes(image_data)
+        if predictions is not None:
+            telemetry.label(cache='bytes_hit')
+            return predictions
+
+    # Preprocess image (decode แบบย่อสเกล + เขียนลง buffer ตาม dtype ของโมเดล ดู preprocessing.py)
+    img_array = preprocess_image(BufferReader(image_data), inference.pool.input_details[0], timer=telemetry)
+
+    if prediction_cache is not None:
+        tensor_key, predictions = prediction_cache.lookup_tensor(img_array)
+        if predictions is not None:
+            telemetry.label(cache='tensor_hit')
+            prediction_cache.store(predictions, cache_key)
+            return predictions
+
+    # Predict ด้วย TFLite Interpreter จาก pool (อาจถูกรวม batch กับ request อื่นที่เข้ามาพร้อมกัน)
+    telemetry.label(cache='miss' if prediction_cache is not None else 'off')
+    with telemetry.phase('invoke'):
+        predictions = inference.predict(img_array)
+    if prediction_cache is not None:
+        prediction_cache.store(predictions, cache_key, tensor_key)
+    return predictions
+
 @handler.add(MessageEvent, message=ImageMessage)
 def handle_image_message(event):
     user_id = event.source.user_id # ดึง User ID ของผู้ใช้
 
-    if interpreter is None:
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextMessage(text="ขออภัยครับ เราไม่เข้าใจคำถาม")
-        )
-        return
+    # ไลบรารีประมวลผลภาพโหลดเฉพาะเมื่อมีรูปภาพเข้ามา (Text Message ไม่ต้องรอ)
+    import numpy as np
 
-    message_content = line_bot_api.get_message_content(event.message.id)
-    image_bytes = io.BytesIO(message_content.content)
+    inference = get_inference()
+    if inference is None:
+        send_reply(event.reply_token, "ขออภัยครับ เราไม่เข้าใจคำถาม")
+        return
 
     try:
-        # Preprocess image
-        img = Image.open(image_bytes).convert('RGB')
-        img = img.resize((224, 224))
-        img_array = np.array(img)
-        img_array = img_array / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
-
-        # Predict ด้วย TFLite Interpreter
-        interpreter.set_tensor(input_details[0]['index'], img_array.astype(input_details[0]['dtype']))
-        interpreter.invoke()
-        predictions = interpreter.get_tensor(output_details[0]['index'])
-        
-        predicted_class_index = np.argmax(predictions[0])
-        predicted_class_english_name = class_names[predicted_class_index] # ได้ชื่อภาษาอังกฤษจากโมเดล
-        confidence = np.max(predictions[0])
-
-        # ค้นหาชื่อภาษาไทยที่เกี่ยวข้อง
-        predicted_class_thai_name = ""
-        for item in class_names_map:
-            if item['english'] == predicted_class_english_name:
-                predicted_class_thai_name = item['thai']
-                break
-        
-        # ถ้าหาชื่อไทยไม่เจอ ให้ใช้ชื่ออังกฤษแทน
-        if not predicted_class_thai_name:
-            predicted_class_thai_name = predicted_class_english_name
-
-        # ดึงข้อมูลเพิ่มเติมจาก class_details (ใช้ชื่อภาษาอังกฤษเป็น Key)
-        details = class_details.get(predicted_class_english_name, {})
-        treatment_info = details.get('treatment', 'ไม่มีข้อมูลวิธีรักษาเบื้องต้น')
-        avoid_info = details.get('avoid', 'ไม่มีข้อมูลสิ่งที่ควรหลีกเลี่ยง')
-        severe_warning_info = details.get('severe_warning', 'ไม่มีคำเตือนสำหรับอาการรุนแรง')
-
-        # สร้างข้อความตอบกลับที่สมบูรณ์ขึ้น
-        reply_text = (
-            f"จากการวิเคราะห์เบื้องต้น AI คาดการณ์ว่ารูปภาพนี้มีลักษณะคล้ายกับ:\n"
-            f"**{predicted_class_thai_name} ({predicted_class_english_name})**\n" # แสดงทั้งไทยและอังกฤษ
-            f"(ความมั่นใจ: {confidence:.2f})\n\n"
-            f"**💡 วิธีรักษาเบื้องต้น:**\n"
-            f"{treatment_info}\n\n"
-            f"**🚫 สิ่งที่ควรหลีกเลี่ยง:**\n"
-            f"{avoid_info}\n\n"
-            f"**🚨 หากอาการรุนแรง/ผิดปกติ:**\n"
-            f"{severe_warning_info}\n\n"
-            f"**⚠️ คำเตือนสำคัญ:**\n"
-            f"ข้อมูลนี้เป็นเพียงการวิเคราะห์เบื้องต้นจากระบบ AI และไม่สามารถใช้แทนการวินิจฉัยของแพทย์ได้\n"
-            f"เพื่อการวินิจฉัยที่ถูกต้องและแม่นยำที่สุด **โปรดปรึกษาแพทย์ผู้เชี่ยวชาญ** หรือผู้เชี่ยวชาญด้านสุขภาพ"
-        )
+        with telemetry.phase('download'):
+            image_data = image_downloader.fetch(line_bot_api, event.message.id)
+        predictions = predict_image(inference, image_data)
         
+        # class อันดับต้นๆ เรียงจากมากไปน้อย (อันดับแรกคือผลการทำนาย)
+        top_indices = np.argsort(predictions)[::-1][:max(1, PREDICTION_TOP_K)]
+        predicted_class_index = int(top_indices[0])
+        confidence = float(predictions[predicted_class_index])
+
+        # ชื่อไทย/อังกฤษ รายละเอียด และข้อความตอบกลับของ class ถูกเตรียมไว้แล้วใน routing_index
+        class_info = routing_index.classes[predicted_class_index]
+        predicted_class_english_name = class_info.english # ได้ชื่อภาษาอังกฤษจากโมเดล
+        predicted_class_thai_name = class_info.thai
+        telemetry.label(predicted_class=predicted_class_english_name)
+
+        if confidence < RETAKE_CONFIDENCE_THRESHOLD:
+            # ไม่น่าจะเป็นรูปผิวหนังที่ชัดเจน: ตอบสั้นๆ ให้ถ่ายใหม่ ไม่เขียนสถานะ
+            telemetry.count('image_retake')
+            send_reply(event.reply_token, RETAKE_REPLY_TEMPLATE.format(confidence=confidence))
+            return
+
+        reply_text = routing_index.class_reply(predicted_class_index, confidence)
+        if confidence < UNCERTAIN_CONFIDENCE_THRESHOLD:
+            telemetry.count('image_uncertain')
+            reply_text += ALTERNATIVES_HINT
+        else:
+            telemetry.count('image_confident')
+
         # บันทึกข้อมูลการวินิจฉัยเบื้องต้นลงใน Firestore ชั่วคราว
-        # เพื่อรอข้อมูลเพิ่มเติมจากผู้ใช้
+        # เพื่อรอข้อมูลเพิ่มเติมจากผู้ใช้ (top_k ใช้ตอบ "ความเป็นไปได้อื่น" โดยไม่ต้องรันโมเดลใหม่)
         temp_diagnosis_data = {
             'predicted_class_english': predicted_class_english_name,
             'predicted_class_thai': predicted_class_thai_name,
-            'confidence': float(confidence) # แปลงเป็น float ปกติก่อนบันทึก
+            'confidence': confidence, # เป็น float ปกติแล้ว บันทึกลง Firestore ได้
+            'top_k': [
+                {'class': routing_index.classes[i].english, 'confidence': round(float(predictions[i]), 4)}
+                for i in top_indices
+            ],
         }
-        update_user_state(user_id, 'waiting_for_location', temp_diagnosis_data)
+        update_user_state(user_id, 'waiting_for_location', temp_diagnosis_data, force=True) # เริ่มการวินิจฉัยใหม่ ทับสถานะเดิมได้เลย
 
         # ตอบกลับผู้ใช้ด้วยข้อความผลการวิเคราะห์ และถามคำถามแรก
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextMessage(text=reply_text + "\n\n**เพื่อบันทึกข้อมูลเพิ่มเติม:**\nอาการนี้เกิดขึ้นที่ส่วนไหนของร่างกายครับ/คะ? (เช่น แขน, ขา, ใบหน้า, ลำตัว)")
-        )
+        send_reply(event.reply_token, reply_text + IMAGE_FOLLOW_UP_QUESTION)
         return # ออกจากฟังก์ชันหลังจากตอบและเปลี่ยนสถานะ
 
+    except ContentRejectedError as e:
+        telemetry.label(error=e.__class__.__name__)
+        max_mb = image_downloader.max_bytes // (1024 * 1024)
+        formats = f"{', '.join(ACCEPTED_IMAGE_FORMATS[:-1])} หรือ {ACCEPTED_IMAGE_FORMATS[-1]}"
+        reply_text = f"ขออภัยครับ ไม่สามารถวิเคราะห์ไฟล์นี้ได้ โปรดส่งรูปภาพ ({formats}) ที่มีขนาดไม่เกิน {max_mb} MB"
+        log.warning(f"Rejected image content: {e}")
+    except PoolExhaustedError as e:
+        telemetry.label(error=e.__class__.__name__)
+        reply_text = "ขออภัยครับ ขณะนี้มีผู้ส่งรูปภาพเข้ามาจำนวนมาก โปรดลองส่งรูปภาพอีกครั้งในอีกสักครู่"
+        log.warning(f"Interpreter pool exhausted: {e}")
     except Exception as e:
+        telemetry.label(error=e.__class__.__name__)
         reply_text = f"ขออภัยครับ เกิดข้อผิดพลาดในการประมวลผลรูปภาพ: {e}\nโปรดลองอีกครั้งหรือส่งรูปภาพที่ชัดเจนขึ้น"
-        print(f"Error processing image: {e}")
+        log.error(f"Error processing image: {e}")
 
-    line_bot_api.reply_message(
-        event.reply_token,
-        TextMessage(text=reply_text)
-    )
+    send_reply(event.reply_token, reply_text)
 
 # ไม่ต้องมี if __name__ == "__main__": ใน Cloud Functions
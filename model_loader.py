@@ -0,0 +1,145 @@
+# ----------------------------------------------------------------------
+# การโหลดโมเดล TFLite
+# ----------------------------------------------------------------------
+# เลือกใช้ runtime ที่เบาที่สุดที่ติดตั้งอยู่ (ai_edge_litert หรือ tflite_runtime)
+# และ fallback ไปใช้ tensorflow เต็มตัวเมื่อไม่มี เพื่อลดเวลา import ตอน cold start
+# สามารถบังคับเลือก runtime ได้ด้วย environment variable TFLITE_RUNTIME
+#
+# รองรับโมเดลหลายแบบจากไฟล์ต้นฉบับเดียวกัน (เลือกด้วย MODEL_VARIANT):
+#   float    ไฟล์ต้นฉบับ
+#   float16  post-training float16 quantization (<ชื่อไฟล์>_float16.tflite) ขนาดครึ่งหนึ่ง
+#   int8     post-training integer quantization (<ชื่อไฟล์>_int8.tflite) เล็กและเร็วที่สุดบน CPU
+# ไฟล์ quantized สร้างด้วย quantize_model.py การแปลง input/output ตาม dtype และค่า quantization
+# ทำอัตโนมัติจาก input_details/output_details (ดู preprocessing.py และ batch_scheduler.py)
+import os
+from collections import namedtuple
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+# ลำดับการลองโหลด runtime (เบาที่สุดก่อน)
+RUNTIME_CANDIDATES = ('ai_edge_litert', 'tflite_runtime', 'tensorflow')
+
+LoadedModel = namedtuple('LoadedModel', ['interpreter', 'input_details', 'output_details', 'runtime'])
+
+MODEL_VARIANTS = ('float', 'float16', 'int8')
+# โมเดล float ที่มากับ repo (path สัมพัทธ์กับ root ของ repo)
+DEFAULT_MODEL_PATH = 'khunmoa_skin_diagnosis_final_model.tflite'
+
+# ค่าของ delegate:
+#   default  ให้ runtime เลือกเอง (runtime รุ่นใหม่ใช้ XNNPACK เป็นค่าเริ่มต้นบน CPU)
+#   xnnpack  ชื่อเรียกอีกแบบของ default (op resolver แบบ BUILTIN คือค่าเริ่มต้นของ runtime อยู่แล้ว)
+#            ไม่ได้บังคับใช้ XNNPACK และตั้งค่า option ของ XNNPACK ไม่ได้ (จำนวน thread มาจาก num_threads)
+#   none     ปิด default delegate ทั้งหมด (ใช้ kernel อ้างอิงของ TFLite ไว้เทียบผล)
+#   <path>   โหลด external delegate จากไฟล์ .so ด้วย load_delegate
+DELEGATE_DEFAULT = 'default'
+DELEGATE_XNNPACK = 'xnnpack'
+DELEGATE_NONE = 'none'
+
+
+def variant_path(model_path, variant):
+    """path ของไฟล์โมเดลแบบ variant (float คือไฟล์ต้นฉบับ)."""
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Unknown model variant '{variant}' (choose from {', '.join(MODEL_VARIANTS)})")
+    if variant == 'float':
+        return model_path
+    stem, ext = os.path.splitext(model_path)
+    return f"{stem}_{variant}{ext}"
+
+
+def resolve_model_path(model_path, variant=None):
+    """เลือกไฟล์โมเดลตาม variant (ค่าเริ่มต้นจาก MODEL_VARIANT) ถ้าไม่มีไฟล์จะใช้ไฟล์ float แทน."""
+    variant = variant or os.getenv('MODEL_VARIANT', 'float')
+    path = variant_path(model_path, variant)
+    if path != model_path and not os.path.exists(path):
+        log.warning(f"Model variant '{variant}' not found at {path}; falling back to {model_path}")
+        return model_path
+    return path
+
+
+def _import_runtime_module(runtime):
+    # module ที่มี Interpreter, load_delegate และ OpResolverType
+    if runtime == 'ai_edge_litert':
+        from ai_edge_litert import interpreter
+        return interpreter
+    if runtime == 'tflite_runtime':
+        from tflite_runtime import interpreter
+        return interpreter
+    if runtime == 'tensorflow':
+        import tensorflow as tf
+        return tf.lite.experimental
+    raise ValueError(f"Unknown TFLite runtime: {runtime}")
+
+
+def _import_interpreter_class(runtime):
+    if runtime == 'tensorflow':
+        import tensorflow as tf
+        return tf.lite.Interpreter
+    return _import_runtime_module(runtime).Interpreter
+
+
+def _delegate_kwargs(runtime, delegate):
+    # แปลงค่า delegate เป็น argument ของ Interpreter
+    if not delegate or delegate in (DELEGATE_DEFAULT, DELEGATE_XNNPACK):
+        return {}
+    module = _import_runtime_module(runtime)
+    if delegate == DELEGATE_NONE:
+        return {'experimental_op_resolver_type': module.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES}
+    return {'experimental_delegates': [module.load_delegate(delegate)]}
+
+
+def resolve_interpreter_class(preferred=None):
+    """คืน (Interpreter class, ชื่อ runtime) จาก runtime ที่เบาที่สุดที่ import ได้."""
+    preferred = preferred or os.getenv('TFLITE_RUNTIME')
+    if preferred:
+        return _import_interpreter_class(preferred), preferred
+
+    last_error = None
+    for runtime in RUNTIME_CANDIDATES:
+        try:
+            return _import_interpreter_class(runtime), runtime
+        except ImportError as e:
+            last_error = e
+    raise ImportError(f"No TFLite runtime available (tried {', '.join(RUNTIME_CANDIDATES)}): {last_error}")
+
+
+def load_model(model_path, timer=None, num_threads=None, delegate=None):
+    """สร้าง Interpreter จากไฟล์โมเดลและ allocate tensors
+
+    ถ้าส่ง StartupTimer มา จะบันทึกเวลา import runtime และเวลา allocate แยกกัน
+    num_threads คือจำนวน thread ภายใน (intra-op) ของ interpreter ตัวนี้ (None = ค่าเริ่มต้นของ runtime)
+    delegate ดูค่าที่รองรับได้ที่ DELEGATE_* ด้านบน (None = default)
+    """
+    if timer is not None:
+        with timer.phase('model_import'):
+            interpreter_class, runtime = resolve_interpreter_class()
+            kwargs = _delegate_kwargs(runtime, delegate)
+        with timer.phase('model_allocate'):
+            interpreter = interpreter_class(model_path=model_path, num_threads=num_threads, **kwargs)
+            interpreter.allocate_tensors()
+    else:
+        interpreter_class, runtime = resolve_interpreter_class()
+        interpreter = interpreter_class(model_path=model_path, num_threads=num_threads,
+                                        **_delegate_kwargs(runtime, delegate))
+        interpreter.allocate_tensors()
+
+    log.info(f"TFLite Model loaded successfully! (runtime: {runtime}, model: {os.path.basename(model_path)}, "
+             f"delegate: {delegate or DELEGATE_DEFAULT})")
+    return LoadedModel(
+        interpreter=interpreter,
+        input_details=interpreter.get_input_details(),
+        output_details=interpreter.get_output_details(),
+        runtime=runtime,
+    )
+
+
+def file_fingerprint(model_path):
+    """คืน sha256 (hex) ของไฟล์โมเดล ใช้เป็น model version เพื่อให้ cache เก่าใช้ไม่ได้เมื่อเปลี่ยนโมเดล."""
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,197 @@
+# ----------------------------------------------------------------------
+# Cache ผลการทำนายตามเนื้อหารูปภาพ (Content-addressed)
+# ----------------------------------------------------------------------
+# ผู้ใช้มักส่งรูปเดิมซ้ำ หรือส่งต่อรูปเดียวกันในกลุ่มแชท จึงเก็บผลลัพธ์ของโมเดลไว้ตาม
+#   1. sha256 ของ bytes ของรูป (ตรงกันทุก byte)
+#   2. (ทางเลือก) perceptual hash ของ tensor 224x224 เพื่อให้รูปเดียวกันที่ถูก re-encode ก็ hit ได้
+# ชั้นแรกเป็น LRU ในหน่วยความจำ (จำกัดจำนวนและอายุ) และมีชั้น Firestore แบบถาวรเป็นทางเลือก
+# ทุก entry บันทึก model version (sha256 ของไฟล์ .tflite) ไว้ เมื่อเปลี่ยนโมเดล entry เก่าจะถือว่า miss
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+# Collection สำหรับเก็บ cache แบบถาวร
+PREDICTION_CACHE_COLLECTION = 'prediction_cache'
+
+
+def content_key(image_bytes):
+    return 'sha256:' + hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_key(tensor):
+    """gradient hash ของ tensor (H, W, 3): เฉลี่ยเป็นตาราง 8x8 แล้วเทียบค่าความสว่างช่องข้างเคียง."""
+    gray = np.asarray(tensor, dtype=np.float32).mean(axis=-1)
+    h, w = gray.shape
+    grid = gray[:h - h % 8, :w - w % 8].reshape(8, h // 8, 8, w // 8).mean(axis=(1, 3))
+    bits = np.concatenate([(grid[:, 1:] > grid[:, :-1]).ravel(), (grid[1:, :] > grid[:-1, :]).ravel()])
+    return 'phash:' + np.packbits(bits).tobytes().hex()
+
+
+class FirestoreCacheTier:
+    """ชั้น cache ถาวรบน Firestore ใช้ร่วมกันได้ระหว่างหลาย instance."""
+
+    def __init__(self, db_getter, collection=PREDICTION_CACHE_COLLECTION):
+        self._db_getter = db_getter
+        self.collection = collection
+
+    def get(self, key):
+        db = self._db_getter()
+        if db is None:
+            return None
+        doc = db.collection(self.collection).document(key.replace(':', '_')).get()
+        return doc.to_dict() if doc.exists else None
+
+    def put(self, key, entry):
+        db = self._db_getter()
+        if db is None:
+            return
+        db.collection(self.collection).document(key.replace(':', '_')).set(entry)
+
+
+class PredictionCache:
+    """LRU cache ของผลลัพธ์โมเดล (vector ความน่าจะเป็นของทุก class)."""
+
+    def __init__(self, model_version, max_entries=1024, ttl_seconds=86400, persistent=None, perceptual=False,
+                 stats_log_every=100):
+        self.model_version = model_version
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persistent = persistent
+        self.perceptual = perceptual
+        self.stats_log_every = stats_log_every
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (predictions, model_version, expires_at)
+        self._lookups = 0
+        self._counters = {
+            'hits_memory': 0,
+            'hits_perceptual': 0,
+            'hits_persistent': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expired': 0,
+            'stale_model': 0,
+        }
+
+    @classmethod
+    def from_env(cls, model_version, db_getter=None):
+        """สร้าง cache ตาม PREDICTION_CACHE_* environment variables."""
+        persistent = None
+        if os.getenv('PREDICTION_CACHE_PERSISTENT', '0') == '1' and db_getter is not None:
+            persistent = FirestoreCacheTier(db_getter)
+        return cls(
+            model_version,
+            max_entries=int(os.getenv('PREDICTION_CACHE_MAX_ENTRIES', '1024')),
+            ttl_seconds=float(os.getenv('PREDICTION_CACHE_TTL', '86400')),
+            persistent=persistent,
+            perceptual=os.getenv('PREDICTION_CACHE_PERCEPTUAL', '0') == '1',
+        )
+
+    def _count(self, name):
+        # เรียกเมื่อการค้นหาหนึ่งครั้งจบลง (hit หรือ miss) และพิมพ์สถิติทุกๆ stats_log_every ครั้ง
+        with self._lock:
+            self._counters[name] += 1
+            self._lookups += 1
+            should_log = self.stats_log_every and self._lookups % self.stats_log_every == 0
+        if should_log:
+            log.info(f"Prediction cache stats: {self.stats()}")
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            predictions, model_version, expires_at = entry
+            if model_version != self.model_version or expires_at < time.time():
+                del self._entries[key]
+                self._counters['stale_model' if model_version != self.model_version else 'expired'] += 1
+                return None
+            self._entries.move_to_end(key)
+            return predictions
+
+    def _put_memory(self, key, predictions, expires_at=None):
+        if expires_at is None:
+            expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (predictions, self.model_version, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def _get_persistent(self, key):
+        try:
+            entry = self.persistent.get(key)
+        except Exception as e:
+            log.warning(f"Error reading prediction cache: {e}")
+            return None
+        if not entry or entry.get('model_version') != self.model_version:
+            return None
+        expires_at = entry.get('created_at', 0) + self.ttl_seconds
+        if expires_at < time.time():
+            return None
+        predictions = tuple(entry['predictions'])
+        # หมดอายุพร้อม entry ใน Firestore ไม่ใช่นับใหม่ตั้งแต่ตอนที่คัดลอกมา
+        self._put_memory(key, predictions, expires_at)
+        return predictions
+
+    def lookup_bytes(self, image_bytes):
+        """ค้นหาด้วย bytes ของรูป คืน (key, predictions หรือ None)."""
+        key = content_key(image_bytes)
+        predictions = self._get_memory(key)
+        if predictions is not None:
+            self._count('hits_memory')
+            return key, np.asarray(predictions)
+        if self.persistent is not None:
+            predictions = self._get_persistent(key)
+            if predictions is not None:
+                self._count('hits_persistent')
+                return key, np.asarray(predictions)
+        return key, None
+
+    def lookup_tensor(self, tensor):
+        """ค้นหาด้วย perceptual hash ของ tensor (ถ้าเปิดใช้) คืน (key, predictions หรือ None)."""
+        if not self.perceptual:
+            self._count('misses')
+            return None, None
+        key = perceptual_key(tensor)
+        predictions = self._get_memory(key)
+        if predictions is not None:
+            self._count('hits_perceptual')
+            return key, np.asarray(predictions)
+        self._count('misses')
+        return key, None
+
+    def store(self, predictions, *keys):
+        """บันทึกผลลัพธ์ภายใต้ทุก key ที่ให้มา (key ที่เป็น None จะถูกข้าม)."""
+        predictions = tuple(float(p) for p in predictions)
+        for key in keys:
+            if key is None:
+                continue
+            self._put_memory(key, predictions)
+            if self.persistent is not None and key.startswith('sha256:'):
+                try:
+                    self.persistent.put(key, {
+                        'predictions': list(predictions),
+                        'model_version': self.model_version,
+                        'created_at': time.time(),
+                    })
+                except Exception as e:
+                    log.warning(f"Error writing prediction cache: {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        hits = stats['hits_memory'] + stats['hits_perceptual'] + stats['hits_persistent']
+        lookups = hits + stats['misses']
+        stats['hit_rate'] = round(hits / lookups, 3) if lookups else 0.0
+        return stats
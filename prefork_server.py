@@ -0,0 +1,308 @@
+# ----------------------------------------------------------------------
+# โหมด Self-hosted: HTTP server แบบ pre-fork หลาย process ครอบ main(request)
+# ----------------------------------------------------------------------
+# thread ใน process เดียวติด GIL ระหว่าง decode/resize รูป จึงแยกเป็นหลาย worker process:
+#   1. master import ไลบรารีหนัก (numpy, PIL, TFLite runtime, linebot, firebase_admin) และ mmap
+#      ไฟล์โมเดลพร้อมแตะทุก page ให้อยู่ใน page cache ก่อน fork
+#      worker จึงใช้ code/ข้อมูลของไลบรารีร่วมกันแบบ copy-on-write และ TFLite ซึ่ง mmap ไฟล์โมเดล
+#      แบบอ่านอย่างเดียวเช่นกันจะใช้ page ชุดเดียวกันใน page cache (ไม่มีสำเนาโมเดลต่อ worker)
+#   2. master เปิด socket ที่ port เดียว แล้ว fork worker N ตัวที่ accept จาก socket เดียวกัน
+#   3. worker import main (สร้าง interpreter, Firestore client และ thread ต่างๆ หลัง fork เท่านั้น
+#      เพราะสิ่งเหล่านี้ใช้ข้าม fork ไม่ได้) แล้ว warm-up ด้วยการ decode รูปและ invoke() หนึ่งครั้ง
+#      ก่อนเริ่มรับ request
+#   4. worker ที่รับ request ครบ max_requests จะหยุดรับงาน รอ request ที่ค้างอยู่ flush ข้อมูล แล้วออก
+#      master จะ fork ตัวใหม่แทน (ป้องกัน memory โตขึ้นเรื่อยๆ)
+#   5. แต่ละ worker ทำงานพร้อมกันได้ไม่เกิน threads request เมื่อครบจะหยุด accept
+#      connection ใหม่จึงรออยู่ใน backlog ให้ worker ที่ว่างรับไปแทน
+# worker แต่ละตัวมี cache สถานะผู้ใช้ของตัวเอง master จึงตั้ง STATE_CACHE_TTL=0 ให้ (ถ้ายังไม่ได้ตั้ง)
+# ทุกข้อความอ่านสถานะจาก Firestore ใหม่ (การเขียนยังมีเงื่อนไข update_time ดู state_store.py)
+#
+# วิธีใช้:
+#   python prefork_server.py --workers 4 --port 8080 --max-requests 2000
+# หรือตั้งค่าด้วย PREFORK_WORKERS, PORT, PREFORK_MAX_REQUESTS, PREFORK_THREADS
+# แนะนำให้ใช้ INTERPRETER_POOL_SIZE=1 และ INTERPRETER_NUM_THREADS=1 ในโหมดนี้ (ขนานกันที่ระดับ process)
+import argparse
+import io
+import logging
+import mmap
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+
+import model_loader
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+# worker ที่ตายเร็วกว่านี้หลังเริ่มถือว่า crash ตอนเริ่มต้น (หน่วงก่อน fork ใหม่เพื่อไม่ให้วนเร็วเกินไป)
+MIN_WORKER_LIFETIME = 5.0
+
+
+def preload_libraries():
+    """import ไลบรารีหนักทั้งหมดใน master เพื่อให้ worker ใช้ร่วมกันหลัง fork."""
+    import numpy # noqa: F401
+    import PIL.Image # noqa: F401
+    import firebase_admin # noqa: F401
+    import linebot # noqa: F401
+    import flask # noqa: F401
+
+    import batch_scheduler # noqa: F401
+    import preprocessing # noqa: F401
+    import prediction_cache # noqa: F401
+
+    model_loader.resolve_interpreter_class()
+
+
+def premap_model(model_path):
+    """mmap ไฟล์โมเดลแบบอ่านอย่างเดียวและแตะทุก page ให้อยู่ใน page cache (คืน mmap ไว้ตลอดอายุ master)."""
+    with open(model_path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mapped, 'madvise'):
+        mapped.madvise(mmap.MADV_WILLNEED)
+    for offset in range(0, len(mapped), mmap.PAGESIZE):
+        mapped[offset]
+    return mapped
+
+
+def create_app(entry_point):
+    """Flask app ที่ส่งทุก request ให้ entry_point(request) แบบเดียวกับ functions-framework."""
+    from flask import Flask, request
+
+    app = Flask('khunmoa')
+
+    @app.route('/', defaults={'path': ''}, methods=['GET', 'POST'])
+    @app.route('/<path:path>', methods=['GET', 'POST'])
+    def dispatch(path):
+        return entry_point(request)
+
+    return app
+
+
+def bound_threads(server, limit):
+    """จำกัด thread ที่ประมวลผล request พร้อมกัน (server แบบ threaded สร้าง thread ต่อ connection ไม่จำกัด)."""
+    slots = threading.BoundedSemaphore(limit)
+    process_request, process_request_thread = server.process_request, server.process_request_thread
+
+    def bounded_process_request(request, client_address):
+        # รอที่นี่ทำให้ serve_forever ไม่ accept connection ถัดไปจนกว่าจะมี thread ว่าง
+        slots.acquire()
+        try:
+            process_request(request, client_address)
+        except BaseException:
+            slots.release()
+            raise
+
+    def bounded_process_request_thread(request, client_address):
+        try:
+            process_request_thread(request, client_address)
+        finally:
+            slots.release()
+
+    server.process_request = bounded_process_request
+    server.process_request_thread = bounded_process_request_thread
+
+
+class _RequestLimit:
+    """WSGI middleware ที่นับ request และเรียก on_limit ครั้งเดียวเมื่อครบ limit."""
+
+    def __init__(self, app, limit, on_limit):
+        self.app = app
+        self.limit = limit
+        self.on_limit = on_limit
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def __call__(self, environ, start_response):
+        try:
+            return self.app(environ, start_response)
+        finally:
+            with self._lock:
+                self.count += 1
+                reached = self.limit and self.count == self.limit
+            if reached:
+                self.on_limit()
+
+
+def warm_up(app):
+    """โหลดโมเดลและรัน decode + invoke หนึ่งครั้ง ให้ request แรกไม่ต้องจ่ายค่าเริ่มต้น."""
+    import numpy as np
+    from PIL import Image
+
+    from preprocessing import preprocess_image
+
+    started = time.perf_counter()
+    app.get_db()
+    app.get_prediction_cache()
+    inference = app.get_inference()
+    if inference is None:
+        log.error("Model failed to load; worker will answer image messages with an error reply")
+        return
+    image = io.BytesIO()
+    Image.fromarray(np.full((480, 640, 3), 128, dtype=np.uint8)).save(image, format='JPEG')
+    image.seek(0)
+    inference.predict(preprocess_image(image, inference.pool.input_details[0]))
+    log.info(f"Worker {os.getpid()} warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+
+def wait_for_background_work(app, timeout=30.0):
+    # โหมด async: รอให้ event ที่อยู่ในคิวประมวลผลเสร็จก่อนออก
+    deadline = time.monotonic() + timeout
+    while app.ASYNC_WEBHOOKS and time.monotonic() < deadline:
+        if (app._event_queue_resource.get().stats()['queued'] == 0
+                and app._dispatcher_resource.get().stats()['active_lanes'] == 0):
+            break
+        time.sleep(0.05)
+    if app.diagnosis_sink is not None:
+        app.diagnosis_sink.flush()
+
+
+def run_worker(listen_fd, host, port, max_requests, threads):
+    from werkzeug.serving import make_server
+
+    import main as app # import หลัง fork: interpreter, client และ thread ทั้งหมดเป็นของ worker นี้
+
+    warm_up(app)
+    limited_app = _RequestLimit(create_app(app.main), max_requests, None)
+    server = make_server(host, port, limited_app, threaded=threads > 1, fd=listen_fd)
+    if threads > 1:
+        bound_threads(server, threads)
+    # ให้ server_close รอ request ที่กำลังทำงานอยู่จนเสร็จ
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def stop(reason):
+        log.info(f"Worker {os.getpid()} stopping: {reason}")
+        # shutdown() รอจน serve_forever จบ จึงต้องเรียกจาก thread อื่น
+        threading.Thread(target=server.shutdown, name='worker-shutdown', daemon=True).start()
+
+    limited_app.on_limit = lambda: stop(f"served {max_requests} requests")
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop('SIGTERM'))
+
+    log.info(f"Worker {os.getpid()} accepting requests on {host}:{port}")
+    server.serve_forever()
+    server.server_close()
+    wait_for_background_work(app)
+
+
+class PreforkServer:
+    """master process: เตรียมทรัพยากรที่ใช้ร่วมกัน fork worker และ fork ใหม่แทนตัวที่ออกไป."""
+
+    def __init__(self, host='0.0.0.0', port=8080, workers=2, max_requests=1000, max_requests_jitter=0.1,
+                 threads=4, model_path=None):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.threads = threads
+        self.model_path = model_path or model_loader.resolve_model_path(model_loader.DEFAULT_MODEL_PATH)
+        self._children = {} # pid -> เวลาที่เริ่ม
+        self._stopping = False
+        self._model_map = None
+
+    @classmethod
+    def from_env(cls, **overrides):
+        config = dict(
+            host=os.getenv('HOST', '0.0.0.0'),
+            port=int(os.getenv('PORT', '8080')),
+            workers=int(os.getenv('PREFORK_WORKERS', str(os.cpu_count() or 1))),
+            max_requests=int(os.getenv('PREFORK_MAX_REQUESTS', '1000')),
+            threads=int(os.getenv('PREFORK_THREADS', '4')),
+        )
+        config.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**config)
+
+    def _worker_limit(self):
+        # สุ่มเพิ่มเล็กน้อยเพื่อไม่ให้ worker ทุกตัว recycle พร้อมกัน
+        if not self.max_requests:
+            return 0
+        return self.max_requests + random.randint(0, int(self.max_requests * self.max_requests_jitter))
+
+    def _spawn(self, listen_fd):
+        limit = self._worker_limit()
+        pid = os.fork()
+        if pid == 0:
+            # ไม่ใช้ signal handler ของ master (SIGTERM จะถูกตั้งใหม่ใน run_worker หลัง warm-up)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN) # master จัดการ Ctrl+C แล้วส่ง SIGTERM มาให้
+            code = 0
+            try:
+                random.seed() # ไม่ให้ทุก worker ได้ลำดับสุ่มเดียวกับ master
+                run_worker(listen_fd, self.host, self.port, limit, self.threads)
+            except Exception:
+                log.exception(f"Worker {os.getpid()} crashed")
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        self._children[pid] = time.monotonic()
+        log.info(f"Started worker {pid} (max_requests={limit or 'unlimited'})")
+
+    def _terminate_children(self, signum, frame):
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def serve_forever(self):
+        # worker import main หลัง fork จึงเห็นค่านี้ (cache แยกต่อ worker อาจคืนสถานะเก่า)
+        os.environ.setdefault('STATE_CACHE_TTL', '0')
+        started = time.perf_counter()
+        preload_libraries()
+        self._model_map = premap_model(self.model_path)
+        log.info(f"Preloaded libraries and mapped {self.model_path} ({len(self._model_map) / 1024 / 1024:.1f} MB) "
+                 f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        listener = socket.create_server((self.host, self.port), backlog=2048)
+        listener.set_inheritable(True)
+        signal.signal(signal.SIGTERM, self._terminate_children)
+        signal.signal(signal.SIGINT, self._terminate_children)
+        log.info(f"Prefork server listening on {self.host}:{self.port} with {self.workers} workers")
+
+        for _ in range(self.workers):
+            self._spawn(listener.fileno())
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            started = self._children.pop(pid, None)
+            if started is None:
+                continue
+            log.info(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}")
+            if self._stopping:
+                continue
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(1.0)
+            self._spawn(listener.fileno())
+        listener.close()
+        log.info("Prefork server stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve main(request) with pre-forked worker processes')
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--workers', type=int, help='จำนวน worker process (ค่าเริ่มต้นเท่าจำนวน CPU)')
+    parser.add_argument('--max-requests', type=int, help='recycle worker หลังรับ request ครบจำนวนนี้ (0 = ไม่ recycle)')
+    parser.add_argument('--threads', type=int, help='จำนวน request ที่แต่ละ worker ทำพร้อมกันได้ (รอ I/O)')
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        sys.exit("Prefork mode needs os.fork (Linux/macOS)")
+    logging.getLogger('werkzeug').setLevel(logging.WARNING) # ไม่ log ทุก request
+    PreforkServer.from_env(host=args.host, port=args.port, workers=args.workers,
+                           max_requests=args.max_requests, threads=args.threads).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# ----------------------------------------------------------------------
+# การเตรียมรูปภาพก่อนส่งเข้าโมเดล (Preprocessing)
+# ----------------------------------------------------------------------
+# รูปจาก LINE มักมีขนาด 12 MP ขึ้นไป การ decode เต็มขนาดแล้ว resize ทำให้เกิดสำเนาขนาดใหญ่หลายชุด
+# โมดูลนี้จึง:
+#   - ใช้ JPEG draft mode ให้ libjpeg decode ที่สเกลเล็กลง (1/2, 1/4, 1/8) ตั้งแต่แรก
+#   - หมุนรูปตาม EXIF orientation
+#   - เขียนผลลัพธ์ที่ normalize แล้วลงใน buffer ที่ใช้ซ้ำได้ (ต่อ thread) ด้วย dtype ของโมเดลโดยตรง
+#     (float32 หาร 255 หรือ uint8/int8 ตามค่า quantization ของ input โดยไม่ผ่าน float64)
+import threading
+from contextlib import nullcontext
+
+import numpy as np
+from PIL import Image, ImageOps
+
+_local = threading.local()
+
+
+def _reusable_buffer(shape, dtype):
+    # buffer หนึ่งชุดต่อ thread ต่อ (shape, dtype) เพื่อไม่ต้องจองหน่วยความจำใหม่ทุก request
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    key = (tuple(shape), np.dtype(dtype).str)
+    buffer = buffers.get(key)
+    if buffer is None:
+        buffer = buffers[key] = np.empty(shape, dtype=dtype)
+    return buffer
+
+
+def _phase(timer, name):
+    return timer.phase(name) if timer is not None else nullcontext()
+
+
+def load_image(source, size, timer=None):
+    """เปิดรูปจาก path หรือ file-like แล้วคืนรูป RGB ขนาด size=(width, height).
+
+    timer (ถ้ามี) ต้องมี phase(name) เช่น RequestTrace จะได้เวลาของขั้น decode และ resize แยกกัน
+    (preprocess_image เพิ่มขั้น normalize สำหรับการแปลงเป็น input ของโมเดล)
+    """
+    with _phase(timer, 'decode'):
+        img = Image.open(source)
+        if img.format == 'JPEG':
+            # ให้ decoder ย่อรูประหว่าง decode โดยยังได้ขนาดไม่ต่ำกว่าที่ต้องการ
+            img.draft('RGB', size)
+        img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.load() # Image.open ยังไม่ decode จริงจนกว่าจะใช้ pixel
+    with _phase(timer, 'resize'):
+        return img.resize(size)
+
+
+def _input_quantization(input_detail):
+    scale, zero_point = input_detail.get('quantization', (0.0, 0))
+    return float(scale), int(zero_point)
+
+
+def to_model_input(pixels, input_detail, out=None):
+    """แปลง array uint8 (H, W, 3) เป็น input ของโมเดล (ไม่รวมมิติ batch) โดยเขียนลง out."""
+    dtype = np.dtype(input_detail['dtype'])
+    if out is None:
+        out = _reusable_buffer(pixels.shape, dtype)
+
+    if dtype.kind == 'f':
+        # โมเดล float รับค่า 0-1: คูณตรงลง buffer float32 โดยไม่สร้าง array float64 ชั่วคราว
+        np.multiply(pixels, 1.0 / 255.0, out=out, casting='unsafe')
+        return out
+
+    scale, zero_point = _input_quantization(input_detail)
+    if dtype == np.uint8 and zero_point == 0 and (scale == 0.0 or abs(scale * 255.0 - 1.0) < 1e-6):
+        # โมเดล quantized ที่รับ 0-255 ตรงๆ: ส่ง pixel เข้าไปได้เลย
+        np.copyto(out, pixels)
+        return out
+
+    # กรณีทั่วไป: q = round((pixel / 255) / scale) + zero_point แล้ว clip ให้อยู่ในช่วงของ dtype
+    info = np.iinfo(dtype)
+    quantized = np.rint(pixels * np.float32(1.0 / (255.0 * scale))) + zero_point
+    np.clip(quantized, info.min, info.max, out=quantized)
+    np.copyto(out, quantized, casting='unsafe')
+    return out
+
+
+def preprocess_image(source, input_detail, out=None, timer=None):
+    """decode + resize + normalize รูปหนึ่งรูปตาม input_detail ของโมเดล (คืน array ไม่รวมมิติ batch)."""
+    height, width = (int(v) for v in input_detail['shape'][1:3])
+    img = load_image(source, (width, height), timer=timer)
+    with _phase(timer, 'normalize'):
+        pixels = np.asarray(img)
+        return to_model_input(pixels, input_detail, out=out)
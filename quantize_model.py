@@ -0,0 +1,95 @@
+# ----------------------------------------------------------------------
+# สร้างโมเดล quantized (post-training quantization) สำหรับ MODEL_VARIANT
+# ----------------------------------------------------------------------
+# ต้องใช้โมเดลต้นฉบับ (SavedModel directory หรือไฟล์ Keras .keras/.h5) และ tensorflow เต็มตัว
+# เพราะ TFLite converter quantize จากไฟล์ .tflite ที่แปลงแล้วไม่ได้
+#   float16  weight เป็น float16 (ขนาดไฟล์ครึ่งหนึ่ง ความแม่นยำแทบไม่เปลี่ยน)
+#   int8     weight และ activation เป็น int8 ต้องมีรูปสำหรับ calibrate (ประมาณ 100-500 รูป)
+#            input/output เป็น uint8: input scale = 1/255 ทำให้ส่ง pixel เข้าโมเดลได้ตรงๆ
+#            (ดู preprocessing.to_model_input) และ output ถูกแปลงกลับเป็น float ใน batch_scheduler.py
+# ผลลัพธ์ถูกบันทึกตามชื่อที่ model_loader.variant_path กำหนด เช่น
+# khunmoa_skin_diagnosis_final_model_int8.tflite แล้วเลือกใช้ด้วย MODEL_VARIANT=int8
+#
+# วิธีใช้ (รันจาก root ของ repo):
+#   python quantize_model.py --source exported_model/ --variant float16
+#   python quantize_model.py --source model.keras --variant int8 --calibration-dir samples/
+# จากนั้นตรวจความแม่นยำและความเร็วด้วย python -m benchmarks.model_variants --images samples/
+import argparse
+import os
+
+import model_loader
+
+FLOAT_MODEL_PATH = model_loader.DEFAULT_MODEL_PATH
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def list_images(directory, limit=None):
+    names = sorted(n for n in os.listdir(directory) if n.lower().endswith(IMAGE_EXTENSIONS))
+    return [os.path.join(directory, n) for n in names[:limit]]
+
+
+def representative_dataset(paths, input_size):
+    """รูปสำหรับ calibrate ในรูปแบบเดียวกับ input ของโมเดล float (float32 ค่า 0-1)."""
+    from preprocessing import preprocess_image
+
+    detail = {'shape': [1, input_size, input_size, 3], 'dtype': 'float32', 'quantization': (0.0, 0)}
+
+    def generate():
+        for path in paths:
+            # ต้องคัดลอก เพราะ preprocess_image คืน buffer ที่ใช้ซ้ำ
+            yield [preprocess_image(path, detail).copy()[None]]
+    return generate
+
+
+def _converter(source):
+    import tensorflow as tf
+
+    if os.path.isdir(source):
+        return tf.lite.TFLiteConverter.from_saved_model(source)
+    return tf.lite.TFLiteConverter.from_keras_model(tf.keras.models.load_model(source))
+
+
+def convert(source, variant, calibration_paths=None, input_size=224):
+    """แปลงโมเดลต้นฉบับเป็น .tflite ตาม variant แล้วคืน bytes ของโมเดล."""
+    import tensorflow as tf
+
+    converter = _converter(source)
+    if variant == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == 'int8':
+        if not calibration_paths:
+            raise ValueError("int8 quantization needs calibration images (--calibration-dir)")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(calibration_paths, input_size)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+    elif variant != 'float':
+        raise ValueError(f"Unknown model variant '{variant}'")
+    return converter.convert()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create a post-training-quantized model variant')
+    parser.add_argument('--source', required=True, help='SavedModel directory หรือไฟล์ Keras ของโมเดลต้นฉบับ')
+    parser.add_argument('--variant', choices=model_loader.MODEL_VARIANTS, required=True)
+    parser.add_argument('--calibration-dir', help='directory ของรูปสำหรับ calibrate (จำเป็นสำหรับ int8)')
+    parser.add_argument('--calibration-size', type=int, default=200, help='จำนวนรูปสูงสุดที่ใช้ calibrate')
+    parser.add_argument('--input-size', type=int, default=224)
+    parser.add_argument('--output', help=f"path ของไฟล์ผลลัพธ์ (ค่าเริ่มต้นตาม variant ของ {FLOAT_MODEL_PATH})")
+    args = parser.parse_args()
+
+    calibration_paths = None
+    if args.calibration_dir:
+        calibration_paths = list_images(args.calibration_dir, args.calibration_size)
+    model = convert(args.source, args.variant, calibration_paths, args.input_size)
+
+    output = args.output or model_loader.variant_path(FLOAT_MODEL_PATH, args.variant)
+    with open(output, 'wb') as f:
+        f.write(model)
+    print(f"Wrote {args.variant} model to {output} ({len(model) / 1024 / 1024:.2f} MB)")
+
+
+if __name__ == '__main__':
+    main()
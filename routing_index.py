@@ -0,0 +1,204 @@
+# ----------------------------------------------------------------------
+# ดัชนีสำหรับจัดเส้นทางข้อความ และข้อความตอบกลับที่สร้างไว้ล่วงหน้า
+# ----------------------------------------------------------------------
+# สร้างครั้งเดียวตอนเริ่มระบบ:
+#   - KeywordMatcher (Aho-Corasick) ค้นหาคำของอาการและ intent ทั้งหมดในการสแกนข้อความรอบเดียว
+#     เวลาที่ใช้ขึ้นกับความยาวข้อความ ไม่ขึ้นกับจำนวน keyword (เพิ่มอาการ/คำพ้องได้โดยไม่ช้าลง)
+#   - ข้อความตอบกลับของแต่ละอาการและแต่ละ class เป็น string ที่สร้างไว้แล้ว (ไม่ต้องประกอบ f-string ทุกครั้ง)
+#   - ตารางจาก index ของ class ไปยังชื่อไทย/อังกฤษและรายละเอียด (ไม่ต้องวนหาใน class_names_map)
+#   - ข้อความ "ความเป็นไปได้อื่น" ประกอบจาก top-k ที่เก็บไว้ใน state (ไม่ต้องรันโมเดลใหม่)
+import time
+from collections import deque, namedtuple
+from types import MappingProxyType
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+# ลำดับความสำคัญเมื่อข้อความมีหลาย keyword: อาการ (ตามลำดับใน dict) มาก่อน intent เสมอ
+# และ intent เรียงตามลำดับที่ส่งเข้ามา (ค่าน้อย = สำคัญกว่า)
+KIND_SYMPTOM = 'symptom'
+KIND_INTENT = 'intent'
+
+Route = namedtuple('Route', ['symptom', 'intent'])
+ClassInfo = namedtuple('ClassInfo', ['english', 'thai', 'treatment', 'avoid', 'severe_warning',
+                                     'reply_head', 'reply_tail'])
+
+SYMPTOM_REPLY_TEMPLATE = (
+    "**💡 วิธีรักษาเบื้องต้นสำหรับอาการ{symptom}:**\n"
+    "{treatment}\n\n"
+    "**⚠️ คำเตือนสำคัญ:**\n"
+    "{warning}\n\n"
+    "ข้อมูลนี้เป็นเพียงคำแนะนำเบื้องต้นจากระบบ AI และไม่สามารถใช้แทนการวินิจฉัยของแพทย์ได้\n"
+    "เพื่อการวินิจฉัยที่ถูกต้องและแม่นยำที่สุด **โปรดปรึกษาแพทย์ผู้เชี่ยวชาญ** หรือผู้เชี่ยวชาญด้านสุขภาพ"
+)
+
+# ข้อความผลการวิเคราะห์รูปภาพถูกแบ่งเป็นส่วนหัว + ค่าความมั่นใจ + ส่วนท้าย
+CLASS_REPLY_HEAD_TEMPLATE = (
+    "จากการวิเคราะห์เบื้องต้น AI คาดการณ์ว่ารูปภาพนี้มีลักษณะคล้ายกับ:\n"
+    "**{thai} ({english})**\n" # แสดงทั้งไทยและอังกฤษ
+    "(ความมั่นใจ: "
+)
+CLASS_REPLY_TAIL_TEMPLATE = (
+    ")\n\n"
+    "**💡 วิธีรักษาเบื้องต้น:**\n"
+    "{treatment}\n\n"
+    "**🚫 สิ่งที่ควรหลีกเลี่ยง:**\n"
+    "{avoid}\n\n"
+    "**🚨 หากอาการรุนแรง/ผิดปกติ:**\n"
+    "{severe_warning}\n\n"
+    "**⚠️ คำเตือนสำคัญ:**\n"
+    "ข้อมูลนี้เป็นเพียงการวิเคราะห์เบื้องต้นจากระบบ AI และไม่สามารถใช้แทนการวินิจฉัยของแพทย์ได้\n"
+    "เพื่อการวินิจฉัยที่ถูกต้องและแม่นยำที่สุด **โปรดปรึกษาแพทย์ผู้เชี่ยวชาญ** หรือผู้เชี่ยวชาญด้านสุขภาพ"
+)
+
+# ข้อความแสดงความเป็นไปได้อันดับต้นๆ จากผลการวิเคราะห์รูปล่าสุด
+ALTERNATIVES_REPLY_HEAD = "ความเป็นไปได้จากการวิเคราะห์รูปภาพล่าสุด เรียงจากมากไปน้อย:\n"
+ALTERNATIVES_REPLY_LINE = "{rank}. {thai} ({english}) ความมั่นใจ: {confidence:.2f}"
+ALTERNATIVES_REPLY_TAIL = (
+    "\n\nข้อมูลนี้เป็นเพียงการวิเคราะห์เบื้องต้นจากระบบ AI และไม่สามารถใช้แทนการวินิจฉัยของแพทย์ได้\n"
+    "**โปรดปรึกษาแพทย์ผู้เชี่ยวชาญ** เพื่อการวินิจฉัยที่ถูกต้อง"
+)
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton: หา keyword ทั้งหมดที่ปรากฏในข้อความด้วยการสแกนรอบเดียว."""
+
+    def __init__(self, keywords):
+        # keywords: iterable ของ (keyword, value)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        self.size = 0
+        for keyword, value in keywords:
+            self._add(keyword, value)
+        self._build_failure_links()
+
+    def _add(self, keyword, value):
+        if not keyword:
+            raise ValueError("Keyword must not be empty")
+        node = 0
+        for ch in keyword:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            node = nxt
+        self._out[node] = self._out[node] + (value,)
+        self.size += 1
+
+    def _build_failure_links(self):
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for ch, child in self._goto[node].items():
+                pending.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0 # ลูกของ root ชี้กลับ root
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find_all(self, text):
+        """คืน value ของทุก keyword ที่พบในข้อความ (อาจซ้ำถ้า keyword ปรากฏหลายครั้ง)."""
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        found = []
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.extend(out[node])
+        return found
+
+
+class RoutingIndex:
+    """ผลลัพธ์ของ build_routing_index: matcher, ข้อความตอบกลับ และตารางของ class."""
+
+    def __init__(self, matcher, symptom_replies, classes, build_seconds):
+        self.matcher = matcher
+        self.symptom_replies = symptom_replies
+        self.classes = classes
+        self.class_indices = MappingProxyType({info.english: i for i, info in enumerate(classes)})
+        self.build_seconds = build_seconds
+
+    def route(self, text):
+        """หาอาการและ intent ที่สำคัญที่สุดในข้อความ (ข้อความควรถูกแปลงเป็นตัวพิมพ์เล็กแล้ว)."""
+        best = {KIND_SYMPTOM: None, KIND_INTENT: None}
+        for kind, priority, name in self.matcher.find_all(text):
+            current = best[kind]
+            if current is None or priority < current[0]:
+                best[kind] = (priority, name)
+        return Route(
+            symptom=best[KIND_SYMPTOM][1] if best[KIND_SYMPTOM] else None,
+            intent=best[KIND_INTENT][1] if best[KIND_INTENT] else None,
+        )
+
+    def class_reply(self, class_index, confidence):
+        info = self.classes[class_index]
+        return f"{info.reply_head}{confidence:.2f}{info.reply_tail}"
+
+    def alternatives_reply(self, top_k):
+        """ข้อความจาก top_k ที่เก็บไว้ ([{'class': ชื่ออังกฤษ, 'confidence': ...}, ...] เรียงจากมากไปน้อย)."""
+        lines = []
+        for rank, item in enumerate(top_k, start=1):
+            index = self.class_indices.get(item['class'])
+            thai = self.classes[index].thai if index is not None else item['class']
+            lines.append(ALTERNATIVES_REPLY_LINE.format(
+                rank=rank, thai=thai, english=item['class'], confidence=item['confidence']))
+        return ALTERNATIVES_REPLY_HEAD + '\n'.join(lines) + ALTERNATIVES_REPLY_TAIL
+
+
+def build_routing_index(symptoms, intents, class_names_map, class_details):
+    """สร้าง RoutingIndex
+
+    symptoms: dict ของอาการ -> {'treatment', 'warning', 'synonyms' (ไม่บังคับ)}
+    intents: ลำดับของ (ชื่อ intent, keywords) เรียงตามความสำคัญ
+    """
+    started = time.perf_counter()
+
+    keywords = []
+    symptom_replies = {}
+    for priority, (symptom, details) in enumerate(symptoms.items()):
+        for keyword in (symptom, *details.get('synonyms', ())):
+            keywords.append((keyword.lower(), (KIND_SYMPTOM, priority, symptom)))
+        symptom_replies[symptom] = SYMPTOM_REPLY_TEMPLATE.format(
+            symptom=symptom, treatment=details['treatment'], warning=details['warning'])
+    for priority, (intent, intent_keywords) in enumerate(intents):
+        for keyword in intent_keywords:
+            keywords.append((keyword.lower(), (KIND_INTENT, priority, intent)))
+    matcher = KeywordMatcher(keywords)
+
+    classes = []
+    for item in class_names_map:
+        english = item['english']
+        thai = item.get('thai') or english # ถ้าไม่มีชื่อไทย ให้ใช้ชื่ออังกฤษแทน
+        details = class_details.get(english, {})
+        treatment = details.get('treatment', 'ไม่มีข้อมูลวิธีรักษาเบื้องต้น')
+        avoid = details.get('avoid', 'ไม่มีข้อมูลสิ่งที่ควรหลีกเลี่ยง')
+        severe_warning = details.get('severe_warning', 'ไม่มีคำเตือนสำหรับอาการรุนแรง')
+        classes.append(ClassInfo(
+            english=english,
+            thai=thai,
+            treatment=treatment,
+            avoid=avoid,
+            severe_warning=severe_warning,
+            reply_head=CLASS_REPLY_HEAD_TEMPLATE.format(thai=thai, english=english),
+            reply_tail=CLASS_REPLY_TAIL_TEMPLATE.format(
+                treatment=treatment, avoid=avoid, severe_warning=severe_warning),
+        ))
+
+    index = RoutingIndex(
+        matcher,
+        MappingProxyType(symptom_replies),
+        tuple(classes),
+        time.perf_counter() - started,
+    )
+    log.info(f"Routing index built in {index.build_seconds * 1000:.2f} ms: {matcher.size} keywords "
+             f"({len(symptom_replies)} symptoms, {len(intents)} intents), {len(classes)} classes")
+    return index
@@ -0,0 +1,99 @@
+# ----------------------------------------------------------------------
+# ตัวช่วยลดเวลา Cold Start
+# ----------------------------------------------------------------------
+# โหลดทรัพยากรที่หนัก (Firestore, โมเดล TFLite) แบบ background/lazy
+# เพื่อให้ webhook แรกหลัง scale-up ไม่ต้องรอทุกอย่างโหลดเสร็จ
+# และจับเวลาของแต่ละช่วง (import, สร้าง client, allocate โมเดล) แยกกัน
+import threading
+import time
+from contextlib import contextmanager
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+
+class StartupTimer:
+    """เก็บเวลาที่ใช้ในแต่ละช่วงของการเริ่มต้นระบบ (หน่วยวินาที)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._created_at = time.perf_counter()
+
+    def record(self, phase, seconds):
+        with self._lock:
+            self._phases[phase] = self._phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def report(self):
+        """คืน dict ของเวลาแต่ละช่วง (ms) พร้อมเวลารวมตั้งแต่เริ่ม import."""
+        with self._lock:
+            phases = {name: round(seconds * 1000, 1) for name, seconds in self._phases.items()}
+        phases['since_start'] = round((time.perf_counter() - self._created_at) * 1000, 1)
+        return phases
+
+    def format_report(self):
+        return "Startup timings (ms): " + ", ".join(
+            f"{name}={value}" for name, value in self.report().items()
+        )
+
+
+class LazyResource:
+    """ทรัพยากรที่สร้างครั้งเดียวด้วย factory โดยจะเริ่มสร้างใน background ได้
+
+    ถ้า factory ล้มเหลว get() จะคืนค่า None (เหมือนพฤติกรรมเดิมที่ตั้ง db/interpreter เป็น None)
+    """
+
+    def __init__(self, name, factory, timer=None, phase=None):
+        self.name = name
+        self._factory = factory
+        self._timer = timer
+        self._phase = phase or name
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._started = False
+        self._value = None
+        self.error = None
+
+    def start(self):
+        """เริ่มโหลดใน background thread (เรียกซ้ำได้ จะทำงานแค่ครั้งเดียว)."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._load, name=f"load-{self.name}", daemon=True).start()
+
+    def _load(self):
+        started = time.perf_counter()
+        try:
+            self._value = self._factory()
+        except Exception as e:
+            self.error = e
+            log.error(f"Error loading {self.name}: {e}")
+            self._value = None
+        finally:
+            if self._timer is not None:
+                self._timer.record(self._phase, time.perf_counter() - started)
+            self._ready.set()
+
+    @property
+    def loaded(self):
+        return self._ready.is_set()
+
+    def get(self, timeout=None):
+        """คืนค่าทรัพยากร ถ้ายังไม่เคยเริ่มโหลดจะโหลดใน thread ปัจจุบันเลย."""
+        with self._lock:
+            run_inline = not self._started
+            self._started = True
+        if run_inline:
+            self._load()
+        self._ready.wait(timeout)
+        return self._value
@@ -0,0 +1,196 @@
+# ----------------------------------------------------------------------
+# ที่เก็บสถานะการสนทนาของผู้ใช้ (user_states) แบบมี cache
+# ----------------------------------------------------------------------
+# เดิมทุกข้อความจะอ่าน Firestore 1 ครั้ง และทุกขั้นของการสนทนาจะเขียนอีก 1-2 ครั้ง
+# ชั้นนี้ช่วยลดจำนวน round trip โดย:
+#   - cache แบบ write-through ในหน่วยความจำ (มีอายุ STATE_CACHE_TTL) ทำให้ข้อความถัดไปไม่ต้องอ่านใหม่
+#   - ขั้นสุดท้ายบันทึก record การวินิจฉัยและรีเซ็ตสถานะใน batch write เดียว
+#   - optimistic concurrency: ทุกการเขียนใช้ update_time ของ snapshot ล่าสุดเป็นเงื่อนไข
+#     ถ้า instance อื่นเขียนทับไปก่อน จะได้ StateConflictError แทนการเขียนทับเงียบๆ
+#   - cache ใช้ได้เฉพาะสถานะ waiting_for_* เพราะคำตอบของสถานะเหล่านี้ต้องเขียนสถานะเสมอ
+#     ถ้า cache เก่าการเขียนจะชนกันและถูกตรวจพบ ส่วนสถานะอื่น (เช่น idle) ไม่มีการเขียนที่จะตรวจพบ
+#     cache เก่าได้ (instance อื่นอาจเพิ่งเปลี่ยนเป็น waiting_for_*) จึงอ่านจาก Firestore ทุกครั้ง
+#   - สถานะ waiting_for_* ที่ค้างนานเกิน STATE_EXPIRY จะถือว่าเป็น idle อัตโนมัติ
+import copy
+import threading
+import time
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+STATE_IDLE = 'idle'
+WAITING_PREFIX = 'waiting_for_'
+
+
+class StateConflictError(RuntimeError):
+    """สถานะใน Firestore ถูกเปลี่ยนโดย request อื่นหลังจากที่เราอ่านมา."""
+
+
+def _is_conflict(error):
+    from google.api_core import exceptions
+
+    return isinstance(error, (exceptions.FailedPrecondition, exceptions.AlreadyExists,
+                              exceptions.NotFound, exceptions.Conflict))
+
+
+class _CachedState:
+    __slots__ = ('state', 'data', 'exists', 'update_time', 'updated_at', 'cached_at')
+
+    def __init__(self, state, data, exists, update_time, updated_at):
+        self.state = state
+        self.data = data
+        self.exists = exists
+        self.update_time = update_time
+        self.updated_at = updated_at
+        self.cached_at = time.monotonic()
+
+
+class UserStateStore:
+    """อ่าน/เขียนสถานะการสนทนาของผู้ใช้ผ่าน cache แบบ write-through."""
+
+    def __init__(self, db_getter, collection, cache_ttl=30.0, state_expiry=3600.0, max_entries=10000):
+        self._db_getter = db_getter
+        self.collection = collection
+        self.cache_ttl = cache_ttl
+        self.state_expiry = state_expiry
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._counters = {'cache_hits': 0, 'reads': 0, 'writes': 0, 'batched_writes': 0, 'conflicts': 0, 'expired': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _cached(self, user_id):
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is not None and time.monotonic() - entry.cached_at > self.cache_ttl:
+                del self._cache[user_id]
+                entry = None
+            return entry
+
+    def _peek(self, user_id):
+        # ไม่ตรวจอายุ: update_time ที่เก่าเกินไปทำให้การเขียนชนกัน (ตรวจพบได้) แทนการเขียนทับเงียบๆ
+        # STATE_CACHE_TTL=0 จึงยังเขียนแบบมีเงื่อนไขได้จาก snapshot ที่เพิ่งอ่านใน request เดียวกัน
+        with self._lock:
+            return self._cache.get(user_id)
+
+    def _remember(self, user_id, entry):
+        with self._lock:
+            if len(self._cache) >= self.max_entries and user_id not in self._cache:
+                # ทิ้ง entry ที่เก่าที่สุด (dict เรียงตามลำดับการใส่)
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[user_id] = entry
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._cache.pop(user_id, None)
+
+    def _load(self, db, user_id):
+        self._count('reads')
+        doc = db.collection(self.collection).document(user_id).get()
+        if not doc.exists:
+            return _CachedState(STATE_IDLE, {}, False, None, None)
+        values = doc.to_dict()
+        return _CachedState(values.get('state', STATE_IDLE), values.get('data', {}), True,
+                            doc.update_time, values.get('updated_at'))
+
+    def get(self, user_id):
+        """คืน {'state': ..., 'data': {...}} (สำเนา แก้ไขได้โดยไม่กระทบ cache)."""
+        db = self._db_getter()
+        if db is None:
+            log.warning("Firestore is not initialized. Cannot get user state.")
+            return {'state': STATE_IDLE, 'data': {}}
+
+        entry = self._cached(user_id)
+        if entry is not None and entry.state.startswith(WAITING_PREFIX):
+            self._count('cache_hits')
+        else:
+            entry = self._load(db, user_id)
+            self._remember(user_id, entry)
+
+        if (entry.state.startswith(WAITING_PREFIX) and entry.updated_at is not None
+                and time.time() - entry.updated_at > self.state_expiry):
+            # ผู้ใช้ทิ้งการสนทนาไปนานแล้ว เริ่มใหม่จาก idle (การเขียนครั้งถัดไปจะทับสถานะเก่าเอง)
+            self._count('expired')
+            return {'state': STATE_IDLE, 'data': {}}
+        return {'state': entry.state, 'data': copy.deepcopy(entry.data)}
+
+    def _fields(self, state, data, now):
+        return {'state': state, 'data': data, 'updated_at': now}
+
+    def _write(self, db, user_id, state, data, batch=None, force=False):
+        # เลือกวิธีเขียนตามสิ่งที่รู้จาก snapshot ล่าสุด:
+        #   - รู้ update_time: update แบบมีเงื่อนไข (ล้มเหลวถ้ามีคนเขียนหลังจากเราอ่าน)
+        #   - รู้ว่ายังไม่มี document: create (ล้มเหลวถ้ามีคนสร้างก่อน)
+        #   - ไม่เคยอ่าน หรือ force=True: set(merge=True) แบบเดิม
+        doc_ref = db.collection(self.collection).document(user_id)
+        now = time.time()
+        fields = self._fields(state, data, now)
+        entry = None if force else self._peek(user_id)
+        if entry is not None and entry.update_time is not None:
+            method, kwargs = 'update', {'option': db.write_option(last_update_time=entry.update_time)}
+        elif entry is not None and not entry.exists:
+            method, kwargs = 'create', {}
+        else:
+            method, kwargs = 'set', {'merge': True}
+
+        if batch is not None:
+            getattr(batch, method)(doc_ref, fields, **kwargs)
+            return None, now
+        return getattr(doc_ref, method)(fields, **kwargs), now
+
+    def set(self, user_id, state, data=None, force=False):
+        """เขียนสถานะใหม่ลง Firestore และ cache (data=None หมายถึงล้างข้อมูลชั่วคราว)
+
+        force=True ใช้เมื่อสถานะใหม่ไม่ขึ้นกับสถานะเดิม (เช่น เริ่มการวินิจฉัยใหม่จากรูปภาพ)
+        จะเขียนทับโดยไม่ตรวจ conflict
+        """
+        db = self._db_getter()
+        if db is None:
+            log.warning("Firestore is not initialized. Cannot update user state.")
+            return
+        data = {} if data is None else data
+        try:
+            result, now = self._write(db, user_id, state, data, force=force)
+        except Exception as e:
+            self.invalidate(user_id)
+            if _is_conflict(e):
+                self._count('conflicts')
+                raise StateConflictError(f"State of user {user_id} changed concurrently") from e
+            raise
+        self._count('writes')
+        self._remember(user_id, _CachedState(state, copy.deepcopy(data), True, result.update_time, now))
+        log.debug("User %s state updated to: %s", user_id, state)
+
+    def complete(self, user_id, records_collection, record, state=STATE_IDLE, stats=None):
+        """บันทึก record ใหม่และเปลี่ยนสถานะผู้ใช้ใน batch write เดียว (รวมตัวนับของ stats ถ้ามี)."""
+        db = self._db_getter()
+        if db is None:
+            log.warning("Firestore is not initialized. Cannot save diagnosis record.")
+            return
+        batch = db.batch()
+        batch.create(db.collection(records_collection).document(), record)
+        if stats is not None:
+            stats.add_to_batch(db, batch, [record])
+        try:
+            _, now = self._write(db, user_id, state, {}, batch=batch)
+            results = batch.commit()
+        except Exception as e:
+            self.invalidate(user_id)
+            if _is_conflict(e):
+                self._count('conflicts')
+                raise StateConflictError(f"State of user {user_id} changed concurrently") from e
+            raise
+        self._count('batched_writes')
+        # ผลลัพธ์เรียงตามลำดับการเขียนใน batch: ตัวสุดท้ายคือ document สถานะ
+        self._remember(user_id, _CachedState(state, {}, True, results[-1].update_time, now))
+        log.debug("Diagnosis record saved and user %s state updated to: %s", user_id, state)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['cached_users'] = len(self._cache)
+        return stats
@@ -0,0 +1,304 @@
+# ----------------------------------------------------------------------
+# Logging และการจับเวลาแต่ละขั้นของการประมวลผล (Telemetry)
+# ----------------------------------------------------------------------
+# - log ทั้งหมดของระบบผ่าน logger "khunmoa.*" (get_logger) แทน print
+#   LOG_FORMAT=json จะพิมพ์เป็น JSON หนึ่งบรรทัดต่อ log (Cloud Logging อ่าน field severity ได้เอง)
+#   LOG_LEVEL กำหนดระดับ log ขั้นต่ำ (ค่าเริ่มต้น INFO)
+# - ทุก event ถูกจับเวลาแยกตามขั้น (download, decode, resize, invoke, state_read, state_write,
+#   record_save, reply_send) แล้วเก็บเป็น histogram ที่มี label kind, predicted_class, cache และ error
+#   อ่านได้เป็น Prometheus text format (render_prometheus) หรือ dict (snapshot)
+# - TELEMETRY_SAMPLE_RATE (0-1) สุ่ม log รายละเอียดเวลาของ request เป็น JSON
+# - SLOW_REQUEST_MS (> 0) log trace เต็มของทุก request ที่ช้ากว่าค่านี้ (ปิดไว้เป็นค่าเริ่มต้น)
+# - ตัวนับจำนวนครั้งของแต่ละเส้นทางการตอบ (count) เช่น image_retake, alternatives_stored
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+LOGGER_NAME = 'khunmoa'
+METRIC_NAME = 'khunmoa_stage_latency_seconds'
+COUNTER_METRIC_NAME = 'khunmoa_events_total'
+
+# ขอบบนของ bucket (วินาที) ครอบคลุมตั้งแต่ cache hit ไปจนถึงดาวน์โหลดรูปที่ช้า
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LABEL_NAMES = ('kind', 'predicted_class', 'cache', 'error')
+NO_LABEL = 'none'
+
+
+class _StdoutHandler(logging.StreamHandler):
+    # อ้าง sys.stdout ตอนเขียนทุกครั้ง เพื่อให้ contextlib.redirect_stdout (เช่นใน benchmark) ใช้ได้
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class JsonFormatter(logging.Formatter):
+    """หนึ่งบรรทัดต่อ log: severity, message, logger และ field เพิ่มเติมจาก extra={'fields': {...}}."""
+
+    def format(self, record):
+        entry = {
+            'severity': record.levelname,
+            'message': record.getMessage(),
+            'logger': record.name,
+            'time': round(record.created, 3),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' ' + json.dumps(fields, ensure_ascii=False, default=str)
+        return text
+
+
+_configure_lock = threading.Lock()
+_configured = False
+
+
+def configure_logging(fmt=None, level=None):
+    """ตั้งค่า handler ของ logger "khunmoa" (เรียกซ้ำได้ จะตั้งค่าแค่ครั้งแรก)."""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        _configured = True
+        fmt = fmt or os.getenv('LOG_FORMAT', 'text')
+        handler = _StdoutHandler()
+        handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.addHandler(handler)
+        logger.setLevel((level or os.getenv('LOG_LEVEL', 'INFO')).upper())
+        logger.propagate = False
+
+
+def get_logger(name):
+    configure_logging()
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+class StageHistogram:
+    """histogram ของเวลาแต่ละขั้น แยกตาม stage และ LABEL_NAMES."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {} # (stage, labels...) -> [จำนวนต่อ bucket..., +Inf], ผลรวม
+
+    def observe(self, stage, seconds, labels):
+        key = (stage,) + tuple(labels.get(name, NO_LABEL) for name in LABEL_NAMES)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def snapshot(self):
+        """คืน list ของ series: labels, count, sum_ms และจำนวนสะสมต่อ bucket."""
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        result = []
+        for key, counts, total in sorted(items):
+            cumulative, running = [], 0
+            for count in counts:
+                running += count
+                cumulative.append(running)
+            result.append({
+                'stage': key[0],
+                **dict(zip(LABEL_NAMES, key[1:])),
+                'count': running,
+                'sum_ms': round(total * 1000, 3),
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], cumulative)),
+            })
+        return result
+
+    def render_prometheus(self, name=METRIC_NAME):
+        lines = [
+            f"# HELP {name} Time spent in each stage of webhook event handling.",
+            f"# TYPE {name} histogram",
+        ]
+        for series in self.snapshot():
+            labels = ','.join(f'{label}="{series[label]}"' for label in ('stage',) + LABEL_NAMES)
+            for bound, count in series['buckets'].items():
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {series['sum_ms'] / 1000}")
+            lines.append(f"{name}_count{{{labels}}} {series['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+class EventCounter:
+    """ตัวนับจำนวนครั้งของ event แยกตามชื่อ (เช่นเส้นทางที่ใช้ตอบผู้ใช้)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def increment(self, name, n=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return dict(sorted(self._counts.items()))
+
+    def render_prometheus(self, name=COUNTER_METRIC_NAME):
+        lines = [
+            f"# HELP {name} Number of times each handling path was taken.",
+            f"# TYPE {name} counter",
+        ]
+        lines += [f'{name}{{event="{event}"}} {count}' for event, count in self.snapshot().items()]
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTrace:
+    """เวลาของแต่ละขั้นใน event หนึ่งตัว (มี phase() แบบเดียวกับ StartupTimer)."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.labels = {'kind': kind}
+        self.stages = [] # (stage, เริ่มหลัง request กี่วินาที, วินาทีที่ใช้)
+        self._started = time.perf_counter()
+
+    def label(self, **labels):
+        self.labels.update({name: str(value) for name, value in labels.items()})
+
+    def record(self, stage, seconds, started=None):
+        offset = (started if started is not None else time.perf_counter() - seconds) - self._started
+        self.stages.append((stage, offset, seconds))
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.labels.setdefault('error', e.__class__.__name__)
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started, started)
+
+    def elapsed(self):
+        return time.perf_counter() - self._started
+
+    def to_dict(self, total_seconds):
+        return {
+            'labels': dict(self.labels),
+            'total_ms': round(total_seconds * 1000, 2),
+            'stages': [
+                {'stage': stage, 'start_ms': round(offset * 1000, 2), 'ms': round(seconds * 1000, 2)}
+                for stage, offset, seconds in self.stages
+            ],
+        }
+
+
+class Telemetry:
+    """จุดรวมของ histogram, การสุ่ม log และ slow-request trace."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, sample_rate=0.0, slow_request_ms=0.0, logger=None):
+        self.histogram = StageHistogram(buckets)
+        self.counters = EventCounter()
+        self.sample_rate = sample_rate
+        self.slow_request_ms = slow_request_ms
+        self.logger = logger or get_logger('telemetry')
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            sample_rate=float(os.getenv('TELEMETRY_SAMPLE_RATE', '0')),
+            slow_request_ms=float(os.getenv('SLOW_REQUEST_MS', '0')),
+        )
+
+    def current(self):
+        """trace ของ request ที่กำลังทำงานใน thread นี้ (หรือ None)."""
+        return getattr(self._local, 'trace', None)
+
+    @contextmanager
+    def request(self, kind):
+        """จับเวลาการประมวลผล event หนึ่งตัว ขั้นย่อยที่เรียก phase() ใน thread เดียวกันจะถูกรวมไว้ด้วย."""
+        trace = RequestTrace(kind)
+        previous, self._local.trace = self.current(), trace
+        try:
+            yield trace
+        except Exception as e:
+            trace.labels.setdefault('error', e.__class__.__name__)
+            raise
+        finally:
+            self._local.trace = previous
+            self._finish(trace)
+
+    def label(self, **labels):
+        """เพิ่ม label ให้ request ปัจจุบัน (ไม่มีผลถ้าไม่ได้อยู่ใน request)."""
+        trace = self.current()
+        if trace is not None:
+            trace.label(**labels)
+
+    @contextmanager
+    def phase(self, name):
+        """จับเวลาขั้น name ของ request ปัจจุบัน (ถ้าไม่มี request จะบันทึกลง histogram ทันที)."""
+        trace = self.current()
+        if trace is not None:
+            with trace.phase(name):
+                yield
+            return
+        started = time.perf_counter()
+        error = NO_LABEL
+        try:
+            yield
+        except Exception as e:
+            error = e.__class__.__name__
+            raise
+        finally:
+            self.histogram.observe(name, time.perf_counter() - started, {'error': error})
+
+    def _finish(self, trace):
+        total = trace.elapsed()
+        for stage, _, seconds in trace.stages:
+            self.histogram.observe(stage, seconds, trace.labels)
+        self.histogram.observe('total', total, trace.labels)
+
+        if self.slow_request_ms and total * 1000 >= self.slow_request_ms:
+            self.logger.warning("Slow %s request: %.1f ms", trace.kind, total * 1000,
+                                extra={'fields': {'trace': trace.to_dict(total)}})
+        elif self.sample_rate and random.random() < self.sample_rate:
+            self.logger.info("Request timings", extra={'fields': {'trace': trace.to_dict(total)}})
+
+    def count(self, name, n=1):
+        """เพิ่มตัวนับ name (เช่นเส้นทางที่ใช้ตอบ) ดูค่าได้จาก counts() หรือ /metrics."""
+        self.counters.increment(name, n)
+
+    def counts(self):
+        return self.counters.snapshot()
+
+    def snapshot(self):
+        return self.histogram.snapshot()
+
+    def render_prometheus(self):
+        return self.histogram.render_prometheus() + self.counters.render_prometheus()
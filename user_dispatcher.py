@@ -0,0 +1,142 @@
+# ----------------------------------------------------------------------
+# ตัวกระจาย Event แบบขนานระหว่างผู้ใช้ แต่เรียงลำดับภายในผู้ใช้เดียวกัน
+# ----------------------------------------------------------------------
+# webhook หนึ่งครั้งอาจมีหลาย event จากหลายผู้ใช้ ถ้าประมวลผลทีละ event รูปภาพที่ช้า
+# ของผู้ใช้คนหนึ่งจะทำให้ผู้ใช้คนอื่นต้องรอไปด้วย จึงแยก "lane" ตาม event.source.user_id
+#   - event ของผู้ใช้ต่างกันทำงานพร้อมกันได้ (จำกัดด้วย max_workers)
+#   - event ของผู้ใช้เดียวกันทำงานทีละตัวตามลำดับที่ได้รับ
+#     (state machine waiting_for_location -> waiting_for_other_symptoms ต้องการลำดับนี้)
+#   - จำนวน event ที่ค้างอยู่ทั้งหมดถูกจำกัดด้วย max_pending (submit จะรอเมื่อเต็ม)
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+
+def event_lane_key(event):
+    """key ของ lane: user_id ถ้ามี ไม่เช่นนั้นใช้ group/room หรือ lane เฉพาะของ event นั้น."""
+    source = getattr(event, 'source', None)
+    for attr in ('user_id', 'group_id', 'room_id'):
+        value = getattr(source, attr, None)
+        if value:
+            return value
+    return f"event-{id(event)}"
+
+
+def event_type_name(event):
+    message = getattr(event, 'message', None)
+    if message is not None:
+        return f"{event.__class__.__name__}/{message.__class__.__name__}"
+    return event.__class__.__name__
+
+
+class _LatencyStats:
+    __slots__ = ('count', 'failed', 'wait_total', 'handle_total', 'handle_max')
+
+    def __init__(self):
+        self.count = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.handle_total = 0.0
+        self.handle_max = 0.0
+
+
+class UserOrderedDispatcher:
+    """รัน processor(event) บน thread pool โดยรักษาลำดับภายใน lane เดียวกัน."""
+
+    def __init__(self, processor, max_workers=4, max_pending=64, stats_log_every=100):
+        self.processor = processor
+        self.max_workers = max_workers
+        self.stats_log_every = stats_log_every
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='user-dispatch')
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._lanes = {} # lane key -> deque ของ (event, future, เวลาที่รับ) ที่ยังไม่ได้รัน
+        self._stats = {}
+        self._total = 0
+
+    def submit(self, event):
+        """ส่ง event เข้า lane ของผู้ใช้ คืน Future ที่เสร็จเมื่อ processor ทำงานจบ."""
+        self._pending.acquire()
+        future = Future()
+        key = event_lane_key(event)
+        with self._lock:
+            lane = self._lanes.get(key)
+            start_lane = lane is None
+            if start_lane:
+                lane = self._lanes[key] = deque()
+            lane.append((event, future, time.perf_counter()))
+        if start_lane:
+            self._executor.submit(self._run_next, key)
+        return future
+
+    def dispatch_all(self, events, timeout=None):
+        """ประมวลผลทุก event ใน payload แล้วรอจนเสร็จ ถ้ามี event ที่ล้มเหลวจะ raise error ตัวแรก."""
+        futures = [self.submit(event) for event in events]
+        errors = [future.exception(timeout) for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def _run_next(self, key):
+        # รันทีละหนึ่ง event แล้วค่อยส่ง lane กลับเข้า executor ใหม่
+        # เพื่อให้ lane ที่มี event ค้างเยอะไม่ยึด thread ไว้จนผู้ใช้อื่นต้องรอ
+        with self._lock:
+            event, future, received_at = self._lanes[key].popleft()
+
+        started = time.perf_counter()
+        error = None
+        try:
+            self.processor(event)
+        except Exception as e:
+            error = e
+            log.error(f"Error handling {event_type_name(event)} event: {e}")
+        finished = time.perf_counter()
+        self._record(event_type_name(event), started - received_at, finished - started, error is not None)
+
+        with self._lock:
+            lane = self._lanes[key]
+            if not lane:
+                del self._lanes[key]
+        if lane:
+            self._executor.submit(self._run_next, key)
+
+        self._pending.release()
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
+    def _record(self, event_type, wait_seconds, handle_seconds, failed):
+        with self._lock:
+            stats = self._stats.setdefault(event_type, _LatencyStats())
+            stats.count += 1
+            stats.failed += int(failed)
+            stats.wait_total += wait_seconds
+            stats.handle_total += handle_seconds
+            stats.handle_max = max(stats.handle_max, handle_seconds)
+            self._total += 1
+            should_log = self.stats_log_every and self._total % self.stats_log_every == 0
+        if should_log:
+            log.info(f"Event dispatch stats: {self.stats()}")
+
+    def stats(self):
+        """latency ต่อประเภท event (ms): เวลารอใน lane และเวลาประมวลผล."""
+        with self._lock:
+            stats = {
+                event_type: {
+                    'count': s.count,
+                    'failed': s.failed,
+                    'avg_wait_ms': round(s.wait_total / s.count * 1000, 2),
+                    'avg_handle_ms': round(s.handle_total / s.count * 1000, 2),
+                    'max_handle_ms': round(s.handle_max * 1000, 2),
+                }
+                for event_type, s in self._stats.items()
+            }
+            stats['active_lanes'] = len(self._lanes)
+        return stats
@@ -0,0 +1,224 @@
+# ----------------------------------------------------------------------
+# โหมด Asynchronous: ตอบ LINE ทันทีแล้วประมวลผล Event ใน background
+# ----------------------------------------------------------------------
+# main(request) จะตรวจ signature แล้วนำ event ใส่คิว (มีขนาดจำกัด) และตอบ 200 ทันที
+# worker threads จะดึง event จากคิวไปเรียก handle_text_message / handle_image_message
+# event ที่ซ้ำ (ตรวจจาก webhookEventId) จะถูกข้าม
+#
+# หมายเหตุ: บน Cloud Functions รุ่นแรก CPU จะถูกจำกัดหลังตอบ response แล้ว
+# โหมดนี้จึงเหมาะกับ Cloud Functions gen2/Cloud Run ที่เปิด CPU always allocated
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from linebot.models import MessageEvent
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+# นโยบายเมื่อคิวเต็ม
+FULL_POLICY_REJECT = 'reject' # ปฏิเสธ (main ตอบ 503 ให้ LINE ส่งซ้ำภายหลัง)
+FULL_POLICY_INLINE = 'inline' # ประมวลผลใน thread ของ request เลย (กลับไปทำงานแบบเดิม ใช้ไม่ได้เมื่อ ordered)
+FULL_POLICY_BLOCK = 'block' # รอให้คิวว่างภายในเวลาที่กำหนด ถ้ายังเต็มจึงปฏิเสธ
+FULL_POLICIES = (FULL_POLICY_REJECT, FULL_POLICY_INLINE, FULL_POLICY_BLOCK)
+
+# Collection สำหรับตรวจ event ซ้ำข้าม instance (ทุก event ที่มี webhookEventId ต้องมี marker
+# ตั้งแต่การส่งครั้งแรก ไม่เช่นนั้น event ที่ LINE ส่งซ้ำไปยัง instance อื่นจะไม่ถูกตรวจพบ)
+WEBHOOK_EVENTS_COLLECTION = 'webhook_events'
+
+
+def find_event_handler(handler, event):
+    """หา function ที่ลงทะเบียนไว้กับ WebhookHandler สำหรับ event นี้ (ลำดับเดียวกับ handler.handle)."""
+    func = None
+    if isinstance(event, MessageEvent):
+        func = handler._handlers.get(f"{event.__class__.__name__}_{event.message.__class__.__name__}")
+    if func is None:
+        func = handler._handlers.get(event.__class__.__name__)
+    return func or handler._default
+
+
+def dispatch_event(handler, event):
+    func = find_event_handler(handler, event)
+    if func is None:
+        log.warning(f"No handler for event type {event.__class__.__name__}")
+        return
+    func(event)
+
+
+def event_id(event):
+    return getattr(event, 'webhook_event_id', None)
+
+
+def is_redelivery(event):
+    context = getattr(event, 'delivery_context', None)
+    return bool(getattr(context, 'is_redelivery', False))
+
+
+class InProcessQueueBackend:
+    """คิวในหน่วยความจำของ process (ค่าเริ่มต้น) backend อื่นต้องมี put/get/qsize แบบเดียวกัน."""
+
+    def __init__(self, maxsize):
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, item, block=False, timeout=None):
+        """คืน True ถ้าใส่คิวได้ และ False ถ้าคิวเต็ม."""
+        try:
+            self._queue.put(item, block=block, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def get(self, timeout=None):
+        """คืน item ถัดไป หรือ None ถ้าไม่มีภายในเวลาที่กำหนด."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+class EventDeduplicator:
+    """จำ webhookEventId ที่เคยรับไว้ช่วงเวลาหนึ่ง เพื่อไม่ให้ประมวลผล event เดิมซ้ำ."""
+
+    def __init__(self, ttl_seconds=600, max_entries=10000, db_getter=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._db_getter = db_getter
+        self._lock = threading.Lock()
+        self._seen = OrderedDict() # webhookEventId -> เวลาที่รับ
+
+    def _seen_in_process(self, key):
+        now = time.time()
+        with self._lock:
+            while self._seen and next(iter(self._seen.values())) < now - self.ttl_seconds:
+                self._seen.popitem(last=False)
+            if key in self._seen:
+                return True
+            self._seen[key] = now
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return False
+
+    def _seen_in_firestore(self, key):
+        # LINE ส่งซ้ำได้ไปยัง instance อื่น จึงใช้ create() ซึ่งล้มเหลวถ้ามี document อยู่แล้ว
+        db = self._db_getter() if self._db_getter else None
+        if db is None:
+            return False
+        try:
+            db.collection(WEBHOOK_EVENTS_COLLECTION).document(key).create({'received_at': time.time()})
+            return False
+        except Exception as e:
+            if e.__class__.__name__ in ('AlreadyExists', 'Conflict'):
+                return True
+            log.error(f"Error checking webhook event {key}: {e}")
+            return False
+
+    def is_duplicate(self, event):
+        key = event_id(event)
+        if key is None:
+            return False
+        if self._seen_in_process(key):
+            return True
+        return self._seen_in_firestore(key)
+
+    def forget(self, event):
+        """ลืม event ที่ถูกปฏิเสธ เพื่อให้รับได้อีกครั้งเมื่อ LINE ส่งซ้ำ."""
+        key = event_id(event)
+        if key is None:
+            return
+        with self._lock:
+            self._seen.pop(key, None)
+        db = self._db_getter() if self._db_getter else None
+        if db is not None:
+            try:
+                db.collection(WEBHOOK_EVENTS_COLLECTION).document(key).delete()
+            except Exception as e:
+                log.error(f"Error releasing webhook event {key}: {e}")
+
+
+class WebhookEventQueue:
+    """รับ event จาก main(request) แล้วให้ worker threads ประมวลผลผ่าน processor(event).
+
+    processor อาจคืน Future (เช่น UserOrderedDispatcher.submit) ซึ่งจะถูกนับเป็น processed/failed เมื่อเสร็จ
+    ordered=True: event ต้องออกจากคิวตามลำดับเสมอ นโยบาย inline (ซึ่งให้ event แซงคิว) จึงถูกแทนด้วย block
+    """
+
+    def __init__(self, processor, backend=None, workers=4, max_queue=256, full_policy=FULL_POLICY_INLINE,
+                 put_timeout=2.0, deduplicator=None, ordered=False):
+        if full_policy not in FULL_POLICIES:
+            raise ValueError(f"Unknown queue-full policy: {full_policy}")
+        if ordered and full_policy == FULL_POLICY_INLINE:
+            log.warning("Queue-full policy 'inline' would reorder events of the same user; using 'block' instead")
+            full_policy = FULL_POLICY_BLOCK
+        self.processor = processor
+        self.backend = backend or InProcessQueueBackend(max_queue)
+        self.full_policy = full_policy
+        self.put_timeout = put_timeout
+        self.deduplicator = deduplicator or EventDeduplicator()
+
+        self._lock = threading.Lock()
+        self._counters = {'enqueued': 0, 'duplicates': 0, 'inline': 0, 'rejected': 0, 'processed': 0, 'failed': 0}
+        for i in range(workers):
+            threading.Thread(target=self._work_forever, name=f"webhook-worker-{i}", daemon=True).start()
+        log.info(f"Webhook event queue started: workers={workers}, max_queue={max_queue}, full_policy={full_policy}")
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def submit(self, events):
+        """ใส่ event ลงคิว คืน False ถ้ามี event ที่ถูกปฏิเสธเพราะคิวเต็ม (ควรตอบ 503)."""
+        accepted = True
+        for event in events:
+            if self.deduplicator.is_duplicate(event):
+                self._count('duplicates')
+                log.info(f"Skipping duplicate webhook event {event_id(event)} (redelivery={is_redelivery(event)})")
+                continue
+
+            block = self.full_policy == FULL_POLICY_BLOCK
+            if self.backend.put(event, block=block, timeout=self.put_timeout if block else None):
+                self._count('enqueued')
+            elif self.full_policy == FULL_POLICY_INLINE:
+                self._count('inline')
+                self._process(event)
+            else:
+                self._count('rejected')
+                self.deduplicator.forget(event)
+                accepted = False
+        return accepted
+
+    def _finished(self, event, error):
+        if error is None:
+            self._count('processed')
+        else:
+            self._count('failed')
+            log.error(f"Error handling webhook event {event_id(event)}: {error}")
+
+    def _process(self, event):
+        try:
+            result = self.processor(event)
+        except Exception as e:
+            self._finished(event, e)
+            return
+        if isinstance(result, Future):
+            # processor ส่งต่อให้ผู้อื่นทำ: นับผลเมื่อ handler ทำงานจบจริง
+            result.add_done_callback(lambda future: self._finished(event, future.exception()))
+        else:
+            self._finished(event, None)
+
+    def _work_forever(self):
+        while True:
+            event = self.backend.get(timeout=1.0)
+            if event is not None:
+                self._process(event)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['queued'] = self.backend.qsize()
+        return stats